@@ -2,11 +2,17 @@
 with all the essential views"""
 
 import os
+import shutil
+import tempfile
 import time 
+import zipfile
+from contextlib import ExitStack
 from datetime import datetime
 
-from flask import Flask, jsonify, request,json, send_file
-from models import db, Student, Administrator, Group, Assignment, Submission, TestCase
+from flask import Flask, jsonify, request,json, send_file, Response, stream_with_context
+from sqlalchemy import or_
+from models import db, Student, Administrator, Group, Assignment, Submission, TestCase, \
+                   SubmissionFile, Fingerprint
 
 # JWT Imports
 from flask_jwt_extended import (
@@ -17,12 +23,23 @@ from flask_jwt_extended import (
 from serializers import serializers_bp, student_schema, students_schema, \
                         admin_schema, admins_schema,assignment_schema, \
                         assignments_schema,group_schema,groups_schema, \
-                        submissions_schema,submission_schema
+                        submissions_schema,submission_schema,submission_files_schema
 from serializers import test_caseSchema,test_casesSchema
 
 # Helper Function
-from utils import get_user, admin_required, student_required
-from utils import run_test
+from utils import get_user, admin_required, student_required, token_in_query_string
+from utils import summarize_results, get_results, get_current_results, paginate_submissions, \
+                  save_submission
+from utils import validate_grade, bulk_grade
+from grading import grading_queue, regrader, QueueFull, AlreadyRunning
+from events import event_broker, Stream
+from metrics import metrics
+from database import configure_database, retry_on_lock
+from roster import import_roster, RosterError
+from runners import get_runner
+from storage import get_store
+from gradebook import gradebook_query, export_gradebook, GRADEBOOK_FORMATS
+from similarity import similar_pairs
 from test_routes import bp as test_routes_bp
 
 
@@ -44,6 +61,107 @@ app.config['PROJECT_PATH']=os.path.abspath(os.path.dirname(__name__))
 app.config['SUBMISSIONS_FOLDER']=os.path.join(app.config["PROJECT_PATH"], "submissions")
 db.init_app(app) 
 
+# SQLite Concurrency. WAL lets listings read while grading workers write
+app.config['SQLITE_JOURNAL_MODE']='WAL'
+app.config['SQLITE_SYNCHRONOUS']='NORMAL'
+app.config['SQLITE_BUSY_TIMEOUT']=5000      # Milliseconds a writer waits for the lock
+app.config['SQLITE_CACHE_SIZE']=-16000      # KiB per connection
+app.config['SQLITE_FOREIGN_KEYS']=True
+app.config['DATABASE_POOL_SIZE']=10         # Shared by request, grading and re-grading threads
+app.config['DATABASE_MAX_OVERFLOW']=10
+app.config['DATABASE_LOCK_RETRIES']=5       # Write transactions retried when still locked
+app.config['DATABASE_LOCK_RETRY_DELAY']=0.05
+configure_database(app)
+
+# Submission Listing
+app.config['SUBMISSIONS_PAGE_SIZE']=50
+app.config['SUBMISSIONS_MAX_PAGE_SIZE']=200
+
+# Background Grading
+app.config['GRADING_WORKERS']=4
+app.config['GRADING_QUEUE_SIZE']=500
+grading_queue.init_app(app)
+
+# Re-grading of all the submissions of an assignment
+app.config['REGRADE_WORKERS']=2
+app.config['REGRADE_BATCH_SIZE']=20
+app.config['REGRADE_THROTTLE']=0     # Seconds to pause after every submission
+regrader.init_app(app)
+
+# Live grading events, sent to students as Server-Sent Events
+app.config['EVENT_STREAMS_KEPT']=1000   # Submissions whose events are remembered
+app.config['EVENT_KEEPALIVE']=15        # Seconds between keep-alive comments
+event_broker.init_app(app)
+
+# Prometheus metrics on /metrics, only served to scrapers sending the token
+# as 'Authorization: Bearer <token>'. Not served when it is not set
+app.config['METRICS_TOKEN']=os.environ.get("CODEBENCH_METRICS_TOKEN")
+metrics.init_app(app)
+metrics.gauge("codebench_grading_queue_depth", "Submissions waiting to be graded",
+              lambda: grading_queue.pending - grading_queue.active)
+metrics.gauge("codebench_grading_active", "Submissions being graded",
+              lambda: grading_queue.active)
+
+# Test Case Execution
+app.config['PARALLEL_TEST_CASES']=True   # Run the test cases of a submission side by side
+app.config['TEST_CASE_CONCURRENCY']=os.cpu_count()  # Test cases running at once on this host
+# 'subprocess' starts a new interpreter per test case, 'zygote' forks every
+# test case from an interpreter that already loaded the submission
+app.config['GRADING_RUNNER']='zygote'
+
+# Limits of every process running a submission. SUBMISSION_TIME_LIMIT is used
+# for assignments without a time limit of their own
+app.config['SUBMISSION_TIME_LIMIT']=10                   # Seconds
+app.config['SUBMISSION_MEMORY_LIMIT']=512 * 1024 * 1024  # Bytes of address space
+app.config['SUBMISSION_OUTPUT_LIMIT']=8 * 1024 * 1024    # Bytes, unless set per assignment
+app.config['OUTPUT_PREVIEW_LENGTH']=4096                 # Bytes of output stored per test case
+# Submissions run as this user (name or uid) when set, which needs the grader to
+# run as root. Only then are they limited to SUBMISSION_PROCESS_LIMIT processes,
+# shared by all the submissions running at once. The user must be able to run
+# the builds in BUILD_CACHE_FOLDER, and read Python submissions when they don't
+# run on the 'zygote' runner
+app.config['SUBMISSION_USER']=os.environ.get("CODEBENCH_SUBMISSION_USER")
+app.config['SUBMISSION_PROCESS_LIMIT']=64
+
+# Grading results of identical source code and test suites are reused
+app.config['RESULT_CACHE_FOLDER']=os.path.join(app.config["PROJECT_PATH"], "result_cache")
+app.config['RESULT_CACHE_MAX_ENTRIES']=10000
+app.config['RESULT_CACHE_MAX_BYTES']=256 * 1024 * 1024
+
+# Compiled languages are built once per distinct source file
+app.config['BUILD_CACHE_FOLDER']=os.path.join(app.config["PROJECT_PATH"], "build_cache")
+app.config['BUILD_CACHE_MAX_ENTRIES']=1000
+app.config['COMPILE_TIME_LIMIT']=30     # Seconds
+
+# Test case inputs and outputs larger than the inline limit are stored in files
+# and streamed to the submissions. Only a preview of them is kept in the database
+app.config['TESTCASES_FOLDER']=os.path.join(app.config["PROJECT_PATH"], "testcases")
+app.config['TESTCASE_INLINE_LIMIT']=64 * 1024          # Bytes
+app.config['TESTCASE_PREVIEW_LENGTH']=1024             # Bytes
+app.config['TESTCASE_MAX_SIZE']=256 * 1024 * 1024      # Bytes per file in an uploaded archive
+
+# Linting runs on worker processes that keep pylint loaded
+app.config['LINTER_WORKERS']=2
+app.config['LINTER_TIMEOUT']=60     # Seconds a file may take to lint
+
+# Roster Import. Passwords are hashed on a pool of threads
+app.config['ROSTER_BATCH_SIZE']=500
+app.config['ROSTER_HASH_WORKERS']=os.cpu_count()
+
+# Similarity detection. Submitted files are fingerprinted by winnowing hashes
+# of K consecutive tokens, every run of K + WINDOW - 1 tokens is detected
+app.config['SIMILARITY_K']=6
+app.config['SIMILARITY_WINDOW']=5
+app.config['SIMILARITY_MAX_SOURCE_SIZE']=1024 * 1024   # Bytes, larger files are not indexed
+app.config['SIMILARITY_MIN_SHARED']=5                   # Fingerprints a reported pair shares
+app.config['SIMILARITY_COMMON_FRACTION']=0.5            # Fingerprints in more submissions are ignored
+
+# Manual grading of many submissions in a single request
+app.config['BULK_GRADE_MAX_ITEMS']=1000
+
+# Gradebook exports are read from the database and sent in batches of rows
+app.config['GRADEBOOK_BATCH_SIZE']=500
+
 # JWT for Authentication
 jwt = JWTManager(app)
 
@@ -126,11 +244,29 @@ def get_student_assignments():
 @jwt_required
 @student_required
 def get_student_submissions():
-    """Returns the submissions of the currently logged in student"""
+    """Returns a page of the submissions of the currently logged in student.
+    See paginate_submissions for the accepted filters. The cursor of the next
+    page is sent in the X-Next-Cursor header"""
 
     student_data = get_user(get_jwt_identity())
-    student_submissions = student_data.submissions
-    return jsonify(submissions_schema.dump(student_submissions))
+    query = Submission.query.filter(Submission.student_id == student_data.id)
+
+    try:
+        student_submissions, next_cursor = paginate_submissions(query, request.args)
+    except ValueError as error:
+        return jsonify(status="error", message=str(error)), 400
+
+    return submissions_page(student_submissions, next_cursor)
+
+
+def submissions_page(submissions, next_cursor):
+    """Response of a page of submissions, the list of submissions as before
+    the listings were paginated"""
+
+    response = jsonify(submissions_schema.dump(submissions))
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
 
 
 @app.route("/student/submissions/<submission_id>",methods=['GET'])
@@ -163,37 +299,119 @@ def make_submission(assignment_id):
 
     elif assignment_data.group != student_data.group:
         return jsonify(status="error", message="Access Denied")
-    submission_object = Submission.query.filter_by(student=student_data).filter_by(assignment=assignment_data).first()
-    if not submission_object: 
-        # Create Submission
-        new_submission_object = Submission(student_data, assignment_data)
-        db.session.add(new_submission_object)
-        db.session.commit()
-    else:
-        submission_object.update_for_new_submission()
-        new_submission_object=submission_object
-        db.session.commit()
-
-    #new_submission_object = Submission(student_data, assignment_data)  # Create Submission
-    # We save the object so that we get an id to generate the filename
-    #db.session.commit() 
 
     source_code_object = request.files["source_code"] # From submitted form
 
-    # Make use of a utility function we defined in models.py
-    file_path = new_submission_object.get_submission_filename()
+    # The language is picked by the extension of the uploaded file
+    filename = source_code_object.filename or ""
+    if get_runner(filename) is None:
+        return jsonify(status="error", message="Unsupported Language")
+    extension = os.path.splitext(filename)[1].lower()
+
+    # The submission is only stored once there is room to grade it
+    try:
+        grading_queue.reserve()
+    except QueueFull:
+        return jsonify(status="error", message="Too many submissions are being graded. Try again later")
+
+    try:
+        # Save the file by its content first, so the Submission never points at a
+        # missing file. Identical files are stored once
+        digest, size = get_store("SUBMISSIONS_FOLDER").put(source_code_object.stream,
+                                                           suffix=extension)
+
+        # Create the Submission, or mark the existing one as resubmitted. The
+        # previous files are kept
+        new_submission_object = save_submission(student_data, assignment_data, extension[1:],
+                                                digest, size)
+    except Exception:
+        grading_queue.release()
+        raise
+
+    # Grade the submission in the background. Its progress can be followed
+    # through the status view of the submission
+    job_id = grading_queue.submit(new_submission_object.id,
+                                  new_submission_object.source_digest, reserved=True)
+
+    return jsonify(status="queued", job_id=job_id)
+
+
+@app.route("/student/submissions/<submission_id>/status",methods=['GET'])
+@jwt_required
+@student_required
+def submission_status(submission_id):
+    """Returns the grading status of a submission of the currently logged in student
+    along with its results once it has been graded"""
+
+    student_data = get_user(get_jwt_identity())
+
+    submission_data = Submission.query.filter_by(id=submission_id).first()
+
+    if submission_data is None:
+        return jsonify(status="failed", description="Submission does not exist")
+    if submission_data.student != student_data:
+        return jsonify(status="failed", description="Access Denied")
+
+    job = grading_queue.status(submission_data.id)
+    if job is None:
+        # Graded before the application was (re)started
+        results = get_current_results(submission_data)
+        if results is None:
+            return jsonify(status="failed", description="Submission has not been queued for grading")
+
+        job = {"status": "done", "results": summarize_results(results)}
+
+    return jsonify(job_id=submission_data.id, status=job["status"], results=job["results"])
+
+
+@app.route("/student/submissions/<submission_id>/events",methods=['GET'])
+@token_in_query_string
+@jwt_required
+@student_required
+def submission_events(submission_id):
+    """Streams the grading of a submission of the currently logged in student as
+    Server-Sent Events: 'queued', 'running', a 'test_case' per finished test
+    case and finally 'done' with the results or 'failed'. Clients reconnecting
+    with Last-Event-ID only get the events they missed. A browser's EventSource
+    can't send the Authorization header, so it passes the token as ?token="""
+
+    student_data = get_user(get_jwt_identity())
+
+    submission_data = Submission.query.filter_by(id=submission_id).first()
+
+    if submission_data is None:
+        return jsonify(status="failed", description="Submission does not exist")
+    if submission_data.student != student_data:
+        return jsonify(status="failed", description="Access Denied")
 
-    # Save the file
-    source_code_object.save(file_path)
+    stream = event_broker.get(submission_data.id)
+    if stream is None:
+        # Graded before the application was (re)started
+        results = get_current_results(submission_data)
+        if results is None:
+            return jsonify(status="failed", description="Submission has not been queued for grading")
+        stream = Stream()
+        stream.publish("done", summarize_results(results))
+        stream.close()
 
     try:
-        execution_results = run_test(new_submission_object, assignment_data)
-    except:
-        # Revert Database Change
-        source_code_object.delete()
-        raise       # Reraise error
+        start = int(request.headers.get("Last-Event-ID", -1)) + 1
+    except ValueError:
+        start = 0
+    keepalive = app.config['EVENT_KEEPALIVE']
+
+    # Only reads the stream, so the request's database session isn't held
+    # while the events are sent
+    def send_events():
+        for event in stream.follow(start, keepalive):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                event_id, name, data = event
+                yield "id: {}\nevent: {}\ndata: {}\n\n".format(event_id, name, json.dumps(data))
 
-    return jsonify(execution_results)
+    return Response(send_events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.route('/student/submissions/<submission_id>/results',methods=['GET'])
@@ -212,9 +430,11 @@ def student_submission_results(submission_id):
     if submission_data.student != student_data or not submission_data.graded:
         return jsonify(status="Failed", message="Access Denied")
 
-    submission_results_path = submission_data.get_submission_result_path()
+    results = get_results(submission_data)
+    if results is None:
+        return jsonify(status="Failed", message="Submission has not been graded yet")
 
-    return send_file(submission_results_path)
+    return jsonify(results)
 
 # --------------------------------------------
 #           Admin Routes
@@ -245,6 +465,32 @@ def get_groups():
     return jsonify(groups_schema.dump(groups_data))
 
 
+@app.route("/admin/groups/<group_id>/roster", methods=['POST'])
+@jwt_required
+@admin_required
+def import_group_roster(group_id):
+    """Creates or updates the Students of the Group from an uploaded CSV roster.
+    Rows that can't be imported are returned along with the reason"""
+
+    admin_data = get_user(get_jwt_identity())
+    group_data = Group.query.get(group_id)
+
+    if group_data is None or group_data.administrator != admin_data:
+        return jsonify(status="error", message="Access Denied")
+
+    roster_file = request.files.get("roster")
+    if roster_file is None:
+        return jsonify(status="error", message="No Roster Uploaded")
+
+    try:
+        report = import_roster(group_data, roster_file.stream,
+                               batch_size=app.config['ROSTER_BATCH_SIZE'])
+    except RosterError as error:
+        return jsonify(status="error", message=str(error))
+
+    return jsonify(status="success", **report)
+
+
 @app.route("/admin/groups/<group_id>/assignments", methods=['GET'])
 @jwt_required
 @admin_required  
@@ -266,6 +512,35 @@ def get_assignments(group_id):
     return jsonify(assignments_schema.dump(group_data.assignments))
 
 
+@app.route("/admin/groups/<group_id>/gradebook", methods=['GET'])
+@jwt_required
+@admin_required
+def group_gradebook(group_id):
+    """Exports the grades of every Student of the Group in all of its Assignments.
+    ?format=csv (default) or ndjson"""
+
+    admin_data = get_user(get_jwt_identity())
+    group_data = Group.query.get(group_id)
+
+    if group_data is None or group_data.administrator != admin_data:
+        return jsonify(status="error", message="Access Denied")
+
+    return send_gradebook(gradebook_query(group_data.id), "group-{}".format(group_data.id))
+
+
+def send_gradebook(query, name):
+    """Streams the gradebook of query in the format requested"""
+
+    export_format = request.args.get("format", "csv")
+    if export_format not in GRADEBOOK_FORMATS:
+        return jsonify(status="error", message="Unsupported Format")
+
+    chunks = export_gradebook(query, export_format, app.config['GRADEBOOK_BATCH_SIZE'])
+    filename = "gradebook-{}.{}".format(name, export_format)
+    return Response(stream_with_context(chunks), mimetype=GRADEBOOK_FORMATS[export_format],
+                    headers={"Content-Disposition": "attachment; filename=" + filename})
+
+
 @app.route("/admin/assignments/<assignment_id>", methods=['GET'])
 @jwt_required
 @admin_required  
@@ -290,24 +565,104 @@ def get_assignment(assignment_id):
 @jwt_required
 @admin_required 
 def admin_assigments(assignment_id):
-    """Returns submissions for the Assignment specified by id"""
+    """Returns a page of the submissions for the Assignment specified by id.
+    See paginate_submissions for the accepted filters. The cursor of the next
+    page is sent in the X-Next-Cursor header"""
+
+    admin_data = get_user(get_jwt_identity())
 
     admin_assigment=Assignment.query.filter_by(id=assignment_id).first()
-    data=admin_assigment.submissions
+    if admin_assigment is None:
+        return jsonify(status="error", message="No such Assignment")
+
+    if admin_assigment.group.administrator != admin_data:
+        return jsonify(status="error", message="Access Denied")
+
+    query = Submission.query.filter(Submission.assignment_id == admin_assigment.id)
+
+    try:
+        data, next_cursor = paginate_submissions(query, request.args)
+    except ValueError as error:
+        return jsonify(status="error", message=str(error)), 400
+
+    return submissions_page(data, next_cursor)
+
+
+@app.route("/admin/assignments/<assignment_id>/gradebook",methods=['GET'])
+@jwt_required
+@admin_required
+def assignment_gradebook(assignment_id):
+    """Exports the grades of every Student of the Group in the Assignment.
+    ?format=csv (default) or ndjson"""
+
+    admin_data = get_user(get_jwt_identity())
+    assignment_data = Assignment.query.get(assignment_id)
+
+    if assignment_data is None or assignment_data.group.administrator != admin_data:
+        return jsonify(status="error", message="Access Denied")
+
+    return send_gradebook(gradebook_query(assignment_data.group_id, assignment_data.id),
+                          "assignment-{}".format(assignment_data.id))
+
+
+@app.route("/admin/assignments/<assignment_id>/similarity",methods=['GET'])
+@jwt_required
+@admin_required
+def assignment_similarity(assignment_id):
+    """Returns the most similar pairs of submissions of the Assignment, ?limit=20"""
+
+    admin_data = get_user(get_jwt_identity())
+    assignment_data = Assignment.query.get(assignment_id)
+
+    if assignment_data is None or assignment_data.group.administrator != admin_data:
+        return jsonify(status="error", message="Access Denied")
+
+    try:
+        limit = int(request.args.get("limit", 20))
+    except ValueError:
+        return jsonify(status="error", message="Invalid Limit")
+    if not 0 < limit <= 1000:
+        return jsonify(status="error", message="Invalid Limit")
 
-    return jsonify(submissions_schema.dump(data))
+    pairs = similar_pairs(assignment_data, limit,
+                          min_shared=app.config['SIMILARITY_MIN_SHARED'],
+                          common_fraction=app.config['SIMILARITY_COMMON_FRACTION'])
+    return jsonify(status="success", pairs=pairs)
 
 
 @app.route("/admin/assignments/new",methods=['POST'])
 @jwt_required
 @admin_required 
 def create_assignment():
+    # Get Assignment Data. Large test cases are uploaded as a zip archive, in
+    # which case the assignment is sent as JSON in the 'assignment' form field
+    with ExitStack() as stack:
+        archive = None
+        if "test_cases" in request.files:
+            try:
+                assignment_data = json.loads(request.form["assignment"])
+                # Copied, as zipfile can't read from a spooled upload before Python 3.11
+                archive_file = stack.enter_context(tempfile.TemporaryFile())
+                shutil.copyfileobj(request.files["test_cases"].stream, archive_file)
+                archive = stack.enter_context(zipfile.ZipFile(archive_file))
+            except (KeyError, ValueError, zipfile.BadZipFile):
+                return jsonify(status="Error", description="Invalid Test Case Archive")
+        else:
+            assignment_data = request.get_json()
+
+        # The upload can only be read once, so it is read before add_assignment,
+        # which runs again when the database is locked
+        return add_assignment(assignment_data, archive)
+
+
+@retry_on_lock
+def add_assignment(assignment_data, archive):
+    """Creates the Assignment described by assignment_data, reading the test cases
+    given by file name from archive"""
+
     # Get Administrator Data. Needed to verify Group Permission
     admin_data = get_user(get_jwt_identity())
 
-    # Get Assignment Data
-    assignment_data = request.get_json()
-
     # Convert the Given ISO DataTime to Python DateTime object
     try:
         py_deadline = datetime(*time.strptime(assignment_data['deadline'] , "%Y-%m-%dT%H:%M")[:6])
@@ -323,35 +678,119 @@ def create_assignment():
 
     linting_percentage = assignment_data.get("linting") or 0
     time_limit = assignment_data.get("time_limit") or 0
+    output_limit = assignment_data.get("output_limit") or 0
 
     if (linting_percentage > 100) or (linting_percentage < 0):
         return jsonify(status="Error", description="Invalid Linting Percentage")
 
+    if not isinstance(output_limit, int) or output_limit < 0:
+        return jsonify(status="Error", description="Invalid Output Limit")
+
     # Create New Assignment
     new_assignment = Assignment(title=assignment_data['title'], 
                                 group=assignment_group,
                                 deadline = py_deadline,
                                 linting = linting_percentage,
-                                time_limit = time_limit)
+                                time_limit = time_limit,
+                                output_limit = output_limit)
+
+    # Every test case is checked before any of them is stored
+    try:
+        for test_case in assignment_data['test_cases']:
+            if "visible" not in test_case:
+                raise KeyError("visible")
+            for part in ("input", "output"):
+                check_test_case_part(archive, test_case, part)
+    except (KeyError, TypeError, ValueError):
+        return jsonify(status="Error", description="Invalid Test Case Archive")
 
     # List used to store test_cases temporarily
     # so they are not destructed beforing database commit
     test_cases = []
-    for test_case in assignment_data['test_cases']:
-        new_test_case = TestCase(assignment=new_assignment, # Link to the Assignment
-                                exp_input=test_case["input"],
-                                exp_output=test_case["output"],
-                                 visible=test_case["visible"])
-        test_cases.append(test_case)
-
-    # Save all the changes
-    db.session.commit()
+    try:
+        for test_case in assignment_data['test_cases']:
+            # Either given inline as "input"/"output" or as the names of files in
+            # the archive as "input_file"/"output_file"
+            with ExitStack() as stack:
+                exp_input, exp_output = [open_test_case_part(stack, archive, test_case, part)
+                                         for part in ("input", "output")]
+                new_test_case = TestCase(assignment=new_assignment, # Link to the Assignment
+                                         exp_input=None,
+                                         exp_output=None,
+                                         visible=test_case["visible"])
+                test_cases.append(new_test_case)
+                # Stored once it is in test_cases, so a failure can discard its files
+                new_test_case.set_content(exp_input, exp_output)
+
+        # Save all the changes
+        db.session.commit()
+    except Exception as error:
+        db.session.rollback()
+        discard_test_case_files(test_cases)
+        if isinstance(error, zipfile.BadZipFile):
+            return jsonify(status="Error", description="Invalid Test Case Archive")
+        raise
     return jsonify(status="success", message="Assignment Created")
 
 
+def check_test_case_part(archive, test_case, part):
+    """Returns the archive member holding the input or output of test_case, or
+    None if it is given inline. Raises KeyError if it is missing and ValueError
+    if the file is too large"""
+
+    if archive is None or part + "_file" not in test_case:
+        if part not in test_case:
+            raise KeyError(part)
+        return None
+
+    member = archive.getinfo(test_case[part + "_file"])
+    if member.file_size > app.config['TESTCASE_MAX_SIZE']:
+        raise ValueError("{} is too large".format(member.filename))
+    return member
+
+
+def open_test_case_part(stack, archive, test_case, part):
+    """Returns the input or output of test_case, opening it from archive when it
+    is given by file name"""
+
+    member = check_test_case_part(archive, test_case, part)
+    if member is None:
+        return test_case[part]
+    return stack.enter_context(archive.open(member))
+
+
+def discard_test_case_files(test_cases):
+    """Deletes the files stored for the test_cases of a failed request, unless
+    another TestCase refers to them"""
+
+    remove_unused_test_case_files(get_test_case_files(test_cases))
+
+
+def get_test_case_files(test_cases):
+    """Returns the digests of the files storing the parts of test_cases"""
+
+    return {digest for test_case in test_cases
+            for digest in (test_case.input_file, test_case.output_file) if digest}
+
+
+def remove_unused_test_case_files(digests):
+    """Deletes the stored test case files of digests no TestCase refers to"""
+
+    if not digests:
+        return
+
+    used = {digest for row in db.session.query(TestCase.input_file, TestCase.output_file)
+            .filter(or_(TestCase.input_file.in_(digests), TestCase.output_file.in_(digests)))
+            for digest in row}
+    store = get_store("TESTCASES_FOLDER")
+    for digest in digests - used:
+        store.remove(digest)
+
+
 @app.route("/admin/assignment/delete/<assignment_id>",methods=['POST'])
 @jwt_required
 @admin_required  
+@retry_on_lock
 def delete_assignment(assignment_id):
     """Delete The Assignment specified by assignment_id"""
 
@@ -372,6 +811,7 @@ def delete_assignment(assignment_id):
             "message": "Access Denied"
         }
 
+    Fingerprint.query.filter_by(assignment_id=assignment_data.id).delete()
     db.session.delete(assignment_data)
     db.session.commit()
     return jsonify({"status": "succes",
@@ -380,6 +820,7 @@ def delete_assignment(assignment_id):
 @app.route("/admin/assignment/edit/<assignment_id>",methods=['POST'])
 @jwt_required
 @admin_required
+@retry_on_lock
 def edit_assignment(assignment_id):
     
     req=request.get_json()
@@ -394,18 +835,59 @@ def edit_assignment(assignment_id):
     #edited the time
     data_assingments.deadline=datetime(*time.strptime(req['deadline'] ,"%Y-%m-%d %H:%M")[:6])
     #query for test cases
-    test_cases=TestCase.query.filter_by(assignment_id=assignment_id)
-            
-    x=0      
-    for each in test_cases:
-            #edited each test case
-            each.expected_input= req["test_cases"][x].get("expected_input")
-            each.expected_output=req["test_cases"][x].get("expected_output" )
-            x=x+1
-    db.session.commit()
+    test_cases=TestCase.query.filter_by(assignment_id=assignment_id).all()
+    # Files of the previous contents, deleted once nothing refers to them
+    previous_files = get_test_case_files(test_cases)
+
+    try:
+        x=0
+        for each in test_cases:
+                #edited each test case. Changes its version so re-grading runs it again
+                each.set_content(req["test_cases"][x].get("expected_input"),
+                                 req["test_cases"][x].get("expected_output"))
+                x=x+1
+        db.session.commit()
+    except Exception:
+        # Read before the rollback expires them
+        new_files = get_test_case_files(test_cases) - previous_files
+        db.session.rollback()
+        remove_unused_test_case_files(new_files)
+        raise
+
+    remove_unused_test_case_files(previous_files)
     return jsonify(status="Success",message="Edited")
 
 
+@app.route("/admin/assignments/<assignment_id>/regrade",methods=['GET', 'POST'])
+@jwt_required
+@admin_required
+def regrade_assignment(assignment_id):
+    """POST re-grades every submission of the Assignment in the background,
+    e.g. after its test cases were edited. GET reports the progress"""
+
+    admin_data = get_user(get_jwt_identity())
+
+    assignment_data = Assignment.query.filter_by(id=assignment_id).first()
+    if assignment_data is None:
+        return jsonify(status="error", message="No such Assignment")
+
+    if assignment_data.group.administrator != admin_data:
+        return jsonify(status="error", message="Access Denied")
+
+    if request.method == "GET":
+        job = regrader.status(assignment_data.id)
+        if job is None:
+            return jsonify(status="error", message="Assignment has not been re-graded")
+        return jsonify(job)
+
+    try:
+        job = regrader.start(assignment_data.id)
+    except AlreadyRunning:
+        return jsonify(status="error", message="Assignment is already being re-graded")
+
+    return jsonify(job)
+
+
 @app.route('/admin/submissions/<submission_id>',methods=['GET'])
 @jwt_required
 @admin_required
@@ -422,20 +904,16 @@ def submission_details(submission_id):
 @app.route('/admin/submissions/<submission_id>/grade',methods=['POST'])
 @jwt_required
 @admin_required
+@retry_on_lock
 def grade_submission(submission_id):
 
     admin_data = get_user(get_jwt_identity())
 
     post_data = request.get_json()
     try:
-        submission_grade = int(post_data.get("submission_grade"))
-        remarks = post_data.get("remarks")
-
-    except:
-        return jsonify(status="Failed", description="Invalid Grade")
-
-    if submission_grade is None or (0 > submission_grade or submission_grade > 100):
-        return jsonify(status="Failed", description="Invalid Grade")
+        submission_grade, remarks = validate_grade(post_data or {})
+    except ValueError as error:
+        return jsonify(status="Failed", description=str(error))
 
     submission_data=Submission.query.filter_by(id=submission_id).first()
 
@@ -452,20 +930,72 @@ def grade_submission(submission_id):
 
     return jsonify(status="Success", description="Graded")
 
+@app.route('/admin/submissions/grade',methods=['POST'])
+@jwt_required
+@admin_required
+def grade_submissions():
+    """Grades many submissions at once, given as {"grades": [{"submission_id",
+    "submission_grade", "remarks"}, ...]}. Either all valid grades are saved or
+    none. Items that can't be graded are returned with the reason"""
+
+    post_data = request.get_json() or {}
+    items = post_data.get("grades")
+    if not isinstance(items, list):
+        return jsonify(status="Failed", description="No Grades Given")
+
+    if len(items) > app.config['BULK_GRADE_MAX_ITEMS']:
+        return jsonify(status="Failed", description="Too Many Grades")
+
+    graded, errors = bulk_grade(get_jwt_identity()["id"], items)
+
+    return jsonify(status="Success", graded=graded, errors=errors)
+
 @app.route('/admin/submissions/<submission_id>/file',methods=['GET'])
 @jwt_required
 @admin_required
 def submission_file(submission_id):
     
+    admin_data = get_user(get_jwt_identity())
+
     submission_data=Submission.query.filter_by(id=submission_id).first()
     if submission_data is None:
         return jsonify(status="Failed",message="Submission Does Not Exist")
 
+    if submission_data.assignment.group.administrator != admin_data:
+        return jsonify(status="Failed", message="Access Denied"), 403
+
+    # An earlier version of the file, by its id in the files view
+    version = request.args.get("version")
+    if version is not None:
+        version_file = SubmissionFile.query.filter_by(id=version,
+                                                      submission_id=submission_data.id).first()
+        if version_file is None:
+            return jsonify(status="Failed",message="Version Does Not Exist")
+        return send_file(version_file.get_path())
+
     submission_file_path = submission_data.get_submission_filename()
 
     return send_file(submission_file_path)
 
 
+@app.route('/admin/submissions/<submission_id>/files',methods=['GET'])
+@jwt_required
+@admin_required
+def submission_files(submission_id):
+    """Lists every version of the source file of a submission, oldest first"""
+
+    admin_data = get_user(get_jwt_identity())
+
+    submission_data=Submission.query.filter_by(id=submission_id).first()
+    if submission_data is None:
+        return jsonify(status="Failed",message="Submission Does Not Exist")
+
+    if submission_data.assignment.group.administrator != admin_data:
+        return jsonify(status="Failed", message="Access Denied"), 403
+
+    return jsonify(submission_files_schema.dump(submission_data.files))
+
+
 @app.route('/admin/submissions/<submission_id>/results',methods=['GET'])
 @jwt_required
 @admin_required
@@ -475,9 +1005,11 @@ def submission_results(submission_id):
     if submission_data is None:
         return jsonify(status="Failed",message="Submission Does Not Exist")
 
-    submission_results_path = submission_data.get_submission_result_path()
+    results = get_results(submission_data)
+    if results is None:
+        return jsonify(status="Failed", message="Submission has not been graded yet")
 
-    return send_file(submission_results_path)
+    return jsonify(results)
 
 @app.route('/admin/assignment/test_cases/<ass_id>',methods=['GET'])
 @jwt_required
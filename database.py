@@ -0,0 +1,128 @@
+"""Database connection settings for serving from SQLite under concurrent load
+
+By default every SQLAlchemy connection to a SQLite file uses a rollback journal,
+which blocks readers while grading workers write results and fails writers
+straight away with 'database is locked'. 'configure_database' instead:
+ - Sets the journal mode, synchronous, busy_timeout, cache_size and
+   foreign_keys pragmas on every new connection. In WAL mode readers no
+   longer wait for writers
+ - Keeps a pool of connections shared by the request and grading threads
+   rather than opening a new connection for every checkout
+
+Writers still take turns. A writer waits up to busy_timeout for the lock, and
+functions decorated with 'retry_on_lock' are run again with a growing delay
+when that is not enough.
+"""
+import random
+import sqlite3
+import time
+from functools import wraps
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+
+from models import db
+
+
+def configure_database(app):
+    """Applies the SQLite settings to the engine of app. Must be called after
+    db.init_app(app) and before the database is first used
+
+    Configured through the following app configs:
+     - SQLITE_JOURNAL_MODE: 'WAL' lets readers run alongside a writer
+     - SQLITE_SYNCHRONOUS: 'NORMAL' only syncs the WAL on checkpoints
+     - SQLITE_BUSY_TIMEOUT: Milliseconds a connection waits for a lock
+     - SQLITE_CACHE_SIZE: Page cache of every connection, negative values are KiB
+     - SQLITE_FOREIGN_KEYS: Whether SQLite enforces foreign keys, it doesn't by default
+     - DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW, DATABASE_POOL_TIMEOUT: Pool sizing
+     - DATABASE_LOCK_RETRIES, DATABASE_LOCK_RETRY_DELAY: Used by retry_on_lock
+    """
+
+    app.config.setdefault("SQLITE_JOURNAL_MODE", "WAL")
+    app.config.setdefault("SQLITE_SYNCHRONOUS", "NORMAL")
+    app.config.setdefault("SQLITE_BUSY_TIMEOUT", 5000)
+    app.config.setdefault("SQLITE_CACHE_SIZE", -16000)
+    app.config.setdefault("SQLITE_FOREIGN_KEYS", True)
+    app.config.setdefault("DATABASE_POOL_SIZE", 10)
+    app.config.setdefault("DATABASE_MAX_OVERFLOW", 10)
+    app.config.setdefault("DATABASE_POOL_TIMEOUT", 30)
+    app.config.setdefault("DATABASE_LOCK_RETRIES", 5)
+    app.config.setdefault("DATABASE_LOCK_RETRY_DELAY", 0.05)
+
+    if not app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        return
+
+    # SQLAlchemy opens a new connection per checkout for SQLite files by default.
+    # Connections are handed between threads, but never used by two at once
+    options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+    options.setdefault("poolclass", QueuePool)
+    options.setdefault("pool_size", app.config["DATABASE_POOL_SIZE"])
+    options.setdefault("max_overflow", app.config["DATABASE_MAX_OVERFLOW"])
+    options.setdefault("pool_timeout", app.config["DATABASE_POOL_TIMEOUT"])
+    options.setdefault("connect_args", {}).setdefault("check_same_thread", False)
+
+    pragmas = [
+        "PRAGMA journal_mode={}".format(app.config["SQLITE_JOURNAL_MODE"]),
+        "PRAGMA synchronous={}".format(app.config["SQLITE_SYNCHRONOUS"]),
+        "PRAGMA busy_timeout={:d}".format(app.config["SQLITE_BUSY_TIMEOUT"]),
+        "PRAGMA cache_size={:d}".format(app.config["SQLITE_CACHE_SIZE"]),
+        "PRAGMA foreign_keys={}".format("ON" if app.config["SQLITE_FOREIGN_KEYS"] else "OFF"),
+    ]
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    event.listen(db.get_engine(app), "connect", set_pragmas)
+
+
+def is_lock_error(error):
+    """Returns True if error was raised because another connection held a lock"""
+
+    if not isinstance(error, OperationalError) or not isinstance(error.orig, sqlite3.OperationalError):
+        return False
+    message = str(error.orig)
+    return "database is locked" in message or "database table is locked" in message
+
+
+def begin_write():
+    """Starts the transaction of the session by taking the write lock right away.
+
+    pysqlite only starts a transaction before the first INSERT, UPDATE or
+    DELETE, so a SAVEPOINT (db.session.begin_nested) issued before any of them
+    would start and, once released, commit a transaction of its own. Must be
+    called before the session wrote anything."""
+
+    if db.session.get_bind().dialect.name == "sqlite":
+        db.session.execute("BEGIN IMMEDIATE")
+
+
+def retry_on_lock(fn):
+    """Runs fn again when it fails on a locked database, after rolling back the
+    session and waiting a little longer on every attempt.
+
+    fn must do all of its database work, including the commit, so that running
+    it again repeats the whole transaction. Decorates views as well."""
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        retries, delay = 5, 0.05
+        if has_app_context():
+            retries = current_app.config.get("DATABASE_LOCK_RETRIES", retries)
+            delay = current_app.config.get("DATABASE_LOCK_RETRY_DELAY", delay)
+
+        for attempt in range(retries + 1):
+            try:
+                return fn(*args, **kwargs)
+            except OperationalError as error:
+                if attempt == retries or not is_lock_error(error):
+                    raise
+                db.session.rollback()
+                # Random part keeps writers that collided from colliding again
+                time.sleep(delay * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    return wrapper
@@ -0,0 +1,103 @@
+"""Live grading events of Submissions
+
+While a submission is graded, every finished test case is published as an
+event, followed by the final results. Clients follow them through a
+Server-Sent Events view rather than waiting on the status of the submission.
+
+Events are kept per submission in a 'Stream' until the submission is
+graded again, so a client that connects late, or reconnects with the id of
+the last event it got, is sent the events it missed first. Every client
+reads the same Stream, publishing never waits for slow clients.
+"""
+import threading
+from collections import OrderedDict
+
+
+class Stream:
+    """The events of a single grading of a submission"""
+
+    def __init__(self):
+        self.events = []        # (event, data)
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def publish(self, event, data):
+        with self.condition:
+            if not self.closed:
+                self.events.append((event, data))
+                self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def follow(self, start=0, timeout=None):
+        """Yields (id, event, data) for every event from the one with id start
+        until the stream is closed. Yields None whenever timeout seconds pass
+        without an event, so the caller can keep the connection alive"""
+
+        position = start
+        while True:
+            with self.condition:
+                if position >= len(self.events) and not self.closed:
+                    self.condition.wait(timeout)
+                events = self.events[position:]
+                closed = self.closed
+
+            if not events and not closed:
+                yield None
+            for event, data in events:
+                yield position, event, data
+                position += 1
+            if closed and position >= len(self.events):
+                return
+
+
+class EventBroker:
+    """Keeps the Streams of the latest EVENT_STREAMS_KEPT submissions graded"""
+
+    def __init__(self, app=None):
+        self.streams = OrderedDict()
+        self.lock = threading.Lock()
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("EVENT_STREAMS_KEPT", 1000)
+        app.config.setdefault("EVENT_KEEPALIVE", 15)
+
+        self.app = app
+        app.extensions["event_broker"] = self
+
+    def start(self, submission_id):
+        """Starts a new Stream for submission_id, ending the one of its previous grading"""
+
+        stream = Stream()
+        with self.lock:
+            previous = self.streams.pop(submission_id, None)
+            self.streams[submission_id] = stream
+            self._forget_old_streams()
+        if previous is not None:
+            previous.close()
+        return stream
+
+    def get(self, submission_id):
+        """Returns the latest Stream of submission_id or None"""
+
+        with self.lock:
+            return self.streams.get(submission_id)
+
+    def _forget_old_streams(self):
+        # Only called with the lock held. Oldest streams are at the front.
+        excess = len(self.streams) - self.app.config["EVENT_STREAMS_KEPT"]
+        for submission_id in list(self.streams):
+            if excess <= 0:
+                break
+            if self.streams[submission_id].closed:
+                del self.streams[submission_id]
+                excess -= 1
+
+
+event_broker = EventBroker()
@@ -0,0 +1,112 @@
+"""Gradebook export of a Group or an Assignment
+
+Every row is a Student paired with an Assignment of their Group, along with
+the Submission's grade and the scores of its latest grading. Students that
+did not submit get a row with empty grades:
+
+    cms_id,first_name,last_name,assignment_id,assignment_title,submitted,...
+    234,Jared,Dunn,1,Loops,true,...
+
+The rows come from a single joined query, read in batches of yield_per rows,
+and are formatted as CSV or as newline delimited JSON while they are sent.
+So exporting a whole cohort never holds more than a batch in memory.
+"""
+import csv
+import io
+import json
+
+from sqlalchemy import and_
+
+from models import db, Student, Assignment, Submission, SubmissionResult
+
+GRADEBOOK_COLUMNS = ("cms_id", "first_name", "last_name", "assignment_id", "assignment_title",
+                     "submitted", "submission_time", "graded", "grade_percentage",
+                     "overall_score", "test_cases_score", "linter_score",
+                     "test_cases_passed", "total_test_cases")
+
+GRADEBOOK_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def gradebook_query(group_id, assignment_id=None):
+    """Returns the query of the gradebook rows of the Students of a Group, for
+    all of its Assignments or only the one with assignment_id"""
+
+    query = (
+        db.session.query(Student.cms_id, Student.first_name, Student.last_name,
+                         Assignment.id, Assignment.title,
+                         Submission.id, Submission.submission_time, Submission.graded,
+                         Submission.grade_percentage, SubmissionResult.overall_score,
+                         SubmissionResult.test_cases_score, SubmissionResult.linter_score,
+                         Submission.test_cases_passed, SubmissionResult.total_test_cases)
+        .select_from(Student)
+        .join(Assignment, Assignment.group_id == Student.group_id)
+        .outerjoin(Submission, and_(Submission.student_id == Student.id,
+                                    Submission.assignment_id == Assignment.id))
+        .outerjoin(SubmissionResult, SubmissionResult.submission_id == Submission.id)
+        .filter(Student.group_id == group_id)
+    )
+    if assignment_id is not None:
+        query = query.filter(Assignment.id == assignment_id)
+
+    return query.order_by(Student.cms_id, Assignment.id)
+
+
+def gradebook_rows(query, batch_size=500):
+    """Yields every row of a gradebook_query as a dict of the GRADEBOOK_COLUMNS"""
+
+    for row in query.execution_options(stream_results=True).yield_per(batch_size):
+        (cms_id, first_name, last_name, assignment_id, assignment_title, submission_id,
+         submission_time, graded, grade_percentage, overall_score, test_cases_score,
+         linter_score, test_cases_passed, total_test_cases) = row
+
+        submitted = submission_id is not None
+        yield {
+            "cms_id": cms_id,
+            "first_name": first_name,
+            "last_name": last_name,
+            "assignment_id": assignment_id,
+            "assignment_title": assignment_title,
+            "submitted": submitted,
+            "submission_time": submission_time.isoformat() if submission_time else None,
+            "graded": bool(graded) if submitted else None,
+            "grade_percentage": grade_percentage if submitted and graded else None,
+            "overall_score": overall_score,
+            "test_cases_score": test_cases_score,
+            "linter_score": linter_score,
+            "test_cases_passed": test_cases_passed,
+            "total_test_cases": total_test_cases
+        }
+
+
+def export_gradebook(query, export_format="csv", batch_size=500):
+    """Yields the gradebook as chunks of text in export_format, one chunk per batch of rows"""
+
+    if export_format not in GRADEBOOK_FORMATS:
+        raise ValueError("Unsupported format " + export_format)
+
+    buffer = io.StringIO()
+    if export_format == "csv":
+        writer = csv.DictWriter(buffer, GRADEBOOK_COLUMNS)
+        writer.writeheader()
+        write = lambda row: writer.writerow({column: _csv_value(value)
+                                             for column, value in row.items()})
+    else:
+        write = lambda row: buffer.write(json.dumps(row) + "\n")
+
+    for number, row in enumerate(gradebook_rows(query, batch_size), 1):
+        write(row)
+        if number % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
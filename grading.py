@@ -0,0 +1,302 @@
+"""Background grading of Submissions
+
+Grading a submission runs every test case of its Assignment and the linter,
+which can take far longer than a request should. Instead of grading inline,
+views hand the submission over to the 'GradingQueue' and return immediately.
+A bounded pool of worker threads then calls 'run_test' for each queued job.
+
+Jobs are identified by the id of the Submission they grade, so a client can
+poll the status of its latest submission without keeping track of anything else.
+A job remembers the source it was queued for, and the results of a job that
+was overtaken by a resubmission are never stored.
+The progress of a job is also published to the 'event_broker' as every test
+case finishes.
+
+The 'Regrader' re-grades every submission of an Assignment, e.g. after its
+test cases were edited, on a pool of its own that gives way to live grading.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from models import db, Submission
+from utils import run_test, regrade, save_results, store_results, test_case_event
+from database import begin_write, retry_on_lock
+from events import event_broker
+
+# Job States
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    """Raised when the queue already holds as many jobs as it is allowed to"""
+
+
+class AlreadyRunning(Exception):
+    """Raised when an Assignment is already being re-graded"""
+
+
+class GradingQueue:
+    """Runs 'run_test' for submitted jobs on a bounded pool of worker threads
+
+    Configured through the following app configs:
+     - GRADING_WORKERS: Number of submissions graded at the same time
+     - GRADING_QUEUE_SIZE: Maximum number of jobs waiting or being graded
+     - GRADING_JOBS_KEPT: Number of finished jobs remembered for status queries
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.executor = None
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.pending = 0    # Waiting or being graded
+        self.active = 0     # Being graded
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("GRADING_WORKERS", 4)
+        app.config.setdefault("GRADING_QUEUE_SIZE", 500)
+        app.config.setdefault("GRADING_JOBS_KEPT", 1000)
+
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=app.config["GRADING_WORKERS"],
+                                           thread_name_prefix="grader")
+        app.extensions["grading_queue"] = self
+
+    def reserve(self):
+        """Takes a place in the queue for a job submitted later with reserved=True,
+        so a submission can be rejected before it is stored. Raises QueueFull"""
+
+        with self.lock:
+            if self.pending >= self.app.config["GRADING_QUEUE_SIZE"]:
+                raise QueueFull()
+            self.pending += 1
+
+    def release(self):
+        """Gives back a place taken by reserve that won't be used"""
+
+        with self.lock:
+            self.pending -= 1
+
+    def submit(self, submission_id, source_digest, reserved=False):
+        """Queues the Submission specified by submission_id for grading of the
+        source with source_digest and returns the id of the job. With reserved,
+        the job takes the place taken by reserve"""
+
+        with self.lock:
+            if not reserved:
+                if self.pending >= self.app.config["GRADING_QUEUE_SIZE"]:
+                    raise QueueFull()
+                self.pending += 1
+
+            job = {"status": QUEUED, "results": None, "source_digest": source_digest}
+            # A resubmission replaces the job of the previous one
+            self.jobs.pop(submission_id, None)
+            self.jobs[submission_id] = job
+            self._forget_finished_jobs()
+
+        # The job only ever publishes to its own Stream, a resubmission starts a new one
+        stream = event_broker.start(submission_id)
+        stream.publish(QUEUED, {})
+        self.executor.submit(self._grade, submission_id, job, stream)
+        return submission_id
+
+    def status(self, submission_id):
+        """Returns a copy of the job for submission_id or None if it is unknown"""
+
+        with self.lock:
+            job = self.jobs.get(submission_id)
+            return dict(job) if job is not None else None
+
+    def _grade(self, submission_id, job, stream):
+        with self.app.app_context():
+            job["status"] = RUNNING
+            with self.lock:
+                self.active += 1
+            def progress(position, result):
+                stream.publish("test_case", test_case_event(position, result))
+
+            try:
+                submission_object = Submission.query.get(submission_id)
+                assignment_object = submission_object.assignment
+                stream.publish(RUNNING, {"total_test_cases": len(assignment_object.test_cases)})
+                save = partial(save_results, source_digest=job["source_digest"])
+                results = run_test(submission_object, assignment_object, save, progress)
+            except Exception:
+                self.app.logger.exception("Grading of submission %s failed", submission_id)
+                job.update(status=FAILED)
+                stream.publish(FAILED, {})
+            else:
+                job.update(status=DONE, results=results)
+                stream.publish(DONE, results)
+            finally:
+                stream.close()
+                with self.lock:
+                    self.pending -= 1
+                    self.active -= 1
+
+    def _forget_finished_jobs(self):
+        # Only called with the lock held. Oldest jobs are at the front.
+        excess = len(self.jobs) - self.app.config["GRADING_JOBS_KEPT"]
+        for submission_id in list(self.jobs):
+            if excess <= 0:
+                break
+            if self.jobs[submission_id]["status"] in (DONE, FAILED):
+                del self.jobs[submission_id]
+                excess -= 1
+
+
+class Regrader:
+    """Re-grades all the submissions of an Assignment in the background
+
+    Submissions are split into batches that run on a bounded pool of worker
+    threads, each of which starts the processes running the test cases. Only
+    test cases that changed since a submission was last graded are run again.
+    A batch is graded without holding the write lock, then its results are
+    written in a single short transaction, with a savepoint per submission so
+    one that fails to be stored does not undo the others. Like the results of
+    live jobs, those of a submission that was resubmitted while its batch was
+    graded are dropped. Configured through:
+     - REGRADE_WORKERS: Number of batches graded at the same time
+     - REGRADE_BATCH_SIZE: Number of submissions committed together
+     - REGRADE_THROTTLE: Seconds to pause after every re-graded submission
+    Workers also wait while all the live grading workers are busy, so a
+    re-grade never holds up new submissions.
+    """
+
+    def __init__(self, grading_queue, app=None):
+        self.grading_queue = grading_queue
+        self.app = None
+        self.executor = None
+        self.jobs = {}
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("REGRADE_WORKERS", 2)
+        app.config.setdefault("REGRADE_BATCH_SIZE", 20)
+        app.config.setdefault("REGRADE_THROTTLE", 0)
+
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=app.config["REGRADE_WORKERS"],
+                                           thread_name_prefix="regrader")
+        app.extensions["regrader"] = self
+
+    def start(self, assignment_id):
+        """Queues every submission of the Assignment for re-grading and returns the job"""
+
+        submission_ids = [submission_id for submission_id, in
+                          db.session.query(Submission.id)
+                          .filter(Submission.assignment_id == assignment_id)
+                          .order_by(Submission.id)]
+
+        batch_size = self.app.config["REGRADE_BATCH_SIZE"]
+        batches = [submission_ids[start:start + batch_size]
+                   for start in range(0, len(submission_ids), batch_size)]
+
+        with self.lock:
+            job = self.jobs.get(assignment_id)
+            if job is not None and job["status"] in (QUEUED, RUNNING):
+                raise AlreadyRunning()
+
+            job = {"status": QUEUED if batches else DONE, "total": len(submission_ids),
+                   "graded": 0, "failed": 0, "superseded": 0, "batches_left": len(batches)}
+            self.jobs[assignment_id] = job
+
+        for batch in batches:
+            self.executor.submit(self._regrade_batch, job, batch)
+
+        return self.status(assignment_id)
+
+    def status(self, assignment_id):
+        """Returns a copy of the re-grade job of the Assignment or None"""
+
+        with self.lock:
+            job = self.jobs.get(assignment_id)
+            if job is None:
+                return None
+            return {key: value for key, value in job.items() if key != "batches_left"}
+
+    def _wait_for_live_grading(self):
+        workers = self.app.config["GRADING_WORKERS"]
+        while self.grading_queue.pending >= workers:
+            time.sleep(0.5)
+
+    def _regrade_batch(self, job, submission_ids):
+        with self.app.app_context():
+            with self.lock:
+                job["status"] = RUNNING
+
+            graded = []     # (source_digest, (submission, assignment, result, source_hash))
+            for submission_id in submission_ids:
+                self._wait_for_live_grading()
+                try:
+                    submission_object = Submission.query.get(submission_id)
+                    source_digest = submission_object.source_digest
+                    regrade(submission_object, submission_object.assignment,
+                            save=lambda *results: graded.append((source_digest, results)))
+                except Exception:
+                    self.app.logger.exception("Re-grading of submission %s failed", submission_id)
+                    self._count(job, failed=1)
+
+                if self.app.config["REGRADE_THROTTLE"]:
+                    time.sleep(self.app.config["REGRADE_THROTTLE"])
+
+            try:
+                stored, superseded = self._store_batch(graded)
+            except Exception:
+                self.app.logger.exception("Storing re-graded submissions failed")
+                db.session.rollback()
+                stored, superseded = 0, 0
+            self._count(job, graded=stored, failed=len(graded) - stored - superseded,
+                        superseded=superseded)
+
+            with self.lock:
+                job["batches_left"] -= 1
+                if job["batches_left"] == 0:
+                    job["status"] = DONE
+
+    @retry_on_lock
+    def _store_batch(self, graded):
+        """Stores the results of graded and returns how many were stored and how
+        many were dropped because their submission was resubmitted"""
+
+        stored, superseded = 0, 0
+        begin_write()
+        # Checked in the same write transaction, see save_results
+        current_digests = dict(
+            db.session.query(Submission.id, Submission.source_digest)
+            .filter(Submission.id.in_([results[0].id for _, results in graded]))
+        )
+        for source_digest, results in graded:
+            submission_id = results[0].id
+            if current_digests.get(submission_id) != source_digest:
+                superseded += 1
+                continue
+            try:
+                with db.session.begin_nested():
+                    store_results(*results)
+            except Exception:
+                self.app.logger.exception("Storing re-graded submission %s failed", submission_id)
+            else:
+                stored += 1
+        db.session.commit()
+        return stored, superseded
+
+    def _count(self, job, graded=0, failed=0, superseded=0):
+        with self.lock:
+            job["graded"] += graded
+            job["failed"] += failed
+            job["superseded"] += superseded
+
+
+grading_queue = GradingQueue()
+regrader = Regrader(grading_queue)
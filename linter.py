@@ -0,0 +1,177 @@
+"""Linting of submissions on a pool of warm worker processes
+
+Importing pylint (and astroid) takes longer than linting a typical
+submission, and pylint.lint.Run sets up all of its checkers again every
+time it is created. Both used to happen in the grading threads of the web
+process. The 'LinterPool' instead starts worker processes that import
+pylint once, set up a single linter and then lint every file they are sent
+with it.
+
+Like the zygote, a worker is this module run as a script talking to the
+grader over its stdin/stdout:
+ - Request: the path of the file to lint on a line
+ - Response: a JSON line {"global_note": <float>} or {"error": <message>}
+
+pylint is only ever imported in the workers, which are started when the
+first file is linted. Like a zygote, a worker that does not respond within
+the pool's timeout is killed and replaced.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+from worker_pool import WorkerPool
+
+LINTER_SCRIPT = os.path.abspath(__file__)
+
+
+class LinterError(Exception):
+    """Raised when a worker fails to lint a file or stops responding"""
+
+
+# --------------------------------------------
+#         Grader Side
+# --------------------------------------------
+class LinterWorker:
+    """Handle to a worker process, lints a single file at a time"""
+
+    def __init__(self, python=sys.executable):
+        self.process = subprocess.Popen([python, LINTER_SCRIPT], stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE)
+
+    def lint(self, path, timeout=None):
+        """Returns the global_note of the file at path. The worker is killed if
+        it takes longer than timeout seconds"""
+
+        # Killing the worker ends the read below
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, self.process.kill)
+            timer.start()
+        try:
+            self.process.stdin.write(path.encode() + b"\n")
+            self.process.stdin.flush()
+            response = json.loads(self.process.stdout.readline())
+        except (OSError, ValueError) as error:
+            # It may not have exited yet, and must not be reused out of step
+            self.process.kill()
+            self.process.wait()
+            raise LinterError("Linter worker stopped responding") from error
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        if "error" in response:
+            raise LinterError(response["error"])
+        return response["global_note"]
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+
+
+class LinterPool(WorkerPool):
+    """Up to 'size' workers, started when first needed, that lint files from
+    any number of threads. A file taking longer than timeout seconds fails"""
+
+    def __init__(self, size=2, python=sys.executable, timeout=60):
+        super().__init__(size)
+        self.python = python
+        self.timeout = timeout
+
+    def start_worker(self):
+        return LinterWorker(self.python)
+
+    def lint(self, path):
+        """Returns pylint's global_note of the Python file at path, 0 when it
+        has no statements to rate"""
+
+        # A worker that stopped responding is replaced when one is needed
+        with self.worker() as worker:
+            return worker.lint(path, self.timeout)
+
+
+# --------------------------------------------
+#         Worker Side
+# --------------------------------------------
+def setup_linter():
+    """Imports pylint and returns a linter set up with the configuration and
+    checkers pylint.lint.Run would use"""
+
+    from pylint.lint import Run
+    from pylint.reporters import BaseReporter
+
+    class SilentReporter(BaseReporter):
+        """Only the global_note is needed, the messages are dropped"""
+
+        def handle_message(self, msg):
+            pass
+
+        def _display(self, layout):
+            pass
+
+    # Run sets the linter up exactly like linting a submission used to. It
+    # is given an empty file, then its linter is kept
+    fd, empty_file = tempfile.mkstemp(suffix=".py")
+    os.close(fd)
+    try:
+        run = Run([empty_file, "--persistent=n"], reporter=SilentReporter(), do_exit=False)
+    finally:
+        os.remove(empty_file)
+    return run.linter
+
+
+def lint(linter, path):
+    """Lints the file at path with the linter and returns its global_note"""
+
+    from astroid import MANAGER
+    from pylint.lint import fix_import_path
+
+    try:
+        with fix_import_path([path]):
+            linter.check([path])
+        linter.generate_reports()
+        return linter.stats.get("global_note", 0)
+    finally:
+        # Every submission file is linted once, don't keep its tree around
+        for name, module in list(MANAGER.astroid_cache.items()):
+            if getattr(module, "file", None) == path:
+                del MANAGER.astroid_cache[name]
+
+
+def serve():
+    requests = sys.stdin.buffer
+    # Anything pylint prints goes to stderr, stdout is only used for responses
+    responses = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+
+    linter = setup_linter()
+
+    for line in iter(requests.readline, b""):
+        path = line.decode().rstrip("\n")
+        try:
+            response = {"global_note": lint(linter, path)}
+        except Exception as error:
+            response = {"error": "Linting {} failed: {!r}".format(path, error)}
+        responses.write(json.dumps(response).encode() + b"\n")
+        responses.flush()
+
+
+if __name__ == "__main__":
+    serve()
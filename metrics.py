@@ -0,0 +1,232 @@
+"""Application metrics exposed in the Prometheus text format on /metrics
+
+Records the following:
+ - Latency and count of requests per endpoint
+ - Number and duration of SQL statements per request, through SQLAlchemy
+   engine events
+ - Time spent in each phase of grading (spawn, execute, compare, lint, store)
+ - Gauges such as the grading queue depth, read when /metrics is scraped
+
+/metrics is only served when the METRICS_TOKEN app config is set, to
+scrapers sending it as a Bearer token.
+"""
+import hmac
+import threading
+from time import perf_counter
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context, Response, current_app, abort
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Statements per request
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    return "{" + ",".join('{}="{}"'.format(name, escape(value)) for name, value in pairs) + "}"
+
+
+def _format_number(number):
+    if number == float("inf"):
+        return "+Inf"
+    return repr(float(number)) if isinstance(number, float) else str(number)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for label_values, value in sorted(values.items()):
+            yield self.name + _format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # label values -> [bucket counts, sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            if label_values not in self.values:
+                self.values[label_values] = [[0] * len(self.buckets), 0, 0]
+            series = self.values[label_values]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self.lock:
+            values = {key: (list(counts), total, count)
+                      for key, (counts, total, count) in self.values.items()}
+
+        for label_values, (counts, total, count) in sorted(values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.labels, label_values, [("le", _format_number(bound))])
+                yield self.name + "_bucket" + labels, bucket_count
+            yield self.name + "_sum" + _format_labels(self.labels, label_values), total
+            yield self.name + "_count" + _format_labels(self.labels, label_values), count
+
+
+class Gauge:
+    """Gauge whose value is read from a callback whenever it is scraped"""
+
+    type = "gauge"
+
+    def __init__(self, name, description, callback):
+        self.name = name
+        self.description = description
+        self.callback = callback
+
+    def samples(self):
+        yield self.name, self.callback()
+
+
+class Metrics:
+    """Collects the metrics of the application. Call init_app to record requests
+    and SQL statements and to add the /metrics view"""
+
+    def __init__(self, app=None):
+        self.registry = []
+
+        self.request_duration = self.add(Histogram(
+            "codebench_request_duration_seconds", "Time taken to handle a request",
+            ["endpoint", "method"]))
+        self.requests = self.add(Counter(
+            "codebench_requests_total", "Requests handled", ["endpoint", "method", "status"]))
+        self.request_sql_statements = self.add(Histogram(
+            "codebench_request_sql_statements", "SQL statements executed by a request",
+            ["endpoint"], buckets=COUNT_BUCKETS))
+        self.request_sql_duration = self.add(Histogram(
+            "codebench_request_sql_duration_seconds", "Time a request spent executing SQL",
+            ["endpoint"]))
+        self.sql_duration = self.add(Histogram(
+            "codebench_sql_statement_duration_seconds", "Time taken by a single SQL statement"))
+        self.grading_phase_duration = self.add(Histogram(
+            "codebench_grading_phase_duration_seconds", "Time spent in a phase of grading",
+            ["phase"]))
+        self.grading_cache = self.add(Counter(
+            "codebench_grading_cache_total", "Lookups in the grading result cache", ["result"]))
+
+        if app is not None:
+            self.init_app(app)
+
+    def add(self, metric):
+        self.registry.append(metric)
+        return metric
+
+    def gauge(self, name, description, callback):
+        return self.add(Gauge(name, description, callback))
+
+    def init_app(self, app):
+        app.config.setdefault("METRICS_TOKEN", None)
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule("/metrics", "metrics", self.scrape)
+
+        event.listen(Engine, "before_cursor_execute", self._start_statement)
+        event.listen(Engine, "after_cursor_execute", self._finish_statement)
+        event.listen(Engine, "handle_error", self._statement_failed)
+
+        app.extensions["metrics"] = self
+
+    def observe_phase(self, phase, seconds):
+        self.grading_phase_duration.observe(seconds, phase)
+
+    @contextmanager
+    def time_phase(self, phase):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(phase, perf_counter() - start)
+
+    def scrape(self):
+        token = current_app.config["METRICS_TOKEN"]
+        if not token:
+            abort(404)
+
+        scheme, _, given = request.headers.get("Authorization", "").partition(" ")
+        if scheme != "Bearer" or not hmac.compare_digest(given.encode(), token.encode()):
+            return Response("Invalid metrics token\n", 401, mimetype="text/plain",
+                            headers={"WWW-Authenticate": "Bearer"})
+        return self.render()
+
+    def render(self):
+        lines = []
+        for metric in self.registry:
+            lines.append("# HELP {} {}".format(metric.name, metric.description))
+            lines.append("# TYPE {} {}".format(metric.name, metric.type))
+            for sample, value in metric.samples():
+                lines.append("{} {}".format(sample, _format_number(value)))
+
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+    def _start_request(self):
+        g.metrics_start = perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0
+
+    def _finish_request(self, response):
+        if "metrics_start" not in g:
+            return response
+
+        endpoint = request.endpoint or "unmatched"
+        self.request_duration.observe(perf_counter() - g.metrics_start, endpoint, request.method)
+        self.requests.inc(endpoint, request.method, response.status_code)
+        self.request_sql_statements.observe(g.sql_statements, endpoint)
+        self.request_sql_duration.observe(g.sql_seconds, endpoint)
+        return response
+
+    def _start_statement(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_statement_start", []).append(perf_counter())
+
+    def _finish_statement(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = perf_counter() - conn.info["metrics_statement_start"].pop()
+        self.sql_duration.observe(seconds)
+
+        if has_request_context() and "sql_statements" in g:
+            g.sql_statements += 1
+            g.sql_seconds += seconds
+
+    def _statement_failed(self, context):
+        # after_cursor_execute is not called for a statement that raised
+        if context.connection is not None and context.execution_context is not None:
+            starts = context.connection.info.get("metrics_statement_start")
+            if starts:
+                starts.pop()
+
+
+metrics = Metrics()
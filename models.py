@@ -5,6 +5,10 @@ Administrator - Authentication Model for Users who can create assignments
 Group - Model for a Class/Course
 Assignment - Model for storing basic details of the Assignment
 Submission - Individual solutions submitted by a Student
+SubmissionFile - A version of the source file of a Submission
+SubmissionResult - Outcome of grading a Submission against its Assignment's TestCases
+TestCaseResult - Outcome of a single TestCase within a SubmissionResult
+Fingerprint - Hash of a part of a Submission's source code, to find similar Submissions
 
 A 'Student' can be part of a single 'Group'. Each 'Group' needs to have a single
 'Administrator'. A 'Group' can have multiple 'Assignment's added by the 'Administrator'
@@ -13,16 +17,25 @@ All Passwords are stored as hashes
 """
 import os
 import datetime
+import hashlib
 
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
 # Password hashing functions used in functions in authentication models 
 from werkzeug.security import generate_password_hash,check_password_hash
 
+from sandbox import File
+from storage import get_store
+
 db=SQLAlchemy()
 
 get_current_datetime = lambda: datetime.datetime.now().replace(microsecond=0)
 class Student(db.Model):
     __tablename__ = "students"
+    __table_args__ = (
+        # Gradebooks list the Students of a Group ordered by cms_id
+        db.Index("ix_students_group_cms_id", "group_id", "cms_id"),
+    )
 
     # Normal Data Fields
     id = db.Column(db.Integer,primary_key=True,nullable=False)
@@ -105,17 +118,27 @@ class Assignment(db.Model):
     linting = db.Column(db.Integer, default=0)
 
     time_limit = db.Column(db.Float, default=0)
+    # Bytes a submission may print per test case, 0 for the default
+    output_limit = db.Column(db.Integer, default=0)
 
-    def __init__(self, title, group, deadline, linting=0, time_limit=0):
+    def __init__(self, title, group, deadline, linting=0, time_limit=0, output_limit=0):
         self.title = title
         self.group = group
         self.deadline = deadline
         self.linting = linting
         self.time_limit = time_limit
+        self.output_limit = output_limit
 
 
 class Submission(db.Model):
     __tablename__ = "submssions"
+    __table_args__ = (
+        # Listing submissions is ordered by submission_time, id (keyset pagination)
+        db.Index("ix_submissions_assignment_time", "assignment_id", "submission_time", "id"),
+        db.Index("ix_submissions_student_time", "student_id", "submission_time", "id"),
+        # A Student has a single Submission per Assignment, resubmitting updates it
+        db.Index("uq_submissions_student_assignment", "student_id", "assignment_id", unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True, nullable=True)
     submission_time = db.Column(db.DateTime, default=get_current_datetime)
@@ -129,50 +152,318 @@ class Submission(db.Model):
 
     test_cases_passed = db.Column(db.Integer, default=0)
 
+    # Extension of the source file without the dot, selects the language runner
+    extension = db.Column(db.String(10), default="py")
+    # SHA-256 of the latest source file, stored in SUBMISSIONS_FOLDER by it
+    source_digest = db.Column(db.String(64))
+
     # Grading
     graded = db.Column(db.Boolean, default=False)
     grade_percentage = db.Column(db.Integer, default=False)
     remarks = db.Column(db.String, default="")
 
-    def __init__(self, student, assignment):
+    def __init__(self, student, assignment, extension="py"):
         self.student = student
         self.assignment = assignment
+        self.extension = extension
 
     def get_submission_filename(self):
-        """Utility function to get the Submission File's path associated with the current
-        submission"""
+        """Utility function to get the path of the latest Submission File associated
+        with the current submission"""
+
+        extension = "."+(self.extension or "py")
+        if self.source_digest:
+            return get_store("SUBMISSIONS_FOLDER").path(self.source_digest, extension)
 
-        root_folder = os.path.abspath(os.path.dirname(__name__))
-        submissions_folder = os.path.join(root_folder, "submissions")
-        filename = os.path.join(submissions_folder, str(self.id)+".py")
-        return filename
+        # Submitted before files were stored by their content
+        return os.path.join(current_app.config["SUBMISSIONS_FOLDER"], str(self.id)+extension)
 
     def get_submission_result_path(self):
         """Utility function to get the Submission Result File's path associated with the current
-        submission"""
+        submission. Only submissions graded before results were stored in the database have one"""
 
-        root_folder = os.path.abspath(os.path.dirname(__name__))
-        submissions_folder = os.path.join(root_folder, "submissions")
-        filename = os.path.join(submissions_folder, str(self.id)+".json")
-        
-        return filename
+        return os.path.join(current_app.config["SUBMISSIONS_FOLDER"], str(self.id)+".json")
     def update_for_new_submission(self):
         self.submission_time = get_current_datetime()
+
+    @classmethod
+    def upsert(cls, student, assignment, extension="py", source_digest=None):
+        """Creates the Submission of student for assignment, or updates the submission
+        time, extension and source file of the existing one, in a single statement.
+        Returns the Submission.
+
+        Two requests racing can't create duplicates since the statement relies on
+        the unique (student_id, assignment_id) index"""
+
+        statement = db.text(
+            "INSERT INTO submssions (student_id, assignment_id, submission_time, extension, "
+            "                        source_digest, test_cases_passed, graded, "
+            "                        grade_percentage, remarks) "
+            "VALUES (:student_id, :assignment_id, :submission_time, :extension, "
+            "        :source_digest, 0, 0, 0, '') "
+            "ON CONFLICT (student_id, assignment_id) "
+            "DO UPDATE SET submission_time = excluded.submission_time, "
+            "              extension = excluded.extension, source_digest = excluded.source_digest"
+        # Stored in the same format as the ORM does, so they compare with its values
+        ).bindparams(db.bindparam("submission_time", type_=db.DateTime))
+        db.session.execute(statement, {
+            "student_id": student.id, "assignment_id": assignment.id,
+            "submission_time": get_current_datetime(), "extension": extension,
+            "source_digest": source_digest})
+
+        return (cls.query.populate_existing()
+                   .filter_by(student_id=student.id, assignment_id=assignment.id)
+                   .one())
         
 
+class SubmissionFile(db.Model):
+    """Every source file submitted for a Submission, so earlier versions are
+    kept when a Student resubmits. The files themselves are stored in
+    SUBMISSIONS_FOLDER by the SHA-256 of their content, identical files once"""
+
+    __tablename__ = "submission_files"
+    __table_args__ = (
+        db.Index("ix_submission_files_submission", "submission_id", "id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    submission_time = db.Column(db.DateTime, default=get_current_datetime)
+    digest = db.Column(db.String(64), nullable=False)
+    extension = db.Column(db.String(10), default="py")
+    size = db.Column(db.Integer, default=0)
+
+    submission_id = db.Column(db.Integer, db.ForeignKey("submssions.id"), nullable=False)
+    submission = db.relationship("Submission", backref=db.backref("files", uselist=True,
+                                                                  order_by="SubmissionFile.id"))
+
+    def __init__(self, submission, digest, extension="py", size=0):
+        self.submission = submission
+        self.digest = digest
+        self.extension = extension
+        self.size = size
+
+    def get_path(self):
+        return get_store("SUBMISSIONS_FOLDER").path(self.digest, "."+(self.extension or "py"))
+
+
 class TestCase(db.Model):
     __tablename__ = "test_cases"
+    __table_args__ = (
+        # Test cases are always loaded per Assignment, ordered by id
+        db.Index("ix_test_cases_assignment", "assignment_id", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True, nullable=True)
+    # Only a preview when the input or output is stored in a file
     expected_input = db.Column(db.String, default="")
     expected_output = db.Column(db.String)
     visible = db.Column(db.Boolean, default=False, nullable=False)
 
+    # Large inputs and outputs are stored in TESTCASES_FOLDER instead, by the
+    # SHA-256 of their content
+    input_file = db.Column(db.String(64))
+    output_file = db.Column(db.String(64))
+
+    # Hash of the input and output. Changes whenever either of them is edited
+    version = db.Column(db.String(64))
+
     assignment_id = db.Column(db.Integer, db.ForeignKey("assignments.id"))
-    assignment = db.relationship("Assignment", backref=db.backref("test_cases", uselist=True))
+    assignment = db.relationship("Assignment", backref=db.backref("test_cases", uselist=True,
+                                                                  order_by="TestCase.id"))
 
     def __init__(self, assignment, exp_input, exp_output, visible=False):
-        self.expected_input = exp_input
-        self.expected_output = exp_output
+        self.set_content(exp_input, exp_output)
         self.visible = visible
         self.assignment = assignment
+
+    def set_content(self, exp_input, exp_output):
+        """Updates the input and output along with the version. Either may be a
+        str or a binary file. Anything larger than TESTCASE_INLINE_LIMIT bytes is
+        stored in a file and only a preview of it kept in the row"""
+
+        self.expected_input, self.input_file = self._store(exp_input)
+        self.expected_output, self.output_file = self._store(exp_output)
+
+        digest = hashlib.sha256()
+        for part, file_digest in ((self.expected_input, self.input_file),
+                                  (self.expected_output, self.output_file)):
+            if file_digest:
+                # The file is named by the hash of its content
+                digest.update(b"file:" + file_digest.encode())
+            else:
+                encoded = (part or "").encode()
+                digest.update(str(len(encoded)).encode() + b":" + encoded)
+        self.version = digest.hexdigest()
+
+    @staticmethod
+    def _store(content):
+        """Returns (text, file digest) for content. The text is a preview if
+        content was stored in a file"""
+
+        if content is None:
+            return None, None
+
+        inline_limit = 64 * 1024
+        if has_app_context():
+            inline_limit = current_app.config.get("TESTCASE_INLINE_LIMIT", inline_limit)
+
+        if isinstance(content, str):
+            if len(content) * 4 <= inline_limit:
+                return content, None    # Can't be over the limit, skip encoding
+            content = content.encode()
+
+        head = content[:inline_limit + 1] if isinstance(content, bytes) else content.read(inline_limit + 1)
+        if len(head) <= inline_limit:
+            return head.decode(errors="replace"), None
+
+        rest = content[len(head):] if isinstance(content, bytes) else content
+        file_digest, size = get_store("TESTCASES_FOLDER").put(rest, head=head)
+
+        preview_length = current_app.config.get("TESTCASE_PREVIEW_LENGTH", 1024)
+        preview = head[:preview_length].decode(errors="ignore")
+        return preview + "\n... ({} bytes in total)".format(size), file_digest
+
+    def get_input(self):
+        """Returns the input to run the test case with, bytes or a sandbox.File"""
+
+        if self.input_file:
+            return File(get_store("TESTCASES_FOLDER").path(self.input_file))
+        return (self.expected_input or "").encode()
+
+    def get_expected_output(self):
+        """Returns the output the test case expects, a str or a sandbox.File"""
+
+        if self.output_file:
+            return File(get_store("TESTCASES_FOLDER").path(self.output_file))
+        return self.expected_output
+
+
+class SubmissionResult(db.Model):
+    __tablename__ = "submission_results"
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    graded_at = db.Column(db.DateTime, default=get_current_datetime, onupdate=get_current_datetime)
+
+    # A Submission only keeps the result of its latest grading
+    submission_id = db.Column(db.Integer, db.ForeignKey("submssions.id"), unique=True)
+    submission = db.relationship("Submission", backref=db.backref("result", uselist=False))
+
+    test_cases_passed = db.Column(db.Integer, default=0)
+    total_test_cases = db.Column(db.Integer, default=0)
+    time_limit = db.Column(db.Float, default=0)
+    # SHA-256 of the source code that was graded
+    source_hash = db.Column(db.String(64))
+
+    # Percentages of the overall score given to the test cases and the linter
+    test_cases_percentage = db.Column(db.Integer, default=100)
+    linter_percentage = db.Column(db.Integer, default=0)
+
+    # Scaled scores
+    overall_score = db.Column(db.Float, default=0, index=True)
+    test_cases_score = db.Column(db.Float, default=0)
+    linter_score = db.Column(db.Float, default=0)
+
+    def __init__(self, submission):
+        self.submission = submission
+
+    @classmethod
+    def get_or_create(cls, submission):
+        """Returns the SubmissionResult of submission, creating it if there is none.
+
+        The row is created with a single statement, so two workers storing the
+        results of the same submission at once can't both insert one"""
+
+        db.session.execute(db.text(
+            "INSERT INTO submission_results (submission_id) VALUES (:submission_id) "
+            "ON CONFLICT (submission_id) DO NOTHING"
+        ), {"submission_id": submission.id})
+
+        return cls.query.populate_existing().filter_by(submission_id=submission.id).one()
+
+    def update_from_result(self, result):
+        """Copies the summary of a result computed by utils.grade"""
+
+        self.test_cases_passed = result["test_cases_passed"]
+        self.total_test_cases = result["total_test_cases"]
+        self.time_limit = result["time_limit"]
+        self.test_cases_percentage = result["percentages"]["test_cases"]
+        self.linter_percentage = result["percentages"]["linter"]
+        self.overall_score = result["scores"]["overall"]
+        self.test_cases_score = result["scores"]["test_cases"]
+        self.linter_score = result["scores"]["linter"]
+
+    def to_dict(self):
+        """Returns the result in the same format as the results JSON files"""
+
+        test_case_results = (TestCaseResult.query
+                             .options(db.joinedload(TestCaseResult.test_case))
+                             .filter(TestCaseResult.submission_result_id == self.id)
+                             .order_by(TestCaseResult.position)
+                             .all())
+
+        return {
+            "test_cases": [test_case_result.to_dict() for test_case_result in test_case_results],
+            "student_id": self.submission.student_id,
+            "test_cases_passed": self.test_cases_passed,
+            "total_test_cases": self.total_test_cases,
+            "percentages": {
+                "test_cases": self.test_cases_percentage,
+                "linter": self.linter_percentage
+            },
+            "scores": {
+                "overall": self.overall_score,
+                "linter": self.linter_score,
+                "test_cases": self.test_cases_score
+            },
+            "time_limit": self.time_limit
+        }
+
+
+class TestCaseResult(db.Model):
+    __tablename__ = "test_case_results"
+    __table_args__ = (
+        db.Index("ix_test_case_results_result_position", "submission_result_id", "position"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+
+    submission_result_id = db.Column(db.Integer, db.ForeignKey("submission_results.id"))
+    test_case_id = db.Column(db.Integer, db.ForeignKey("test_cases.id"), index=True)
+    test_case = db.relationship("TestCase")
+    # TestCase.version the result was computed for
+    test_case_version = db.Column(db.String(64))
+
+    # Order of the TestCase within its Assignment
+    position = db.Column(db.Integer, default=0)
+    passed = db.Column(db.Boolean, default=False)
+    verdict = db.Column(db.String(3), index=True)
+    output = db.Column(db.String, default="")
+    time_elapsed = db.Column(db.Float, default=0)
+
+    def to_dict(self):
+        return {
+            "passed": self.passed,
+            "verdict": self.verdict,
+            "expected_input": self.test_case.expected_input,
+            "expected_output": self.test_case.expected_output,
+            "output": self.output,
+            "visible": self.test_case.visible,
+            "time_elapsed": self.time_elapsed
+        }
+
+
+class Fingerprint(db.Model):
+    """A hash picked by winnowing the normalized source code of a Submission.
+    Submissions of an Assignment sharing many are likely copied, see similarity.py"""
+
+    __tablename__ = "fingerprints"
+    __table_args__ = (
+        # Submissions sharing a hash are looked up per Assignment
+        db.Index("ix_fingerprints_assignment_hash", "assignment_id", "hash"),
+        db.Index("ix_fingerprints_submission", "submission_id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    assignment_id = db.Column(db.Integer, db.ForeignKey("assignments.id"), nullable=False)
+    submission_id = db.Column(db.Integer, db.ForeignKey("submssions.id"), nullable=False)
+    hash = db.Column(db.BigInteger, nullable=False)
@@ -0,0 +1,149 @@
+"""Content addressed cache of grading results
+
+Students often submit the exact same file more than once. Grading depends only
+on the source code and on the Assignment's test suite, so a result can be
+reused whenever both are unchanged. Only results whose verdicts do not depend
+on the load of the host are cached, see 'is_cacheable'. Results are stored
+as JSON files named by 'grading_key' and the least recently used ones are
+evicted once the cache grows past its limits.
+
+The number and size of the entries are kept as they are stored, so the
+folder is only scanned once the cache is full. Eviction then makes room for
+a tenth of the limits, and the totals are read from the folder again, which
+also takes in entries stored or evicted by other processes.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from sandbox import ACCEPTED, WRONG_ANSWER, RUNTIME_ERROR, COMPILE_ERROR
+
+# Bump whenever the way results are computed changes, to invalidate old entries
+CACHE_VERSION = 6
+
+# Verdicts that only depend on the source code and the test suite. Time and
+# memory limits are hit or not depending on how busy the host was
+CACHEABLE_VERDICTS = frozenset((ACCEPTED, WRONG_ANSWER, RUNTIME_ERROR, COMPILE_ERROR))
+
+
+def is_cacheable(result):
+    """Returns whether result would be the same if the submission was graded again"""
+
+    return all(test_case.get("verdict") in CACHEABLE_VERDICTS
+               for test_case in result["test_cases"])
+
+
+def grading_key(source, extension, assignment_object):
+    """Returns the cache key of a submission's source code (bytes) graded
+    against the current test suite of assignment_object"""
+
+    test_suite = {
+        "test_cases": [[test_case.expected_input, test_case.expected_output, bool(test_case.visible),
+                        test_case.input_file, test_case.output_file]
+                       for test_case in assignment_object.test_cases],
+        "linting": assignment_object.linting,
+        "time_limit": assignment_object.time_limit,
+        "output_limit": assignment_object.output_limit
+    }
+
+    digest = hashlib.sha256()
+    digest.update("{}:{}:".format(CACHE_VERSION, extension).encode())
+    digest.update(hashlib.sha256(source).digest())
+    digest.update(json.dumps(test_suite, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Stores results as '<key>.json' in folder. The modification time of an
+    entry is updated on every hit so eviction removes the least recently used"""
+
+    # Share of the limits eviction makes room for
+    EVICT_FRACTION = 0.1
+
+    def __init__(self, folder, max_entries=10000, max_bytes=256 * 1024 * 1024):
+        self.folder = folder
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.total_entries = None   # Read from the folder on the first put
+        self.total_bytes = 0
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + ".json")
+
+    def get(self, key):
+        """Returns the cached result for key or None"""
+
+        path = self._path(key)
+        try:
+            with open(path) as cache_file:
+                result = json.load(cache_file)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return result
+
+    def put(self, key, result):
+        path = self._path(key)
+        try:
+            replaced_size = os.path.getsize(path)
+        except OSError:
+            replaced_size = None
+
+        # Write to a temporary file first so readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        with os.fdopen(fd, "w") as temp_file:
+            json.dump(result, temp_file)
+            size = temp_file.tell()
+        os.replace(temp_path, path)
+
+        with self.lock:
+            if self.total_entries is None:
+                self._scan()
+            elif replaced_size is None:
+                self.total_entries += 1
+                self.total_bytes += size
+            else:
+                self.total_bytes += size - replaced_size
+
+            if self.total_entries > self.max_entries or self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def _scan(self):
+        """Returns the (mtime, size, path) of every entry and updates the totals"""
+
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(".json"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue    # Evicted by another worker
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        self.total_entries = len(entries)
+        self.total_bytes = sum(size for _, size, _ in entries)
+        return entries
+
+    def evict(self):
+        """Removes the least recently used entries until the cache is a tenth
+        below its limits. Only called with the lock held"""
+
+        entries = self._scan()
+        max_entries = int(self.max_entries * (1 - self.EVICT_FRACTION))
+        max_bytes = int(self.max_bytes * (1 - self.EVICT_FRACTION))
+
+        entries.sort()
+        for _, size, path in entries:
+            if self.total_entries <= max_entries and self.total_bytes <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass   # Evicted by another worker
+            self.total_entries -= 1
+            self.total_bytes -= size
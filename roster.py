@@ -0,0 +1,193 @@
+"""Bulk import of the Students of a Group from a CSV roster
+
+The roster is read as a stream with a header row of at least the columns in
+ROSTER_COLUMNS. One row per Student:
+
+    cms_id,first_name,last_name,email,password
+    234,Jared,Dunn,jared@abc.com,random
+
+Rows are handled in batches. The passwords of a batch are hashed on a pool of
+threads, as PBKDF2 keeps a core busy for tens of milliseconds per password.
+hashlib computes PBKDF2 without holding the GIL, so threads hash side by
+side without starting any processes. The pool belongs to the application
+and is shared by every import. The batch is then written with a single
+multi-row upsert keyed by cms_id. Students already in the Group get their details and password
+updated. Students of other Groups are never touched, their rows are
+rejected. Invalid rows are rejected with the reason, without stopping the
+rest of the import.
+"""
+import codecs
+import csv
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.security import generate_password_hash
+
+from models import db, Student
+from database import retry_on_lock
+
+ROSTER_COLUMNS = ("cms_id", "first_name", "last_name", "email", "password")
+
+UPSERT_STUDENTS = db.text(
+    "INSERT INTO students (cms_id, first_name, last_name, email, password, group_id) "
+    "VALUES (:cms_id, :first_name, :last_name, :email, :password, :group_id) "
+    "ON CONFLICT (cms_id) DO UPDATE SET "
+    "first_name = excluded.first_name, last_name = excluded.last_name, "
+    "email = excluded.email, password = excluded.password "
+    # Only ever updates Students of the importing Group
+    "WHERE students.group_id = excluded.group_id"
+)
+
+
+class RosterError(Exception):
+    """Raised when the roster can't be read at all, e.g. a column is missing"""
+
+
+def get_hash_pool():
+    """Returns the threads of the application hashing passwords, ROSTER_HASH_WORKERS
+    of them. They start when first used"""
+
+    extensions = current_app.extensions
+    if "roster_hash_pool" not in extensions:
+        workers = current_app.config.get("ROSTER_HASH_WORKERS") or os.cpu_count() or 1
+        extensions.setdefault("roster_hash_pool", ThreadPoolExecutor(max_workers=workers))
+    return extensions["roster_hash_pool"]
+
+
+def read_roster(roster_file):
+    """Yields (line number, row) for every row of the binary file roster_file.
+    Rows are dicts of the ROSTER_COLUMNS"""
+
+    reader = csv.DictReader(codecs.getreader("utf-8-sig")(roster_file))
+    missing = [column for column in ROSTER_COLUMNS if column not in (reader.fieldnames or ())]
+    if missing:
+        raise RosterError("Missing columns: " + ", ".join(missing))
+
+    for row in reader:
+        yield reader.line_num, {column: (row[column] or "").strip() for column in ROSTER_COLUMNS}
+
+
+def validate_row(row):
+    """Returns the reason row can't be imported or None. Converts its cms_id to int"""
+
+    for column in ROSTER_COLUMNS:
+        if not row[column]:
+            return "Missing " + column
+    try:
+        row["cms_id"] = int(row["cms_id"])
+    except ValueError:
+        return "Invalid cms_id"
+    if "@" not in row["email"]:
+        return "Invalid email"
+    if len(row["first_name"]) > 50 or len(row["last_name"]) > 50 or len(row["email"]) > 50:
+        return "Field longer than 50 characters"
+    return None
+
+
+class RosterImport:
+    """Imports a roster into a Group. Call run with the roster file, then read
+    created, updated and rejected"""
+
+    def __init__(self, group, batch_size=500):
+        self.group = group
+        self.batch_size = batch_size
+
+        self.created = 0
+        self.updated = 0
+        self.rejected = []      # {"line", "cms_id", "reason"}
+
+        self._cms_ids = set()   # Seen in the roster so far
+        self._emails = set()
+
+    def run(self, roster_file):
+        """Imports every row of roster_file and returns the report"""
+
+        executor = get_hash_pool()
+        batch = []
+        for line, row in read_roster(roster_file):
+            reason = self._check(row)
+            if reason is not None:
+                self._reject(line, row, reason)
+                continue
+
+            batch.append((line, row))
+            if len(batch) == self.batch_size:
+                self._import_batch(executor, batch)
+                batch = []
+
+        if batch:
+            self._import_batch(executor, batch)
+
+        return self.report()
+
+    def report(self):
+        return {"created": self.created, "updated": self.updated,
+                "rejected": sorted(self.rejected, key=lambda rejected: rejected["line"])}
+
+    def _check(self, row):
+        reason = validate_row(row)
+        if reason is not None:
+            return reason
+
+        email = row["email"].lower()
+        if row["cms_id"] in self._cms_ids:
+            return "Duplicate cms_id in roster"
+        if email in self._emails:
+            return "Duplicate email in roster"
+        self._cms_ids.add(row["cms_id"])
+        self._emails.add(email)
+        return None
+
+    def _reject(self, line, row, reason):
+        self.rejected.append({"line": line, "cms_id": row.get("cms_id"), "reason": reason})
+
+    def _import_batch(self, executor, batch):
+        # Students of other Groups must not be taken over
+        groups = dict(
+            db.session.query(Student.cms_id, Student.group_id)
+            .filter(Student.cms_id.in_([row["cms_id"] for _, row in batch]))
+        )
+        # Emails belonging to other students would make the whole upsert fail
+        taken_emails = dict(
+            db.session.query(Student.email, Student.cms_id)
+            .filter(Student.email.in_([row["email"] for _, row in batch]))
+        )
+        accepted = []
+        for line, row in batch:
+            owner = taken_emails.get(row["email"])
+            if row["cms_id"] in groups and groups[row["cms_id"]] != self.group.id:
+                self._reject(line, row, "cms_id belongs to a student of another group")
+            elif owner is not None and owner != row["cms_id"]:
+                self._reject(line, row, "Email belongs to another student")
+            else:
+                accepted.append(row)
+        if not accepted:
+            return
+
+        hashes = executor.map(generate_password_hash, [row["password"] for row in accepted])
+
+        students = []
+        for row, password_hash in zip(accepted, hashes):
+            students.append(dict(row, password=password_hash, group_id=self.group.id))
+
+        created, updated = self._upsert(students)
+        self.created += created
+        self.updated += updated
+
+    @retry_on_lock
+    def _upsert(self, students):
+        existing = {cms_id for cms_id, in db.session.query(Student.cms_id)
+                    .filter(Student.cms_id.in_([student["cms_id"] for student in students]))}
+
+        db.session.execute(UPSERT_STUDENTS, students)
+        db.session.commit()
+
+        return len(students) - len(existing), len(existing)
+
+
+def import_roster(group, roster_file, batch_size=500):
+    """Imports the CSV roster_file into group and returns a report of the
+    created and updated counts along with the rejected rows"""
+
+    return RosterImport(group, batch_size).run(roster_file)
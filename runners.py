@@ -0,0 +1,220 @@
+"""Runners for the languages submissions can be written in
+
+A 'Runner' knows how to run a submission's source file, and for compiled
+languages how to build it first. Runners are registered by file extension
+with 'register' and looked up with 'get_runner', so supporting another
+language only takes a new Runner subclass.
+
+Builds are kept in a 'BuildCache' keyed by the hash of the source code, so a
+submission is compiled once no matter how many test cases it runs or how
+often it is re-graded, and identical submissions share the same build. A
+build the compiler rejected is cached as well, along with its output. One
+that timed out or was killed is not, as it may succeed when tried again.
+
+Only the standard library and sandbox are used, like in the zygote.
+"""
+import hashlib
+import os
+import shutil
+import signal
+import tempfile
+from collections import namedtuple
+
+from sandbox import Limits, run_process, COMPILE_ERROR, TIME_LIMIT_EXCEEDED, \
+                    MEMORY_LIMIT_EXCEEDED, OUTPUT_LIMIT_EXCEEDED
+
+# Bump whenever compiler flags change, to invalidate old builds
+BUILD_VERSION = 2
+
+# Outcome of building a submission. folder holds the artifacts, error the
+# compiler's output when the build failed and verdict the verdict of its
+# test cases then: COMPILE_ERROR, or the limit the compiler ran into, in
+# which case nothing is kept and folder is None
+Build = namedtuple("Build", ["folder", "error", "verdict"], defaults=(None,))
+
+
+class Runner:
+    """Runs submissions of a language. Interpreted languages only need a
+    run_command, compiled ones set source_name and a compile_command too"""
+
+    name = None
+    extensions = ()
+    # File name the source is copied to in the build folder before compiling
+    source_name = None
+
+    @property
+    def compiled(self):
+        return self.source_name is not None
+
+    def compile_command(self, build_folder):
+        """Returns the command compiling source_name inside build_folder"""
+
+        return None
+
+    def run_command(self, source_file, build_folder, limits):
+        """Returns the command running the submission under limits. build_folder
+        is None for languages that aren't compiled"""
+
+        raise NotImplementedError()
+
+    def get_limits(self, limits):
+        """Returns the Limits to run the submission with"""
+
+        return limits
+
+
+class PythonRunner(Runner):
+    name = "python"
+    extensions = (".py",)
+
+    def run_command(self, source_file, build_folder, limits):
+        return ["python", source_file]
+
+
+class JavaRunner(Runner):
+    """Submissions need a 'Main' class, which javac requires to be in Main.java"""
+
+    name = "java"
+    extensions = (".java",)
+    source_name = "Main.java"
+
+    def compile_command(self, build_folder):
+        return ["javac", "-encoding", "UTF-8", "-d", build_folder,
+                os.path.join(build_folder, self.source_name)]
+
+    def run_command(self, source_file, build_folder, limits):
+        command = ["java", "-XX:+UseSerialGC", "-Xss64m"]
+        if limits.memory:
+            command.append("-Xmx{}".format(limits.memory))
+        return command + ["-cp", build_folder, "Main"]
+
+    def get_limits(self, limits):
+        # The JVM reserves far more address space than it uses and counts every
+        # one of its threads as a process, so memory is limited through -Xmx instead
+        return Limits(time_limit=limits.time_limit, memory=None, output=limits.output,
+                      processes=None, uid=limits.uid, gid=limits.gid)
+
+
+class CRunner(Runner):
+    name = "c"
+    extensions = (".c",)
+    source_name = "main.c"
+
+    def compile_command(self, build_folder):
+        return ["gcc", "-O2", "-std=c11", "-o", os.path.join(build_folder, "main"),
+                os.path.join(build_folder, self.source_name), "-lm"]
+
+    def run_command(self, source_file, build_folder, limits):
+        return [os.path.join(build_folder, "main")]
+
+
+class CppRunner(CRunner):
+    name = "cpp"
+    extensions = (".cpp", ".cc")
+    source_name = "main.cpp"
+
+    def compile_command(self, build_folder):
+        return ["g++", "-O2", "-std=c++17", "-o", os.path.join(build_folder, "main"),
+                os.path.join(build_folder, self.source_name)]
+
+
+# Extension -> Runner
+runners = {}
+
+def register(runner):
+    for extension in runner.extensions:
+        runners[extension] = runner
+    return runner
+
+for runner_class in (PythonRunner, JavaRunner, CRunner, CppRunner):
+    register(runner_class())
+
+
+def get_runner(filename):
+    """Returns the Runner for filename by its extension, or None if the
+    language is not supported"""
+
+    return runners.get(os.path.splitext(filename)[1].lower())
+
+
+class BuildCache:
+    """Stores every build in its own folder named by the hash of the runner
+    and source code. The least recently used builds are removed once there are
+    more than max_entries"""
+
+    def __init__(self, folder, max_entries=1000):
+        self.folder = folder
+        self.max_entries = max_entries
+        os.makedirs(folder, exist_ok=True)
+
+    def get_build(self, runner, source_file, limits):
+        """Returns the Build of source_file, compiling it under limits if it
+        hasn't been built before"""
+
+        with open(source_file, "rb") as source:
+            digest = hashlib.sha256("{}:{}:".format(BUILD_VERSION, runner.name).encode())
+            digest.update(source.read())
+        path = os.path.join(self.folder, digest.hexdigest())
+
+        build = self._load(path)
+        if build is not None:
+            os.utime(path)
+            return build
+
+        # Build in a temporary folder that is renamed once complete, so other
+        # workers never use a partial build
+        temp_folder = tempfile.mkdtemp(dir=self.folder, suffix=".tmp")
+        shutil.copyfile(source_file, os.path.join(temp_folder, runner.source_name))
+        execution = run_process(runner.compile_command(temp_folder), b"", limits, cwd=temp_folder)
+
+        if execution.exit_code != 0 or execution.timed_out:
+            error = (execution.stderr + execution.stdout).decode(errors="replace")
+            error = error.replace(temp_folder + os.sep, "")
+            if execution.timed_out or execution.output_exceeded or execution.exit_code < 0:
+                # Hit a limit rather than rejected by the compiler, so not cached
+                shutil.rmtree(temp_folder, ignore_errors=True)
+                return self._failed_build(execution, error, limits)
+            with open(os.path.join(temp_folder, "error.txt"), "w") as error_file:
+                error_file.write(error)
+
+        # mkdtemp only lets the grader in, submissions may run as another user
+        os.chmod(temp_folder, 0o755)
+        try:
+            os.rename(temp_folder, path)
+        except OSError:
+            # Built by another worker at the same time
+            shutil.rmtree(temp_folder, ignore_errors=True)
+        self.evict()
+
+        return self._load(path)
+
+    def _failed_build(self, execution, error, limits):
+        """Build of a compiler that timed out, printed too much or was killed"""
+
+        if execution.timed_out or execution.exit_code == -getattr(signal, "SIGXCPU", 0):
+            error += "\nCompilation took longer than {} seconds".format(limits.time_limit)
+            return Build(None, error, TIME_LIMIT_EXCEEDED)
+        if execution.output_exceeded or execution.exit_code == -getattr(signal, "SIGXFSZ", 0):
+            return Build(None, error + "\nCompiler output was too long", OUTPUT_LIMIT_EXCEEDED)
+        # Killed without hitting a limit of ours is most likely the kernel's OOM killer
+        error += "\nCompiler was killed by signal {}".format(-execution.exit_code)
+        return Build(None, error, MEMORY_LIMIT_EXCEEDED)
+
+    def _load(self, path):
+        if not os.path.isdir(path):
+            return None
+
+        error_path = os.path.join(path, "error.txt")
+        if os.path.exists(error_path):
+            with open(error_path) as error_file:
+                return Build(path, error_file.read(), COMPILE_ERROR)
+        return Build(path, None)
+
+    def evict(self):
+        """Removes the least recently used builds past max_entries"""
+
+        entries = [(entry.stat().st_mtime, entry.path) for entry in os.scandir(self.folder)
+                   if entry.is_dir() and not entry.name.endswith(".tmp")]
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            shutil.rmtree(path, ignore_errors=True)
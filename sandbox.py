@@ -0,0 +1,421 @@
+"""Resource limits for the processes running submissions
+
+Every process running a submission gets a hard wall clock deadline and
+CPU time, address space and file size rlimits. Run under a dedicated user, it
+also gets a process count rlimit. Output is
+read with a cap, so a runaway submission is killed instead of taking the
+grader down with it. Only a preview of it is kept in memory, while an
+'OutputMatcher' compares it with the expected output as it arrives and stops
+the process as soon as it can no longer pass. The verdicts reported for a
+test case are defined here.
+
+Only the standard library is used so the zygote can import this module.
+"""
+import codecs
+import mmap
+import os
+import selectors
+import signal
+import subprocess
+from collections import namedtuple
+from math import ceil
+from time import time, monotonic, sleep
+
+try:
+    import resource
+except ImportError:     # Not available on Windows
+    resource = None
+
+# Verdicts
+ACCEPTED = "AC"
+WRONG_ANSWER = "WA"
+TIME_LIMIT_EXCEEDED = "TLE"
+MEMORY_LIMIT_EXCEEDED = "MLE"
+OUTPUT_LIMIT_EXCEEDED = "OLE"
+RUNTIME_ERROR = "RE"
+COMPILE_ERROR = "CE"
+
+# stderr is only kept for its end, where the error is
+STDERR_KEPT = 64 * 1024
+
+# Outcome of running a submission once. passed is None if the output was not
+# compared, diverged is True if the process was stopped for wrong output
+Execution = namedtuple("Execution", ["stdout", "stderr", "exit_code", "time_elapsed",
+                                     "timed_out", "output_exceeded", "spawn_time",
+                                     "passed", "diverged"],
+                       defaults=(None, False))
+
+
+# Test case input or expected output stored in a file, passed in place of
+# the bytes or str so it is streamed from disk instead of held in memory
+File = namedtuple("File", ["path"])
+
+
+class OutputMatcher:
+    """Compares output with expected chunk by chunk as it is produced. Gives the
+    same answer as output.decode(errors="replace").strip() == expected.strip()
+    would once all of it was read, but knows as soon as the output went wrong.
+
+    expected is a str or a File, which is memory mapped and read as far as the
+    output got. Call close() when done"""
+
+    def __init__(self, expected, chunk_size=65536):
+        self.file = self.mapped = None
+        if isinstance(expected, File):
+            self.file = open(expected.path, "rb")
+            source = self.file
+            if os.fstat(self.file.fileno()).st_size:
+                source = self.mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.expected_chunks = _decode_chunks(source, chunk_size)
+        else:
+            self.expected_chunks = iter([expected])
+
+        self.expected = ""      # Read from expected, compared up to offset
+        self.offset = 0
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.output_started = self.expected_started = False     # Past leading whitespace
+        # Past the first difference, after which both may only have whitespace left
+        self.tail = False
+        self.diverged = False
+
+    def feed(self, chunk, final=False):
+        """Compares the next chunk (bytes) of output. Returns False once the
+        output can't match anymore"""
+
+        text = self.decoder.decode(chunk, final)
+        if self.diverged or not text:
+            return not self.diverged
+
+        if not self.output_started:
+            text = text.lstrip()
+            if not text:
+                return True
+            self.output_started = True
+
+        while text and not self.tail:
+            if self.offset == len(self.expected) and not self._read_expected():
+                self._start_tail()
+                break
+
+            expected = self.expected[self.offset:self.offset + len(text)]
+            common = len(os.path.commonprefix([text, expected]))
+            self.offset += common
+            text = text[common:]
+            if common < len(expected):
+                self._start_tail()
+
+        if self.tail and text and not text.isspace():
+            self.diverged = True
+        return not self.diverged
+
+    def finish(self):
+        """Returns whether the whole output matched"""
+
+        self.feed(b"", final=True)
+        if not self.tail:
+            self._start_tail()
+        return not self.diverged
+
+    def close(self):
+        if self.mapped is not None:
+            self.mapped.close()
+        if self.file is not None:
+            self.file.close()
+
+    def _read_expected(self):
+        # Makes the next chunk of expected available. Returns False at its end
+        for chunk in self.expected_chunks:
+            if not self.expected_started:
+                chunk = chunk.lstrip()
+                if not chunk:
+                    continue
+                self.expected_started = True
+            self.expected = self.expected[self.offset:] + chunk
+            self.offset = 0
+            return True
+        return False
+
+    def _start_tail(self):
+        # Output and expected differ from here on, so the rest of both must be
+        # trailing whitespace. Output is checked as it arrives, expected right away
+        self.tail = True
+        while True:
+            rest = self.expected[self.offset:]
+            if rest and not rest.isspace():
+                self.diverged = True
+                return
+            self.offset = len(self.expected)
+            if not self._read_expected():
+                return
+
+
+def _decode_chunks(source, chunk_size):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for chunk in iter(lambda: source.read(chunk_size), b""):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", True)
+
+
+class Limits:
+    """Limits applied to every process running a submission
+
+     - time_limit: Wall clock seconds before the process is killed
+     - memory: Bytes of address space
+     - output: Bytes of output (stdout and stderr together, and any file written)
+     - processes: Number of processes the user running the submission may have
+     - uid, gid: Dedicated user and group the submission runs as
+    A limit of 0 or None is not applied.
+
+    RLIMIT_NPROC counts every process of the real user, so processes is only
+    applied along with a uid that nothing but submissions runs as. It is then
+    shared by all the submissions running at the same time. Switching users
+    requires the grader to run as root. Processes a submission starts are
+    killed with it either way, as its process group.
+    """
+
+    def __init__(self, time_limit=10, memory=512 * 1024 * 1024, output=8 * 1024 * 1024,
+                 processes=None, uid=None, gid=None):
+        self.time_limit = time_limit
+        self.memory = memory
+        self.output = output
+        self.processes = processes
+        self.uid = uid
+        self.gid = gid
+
+    @property
+    def cpu_time(self):
+        # A process can't use more CPU than wall clock time on a single core,
+        # the extra second leaves room for the wall clock deadline to act first
+        return ceil(self.time_limit) + 1 if self.time_limit else None
+
+    def to_dict(self):
+        return {"time_limit": self.time_limit, "memory": self.memory,
+                "output": self.output, "processes": self.processes,
+                "uid": self.uid, "gid": self.gid}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def apply(self):
+        """Sets the rlimits of the current process. Called in the child between
+        fork and exec, so it must not take any locks (no imports, no logging)"""
+
+        if resource is None:
+            return
+
+        limits = [(resource.RLIMIT_CPU, self.cpu_time),
+                  (resource.RLIMIT_AS, self.memory),
+                  (resource.RLIMIT_FSIZE, self.output)]
+        if self.uid is not None and hasattr(resource, "RLIMIT_NPROC"):
+            limits.append((resource.RLIMIT_NPROC, self.processes))
+
+        for limit, value in limits:
+            if not value:
+                continue
+            _, hard = resource.getrlimit(limit)
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            resource.setrlimit(limit, (value, value))
+
+        if self.uid is not None:
+            # Group first, it can't be changed anymore once the user is
+            os.setgroups([])
+            os.setgid(self.gid if self.gid is not None else self.uid)
+            os.setuid(self.uid)
+
+
+def get_deadline(limits):
+    """Returns the monotonic() time a process started now must be killed at"""
+
+    return monotonic() + limits.time_limit if limits.time_limit else None
+
+
+def communicate(stdin, stdout, stderr, input_data, kill, deadline, output_limit,
+                matcher=None, preview_length=None):
+    """Writes input_data to stdin (None when the process reads its input from
+    a file) and reads stdout and stderr until both are closed.
+    The process is killed through kill() when the deadline passes, when it
+    writes more than output_limit bytes or once its stdout diverges from the
+    matcher's expected output. All three (unbuffered) files are closed.
+
+    Only the first preview_length + 1 bytes of stdout (all of it if None), the
+    extra byte telling whether it was cut short, and the last STDERR_KEPT bytes
+    of stderr are kept.
+    Returns stdout, stderr, whether the deadline or output limit were exceeded and
+    whether the process was killed for diverging"""
+
+    stdout_chunks = []
+    stdout_kept = 0
+    stderr_data = b""
+    output_size = 0
+    timed_out = output_exceeded = diverged = False
+    selector = selectors.DefaultSelector()
+    if stdin is not None and input_data:
+        input_view = memoryview(input_data)
+        os.set_blocking(stdin.fileno(), False)
+        selector.register(stdin, selectors.EVENT_WRITE)
+    elif stdin is not None:
+        stdin.close()
+    for pipe in (stdout, stderr):
+        selector.register(pipe, selectors.EVENT_READ)
+
+    with selector:
+        while selector.get_map():
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    timed_out = True
+                    break
+
+            for key, _ in selector.select(timeout):
+                if key.fileobj is stdin:
+                    try:
+                        written = os.write(stdin.fileno(), input_view[:65536])
+                        input_view = input_view[written:]
+                    except BrokenPipeError:
+                        input_view = input_view[:0]    # Not reading its input anymore
+                    if not input_view:
+                        selector.unregister(stdin)
+                        stdin.close()
+                    continue
+
+                chunk = os.read(key.fileobj.fileno(), 65536)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    continue
+
+                output_size += len(chunk)
+                if output_limit and output_size > output_limit:
+                    output_exceeded = True
+                    break
+
+                if key.fileobj is stderr:
+                    stderr_data = (stderr_data + chunk)[-STDERR_KEPT:]
+                    continue
+
+                if preview_length is None:
+                    stdout_chunks.append(chunk)
+                elif stdout_kept <= preview_length:
+                    stdout_chunks.append(chunk[:preview_length + 1 - stdout_kept])
+                    stdout_kept += len(stdout_chunks[-1])
+
+                if matcher is not None and not matcher.feed(chunk):
+                    diverged = True
+                    break
+
+            if output_exceeded or diverged:
+                break
+
+    if timed_out or output_exceeded or diverged:
+        kill()
+
+    for pipe in (stdin, stdout, stderr):
+        if pipe is not None:
+            pipe.close()
+
+    return b"".join(stdout_chunks), stderr_data, timed_out, output_exceeded, diverged
+
+
+def run_process(command, input_data, limits, expected_output=None, preview_length=None,
+                **popen_kwargs):
+    """Runs command with input_data (bytes or a File) as its stdin under limits.
+    Returns an Execution. If expected_output (str or File) is given the output is
+    compared with it while it is read, see 'communicate' for preview_length"""
+
+    posix = resource is not None
+    start = time()
+    deadline = get_deadline(limits)
+
+    # A File is given to the process as its stdin as is
+    stdin = open(input_data.path, "rb") if isinstance(input_data, File) else subprocess.PIPE
+    try:
+        process = subprocess.Popen(command, stdin=stdin, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, bufsize=0,
+                                   preexec_fn=limits.apply if posix else None,
+                                   # Own process group, so any children get killed too
+                                   start_new_session=posix, **popen_kwargs)
+    finally:
+        if stdin is not subprocess.PIPE:
+            stdin.close()
+    spawn_time = time() - start
+
+    def kill():
+        try:
+            if posix:
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except ProcessLookupError:
+            pass
+
+    matcher = OutputMatcher(expected_output) if expected_output is not None else None
+    stdout, stderr, timed_out, output_exceeded, diverged = communicate(
+        process.stdin, process.stdout, process.stderr, input_data, kill, deadline,
+        limits.output, matcher, preview_length)
+    passed = None
+    if matcher is not None:
+        passed = matcher.finish()
+        matcher.close()
+
+    # It may have closed its output without exiting
+    try:
+        exit_code = process.wait(None if deadline is None else max(deadline - monotonic(), 0))
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        kill()
+        exit_code = process.wait()
+    end = time()
+
+    return Execution(stdout, stderr, exit_code, end - start, timed_out, output_exceeded,
+                     spawn_time, passed, diverged)
+
+
+def wait_for_child(pid, deadline, kill):
+    """Waits for the forked child pid and returns its exit code (negative signal
+    number if killed) and whether it had to be killed at the deadline"""
+
+    timed_out = False
+    while True:
+        waited_pid, status = os.waitpid(pid, os.WNOHANG if deadline is not None else 0)
+        if waited_pid:
+            break
+        if monotonic() >= deadline:
+            timed_out = True
+            kill()
+            deadline = None
+        else:
+            sleep(0.005)
+
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status), timed_out
+    return os.WEXITSTATUS(status), timed_out
+
+
+def get_verdict(execution, passed, time_limit):
+    """Returns the verdict for a test case given whether its output was correct"""
+
+    if execution.timed_out or (time_limit and execution.time_elapsed > time_limit):
+        return TIME_LIMIT_EXCEEDED
+    if hasattr(signal, "SIGXCPU") and execution.exit_code == -signal.SIGXCPU:
+        return TIME_LIMIT_EXCEEDED
+    if execution.output_exceeded:
+        return OUTPUT_LIMIT_EXCEEDED
+    if hasattr(signal, "SIGXFSZ") and execution.exit_code == -signal.SIGXFSZ:
+        return OUTPUT_LIMIT_EXCEEDED
+    killed = hasattr(signal, "SIGKILL") and execution.exit_code == -signal.SIGKILL
+    out_of_memory = b"MemoryError" in execution.stderr or b"std::bad_alloc" in execution.stderr
+    if out_of_memory:
+        return MEMORY_LIMIT_EXCEEDED
+    if execution.diverged and (killed or execution.exit_code == 0):
+        # Stopped by us for printing the wrong output
+        return WRONG_ANSWER
+    if killed:
+        # Killed without hitting a limit of ours is most likely the kernel's OOM killer
+        return MEMORY_LIMIT_EXCEEDED
+    if passed:
+        return ACCEPTED
+    if execution.exit_code != 0:
+        return RUNTIME_ERROR
+    return WRONG_ANSWER
@@ -0,0 +1,287 @@
+"""Benchmark of the grading engine with synthetic submissions
+
+Generates assignments with varying numbers of test cases and input sizes,
+along with CPU bound, IO bound and timeout heavy student programs, and
+grades them by calling utils.run_test directly. Reports submissions/sec,
+per-submission latency percentiles, process spawn overhead, the share of
+time spent in the linter and the share of test cases passed as JSON, so results can be compared between releases.
+
+Usage: python scripts/benchmark_grading.py [--runner zygote] [--parallel]
+                                           [--submissions 5] [--output results.json]
+"""
+
+import sys, os
+# Include the application folder in path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import argparse
+import datetime
+import json
+import math
+import platform
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+from models import db, Student, Administrator, Group, Assignment, Submission, SubmissionFile, \
+                   TestCase
+from storage import get_store
+import utils
+
+# Student programs. Each reads whitespace separated numbers from stdin
+PROGRAMS = {
+    # Quadratic work in the size of the input
+    "cpu": (
+        "import sys\n"
+        "numbers = list(map(int, sys.stdin.read().split()))\n"
+        "total = 0\n"
+        "for a in numbers[:300]:\n"
+        "    for b in numbers[:300]:\n"
+        "        total += a * b % 7\n"
+        "print(sum(numbers))\n"
+    ),
+    # Reads the whole input and echoes every number
+    "io": (
+        "import sys\n"
+        "numbers = sys.stdin.read().split()\n"
+        "sys.stdout.write('\\n'.join(numbers[:-1]) + '\\n')\n"
+        "print(sum(map(int, numbers)))\n"
+    ),
+    # Never finishes for every other test case
+    "timeout": (
+        "import sys\n"
+        "numbers = list(map(int, sys.stdin.read().split()))\n"
+        "while numbers[0] % 2:\n"
+        "    pass\n"
+        "print(sum(numbers))\n"
+    ),
+}
+
+TEST_CASE_COUNTS = (1, 10, 30)
+INPUT_SIZES = (10, 10000)     # Numbers per test case
+TIME_LIMIT = 1                # Seconds
+
+
+def make_input(size, seed):
+    return " ".join(str(seed + number) for number in range(size)) + "\n"
+
+
+def make_expected_output(program_name, test_input):
+    """Output of the program for test_input, so every test case that finishes passes"""
+
+    numbers = test_input.split()
+    total = str(sum(map(int, numbers)))
+    if program_name == "io":
+        return "\n".join(numbers[:-1] + [total]) + "\n"
+    return total + "\n"
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile"""
+
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def create_app(work_folder, args):
+    app = Flask(__name__)
+    app.config['SECRET_KEY']='thisissecretkey'
+    app.config['SQLALCHEMY_DATABASE_URI']='sqlite:///' + os.path.join(work_folder, "benchmark.db")
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS']=False
+    app.config['SUBMISSIONS_FOLDER']=os.path.join(work_folder, "submissions")
+    app.config['TESTCASES_FOLDER']=os.path.join(work_folder, "testcases")
+
+    app.config['GRADING_RUNNER']=args.runner
+    app.config['PARALLEL_TEST_CASES']=args.parallel
+    app.config['TEST_CASE_CONCURRENCY']=os.cpu_count()
+    app.config['SUBMISSION_TIME_LIMIT']=TIME_LIMIT
+    # Every submission is graded for real
+    app.config['RESULT_CACHE_FOLDER']=None
+
+    db.init_app(app)
+    return app
+
+
+def create_scenarios(args):
+    """Returns (name, assignment, submissions) for every combination of program,
+    test case count and input size"""
+
+    admin = Administrator(first_name="Bench", last_name="Mark", email="bench@mark.com",
+                          password="benchmark")
+    group = Group(name="Benchmark", administrator=admin)
+    deadline = datetime.datetime.now() + datetime.timedelta(days=7)
+    students = [Student(first_name="Student", last_name=str(number), cms_id=number,
+                        email="student{}@mark.com".format(number), password="benchmark",
+                        group=group)
+                for number in range(args.submissions)]
+    db.session.add_all([admin, group] + students)
+
+    scenarios = []
+    for program_name, source in PROGRAMS.items():
+        for test_case_count in TEST_CASE_COUNTS:
+            for input_size in INPUT_SIZES:
+                if program_name == "timeout" and input_size != INPUT_SIZES[0]:
+                    continue    # Dominated by the time limit either way
+
+                name = "{}-{}tc-{}n".format(program_name, test_case_count, input_size)
+                assignment = Assignment(title=name, group=group, deadline=deadline,
+                                        linting=args.linting, time_limit=TIME_LIMIT)
+                for seed in range(test_case_count):
+                    test_input = make_input(input_size, seed)
+                    expected = make_expected_output(program_name, test_input)
+                    TestCase(assignment=assignment, exp_input=test_input,
+                             exp_output=expected, visible=seed % 2 == 0)
+
+                submissions = [Submission(student, assignment) for student in students]
+                db.session.add(assignment)
+                db.session.add_all(submissions)
+                scenarios.append((name, assignment, submissions, source))
+
+    db.session.commit()
+
+    for _, _, submissions, source in scenarios:
+        digest, size = get_store("SUBMISSIONS_FOLDER").put(source.encode(), suffix=".py")
+        for submission in submissions:
+            submission.source_digest = digest
+            db.session.add(SubmissionFile(submission, digest, "py", size))
+    db.session.commit()
+
+    return scenarios
+
+
+def measure_spawn_overhead(work_folder, args, runs=20):
+    """Average seconds to run a program that does nothing, per runner"""
+
+    empty_program = os.path.join(work_folder, "empty.py")
+    with open(empty_program, "w") as source_file:
+        source_file.write("pass\n")
+
+    limits = utils.get_limits(TIME_LIMIT)
+    overhead = {}
+
+    start = time.time()
+    for _ in range(runs):
+        utils.execute_subprocess(empty_program, b"", limits)
+    overhead["subprocess"] = (time.time() - start) / runs
+
+    if hasattr(os, "fork"):
+        start = time.time()
+        with utils.ZygotePool(empty_program) as zygotes:
+            for _ in range(runs):
+                zygotes.run(b"", limits)
+        overhead["zygote"] = (time.time() - start) / runs
+
+    return overhead
+
+
+def run_benchmark(args):
+    work_folder = tempfile.mkdtemp(prefix="codebench-")
+
+    # Time spent in the linter, accumulated across threads
+    lint_seconds = []
+    lint_submission = utils.lint_submission
+
+    def timed_lint_submission(submission_file):
+        start = time.time()
+        try:
+            return lint_submission(submission_file)
+        finally:
+            lint_seconds.append(time.time() - start)
+
+    utils.lint_submission = timed_lint_submission
+
+    try:
+        app = create_app(work_folder, args)
+        with app.app_context():
+            db.create_all()
+            scenarios = create_scenarios(args)
+            spawn_overhead = measure_spawn_overhead(work_folder, args)
+            submission_ids = {name: [submission.id for submission in submissions]
+                              for name, _, submissions, _ in scenarios}
+
+        def grade_one(submission_id):
+            with app.app_context():
+                submission = Submission.query.get(submission_id)
+                start = time.time()
+                results = utils.run_test(submission, submission.assignment)
+                return time.time() - start, results
+
+        report = {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "runner": args.runner,
+            "parallel_test_cases": args.parallel,
+            "concurrency": args.concurrency,
+            "linting": args.linting,
+            "spawn_overhead_seconds": spawn_overhead,
+            "scenarios": {}
+        }
+
+        all_latencies = []
+        total_start = time.time()
+        for name, ids in submission_ids.items():
+            del lint_seconds[:]
+            start = time.time()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                latencies, results = zip(*executor.map(grade_one, ids))
+            wall_time = time.time() - start
+            all_latencies.extend(latencies)
+            passed = sum(result["test_cases_passed"] for result in results)
+            total = sum(result["total_test_cases"] for result in results)
+
+            report["scenarios"][name] = {
+                "submissions": len(latencies),
+                "submissions_per_second": len(latencies) / wall_time,
+                "latency_p50": percentile(latencies, 0.50),
+                "latency_p95": percentile(latencies, 0.95),
+                "latency_p99": percentile(latencies, 0.99),
+                "lint_share": sum(lint_seconds) / sum(latencies),
+                # Only the timeout scenarios should fail any test case
+                "passed_share": passed / total
+            }
+            print(name, json.dumps(report["scenarios"][name]), file=sys.stderr)
+
+        total_time = time.time() - total_start
+        report["overall"] = {
+            "submissions": len(all_latencies),
+            "submissions_per_second": len(all_latencies) / total_time,
+            "latency_p50": percentile(all_latencies, 0.50),
+            "latency_p95": percentile(all_latencies, 0.95),
+            "latency_p99": percentile(all_latencies, 0.99)
+        }
+        return report
+    finally:
+        utils.lint_submission = lint_submission
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runner", choices=("subprocess", "zygote"), default="subprocess")
+    parser.add_argument("--parallel", action="store_true",
+                        help="Run the test cases of a submission in parallel")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Submissions graded at the same time")
+    parser.add_argument("--submissions", type=int, default=5,
+                        help="Submissions graded per scenario")
+    parser.add_argument("--linting", type=int, default=10,
+                        help="Linting percentage of the assignments, 0 disables the linter")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Script to bring an existing Database up to date with the Models
+
+Creates the tables, columns and indexes that were added to the Models after
+the Database was created, moves submission files from the flat
+submissions folder into the content addressed store and fingerprints the
+submissions for the similarity index. It is safe to run it more than once."""
+
+import sys, os
+# Include the application folder in path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import Flask
+from sqlalchemy import inspect
+from models import db, Submission, SubmissionFile, TestCaseResult, Fingerprint
+from storage import get_store
+from similarity import fingerprint, index_submission
+
+app = Flask(__name__)
+
+app.config['SECRET_KEY']='thisissecretkey'
+
+# Database Configurations
+app.config['SQLALCHEMY_DATABASE_URI']='sqlite:///../database.db'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS']=False
+app.config['SUBMISSIONS_FOLDER']=os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'submissions'))
+db.init_app(app)
+
+
+def add_missing_columns():
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                print("Adding column", table.name + "." + column.name)
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                db.engine.execute('ALTER TABLE "{}" ADD COLUMN "{}" {}'.format(
+                    table.name, column.name, column_type))
+
+
+def remove_duplicate_submissions():
+    """Keeps only the latest Submission of every Student for an Assignment,
+    which the unique (student_id, assignment_id) index requires"""
+
+    duplicates = [row[0] for row in db.engine.execute(
+        "SELECT id FROM submssions AS s WHERE EXISTS ("
+        "    SELECT 1 FROM submssions AS newer"
+        "    WHERE newer.student_id = s.student_id AND newer.assignment_id = s.assignment_id"
+        "    AND (newer.submission_time > s.submission_time"
+        "         OR (newer.submission_time = s.submission_time AND newer.id > s.id)))"
+    )]
+    if not duplicates:
+        return
+
+    print("Removing", len(duplicates), "duplicate submissions")
+    for submission in Submission.query.filter(Submission.id.in_(duplicates)):
+        if submission.result is not None:
+            TestCaseResult.query.filter_by(submission_result_id=submission.result.id).delete()
+            db.session.delete(submission.result)
+        db.session.delete(submission)
+    db.session.commit()
+
+
+def store_submission_files(batch_size=500):
+    """Stores the files of submissions made before files were stored by their
+    content, as their first SubmissionFile, and removes the old '<id>.<ext>' files"""
+
+    store = get_store("SUBMISSIONS_FOLDER")
+    moved = 0
+    while True:
+        # Submissions whose file is missing keep no source_digest, skip past them
+        submissions = (Submission.query.filter(Submission.source_digest.is_(None),
+                                               Submission.id > moved)
+                       .order_by(Submission.id).limit(batch_size).all())
+        if not submissions:
+            break
+
+        old_paths = []
+        for submission in submissions:
+            moved = submission.id
+            path = submission.get_submission_filename()
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as source_file:
+                digest, size = store.put(source_file, suffix="."+(submission.extension or "py"))
+            submission_file = SubmissionFile(submission, digest, submission.extension, size)
+            submission_file.submission_time = submission.submission_time
+            db.session.add(submission_file)
+            submission.source_digest = digest
+            old_paths.append(path)
+        db.session.commit()
+
+        if old_paths:
+            print("Stored", len(old_paths), "submission files")
+        for path in old_paths:
+            os.remove(path)
+
+
+def index_fingerprints(batch_size=500):
+    """Fingerprints the submissions that are not in the similarity index yet"""
+
+    indexed = db.session.query(Fingerprint.submission_id).distinct()
+    last_id = 0
+    while True:
+        submissions = (Submission.query.filter(~Submission.id.in_(indexed),
+                                               Submission.id > last_id)
+                       .order_by(Submission.id).limit(batch_size).all())
+        if not submissions:
+            break
+
+        for submission in submissions:
+            last_id = submission.id
+            path = submission.get_submission_filename()
+            if os.path.exists(path):
+                with open(path, "rb") as source_file:
+                    index_submission(submission, fingerprint(source_file.read()))
+        db.session.commit()
+        print("Fingerprinted submissions up to", last_id)
+
+
+def create_missing_indexes():
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                print("Creating index", index.name)
+                index.create(bind=db.engine)
+
+
+with app.app_context():
+    # Only creates the tables that do not exist yet
+    db.create_all()
+    add_missing_columns()
+    remove_duplicate_submissions()
+    create_missing_indexes()
+    store_submission_files()
+    index_fingerprints()
@@ -0,0 +1,196 @@
+"""Concurrent read/write stress test of the database settings in database.py
+
+Writer threads resubmit and store grading results the way the grading workers
+do, while reader threads list submissions and load results like the listing
+views. Reports throughput and every error as JSON, and exits with status 1 if
+any operation failed, e.g. with 'database is locked'.
+
+Run it once with the defaults and once with --journal-mode DELETE --retries 0
+to compare against plain SQLite settings.
+
+Usage: python scripts/db_stress.py [--writers 8] [--readers 8] [--seconds 10]
+"""
+
+import sys, os
+# Include the application folder in path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import argparse
+import datetime
+import json
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from flask import Flask
+from models import db, Student, Administrator, Group, Assignment, Submission, TestCase
+from database import configure_database, retry_on_lock
+from utils import save_results, get_results
+
+STUDENTS = 200
+TEST_CASES = 10
+
+
+def create_app(work_folder, args):
+    app = Flask(__name__)
+    app.config['SECRET_KEY']='thisissecretkey'
+    app.config['SQLALCHEMY_DATABASE_URI']='sqlite:///' + os.path.join(work_folder, "stress.db")
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS']=False
+    # Results of submissions not graded yet are looked up in here
+    app.config['SUBMISSIONS_FOLDER']=os.path.join(work_folder, "submissions")
+
+    app.config['SQLITE_JOURNAL_MODE']=args.journal_mode
+    app.config['SQLITE_BUSY_TIMEOUT']=args.busy_timeout
+    app.config['DATABASE_POOL_SIZE']=args.writers + args.readers
+    app.config['DATABASE_LOCK_RETRIES']=args.retries
+
+    db.init_app(app)
+    configure_database(app)
+    return app
+
+
+def populate():
+    """Returns the ids of the students and the assignment"""
+
+    admin = Administrator(first_name="Stress", last_name="Test", email="stress@test.com",
+                          password="stress")
+    group = Group(name="Stress", administrator=admin)
+    assignment = Assignment(title="Stress", group=group, linting=0,
+                            deadline=datetime.datetime.now() + datetime.timedelta(days=7))
+    for number in range(TEST_CASES):
+        TestCase(assignment=assignment, exp_input=str(number), exp_output=str(number * 2),
+                 visible=number % 2 == 0)
+
+    # Hashing every password is slow and irrelevant here
+    students = [Student(first_name="Student", last_name=str(number), cms_id=number,
+                        email="student{}@test.com".format(number), password="", group=group)
+                for number in range(STUDENTS)]
+    db.session.add_all([admin, group, assignment] + students)
+    db.session.commit()
+
+    return [student.id for student in students], assignment.id
+
+
+def fake_result(assignment):
+    passed = [random.random() < 0.7 for _ in assignment.test_cases]
+    return {
+        "test_cases": [{"passed": test_passed, "verdict": "AC" if test_passed else "WA",
+                        "output": "", "time_elapsed": random.random()}
+                       for test_passed in passed],
+        "test_cases_passed": sum(passed),
+        "total_test_cases": len(passed),
+        "percentages": {"test_cases": 100, "linter": 0},
+        "scores": {"overall": 100 * sum(passed) / len(passed),
+                   "test_cases": 100 * sum(passed) / len(passed), "linter": 0},
+        "time_limit": 0
+    }
+
+
+@retry_on_lock
+def submit(student_id, assignment_id):
+    student = Student.query.get(student_id)
+    assignment = Assignment.query.get(assignment_id)
+    submission = Submission.upsert(student, assignment)
+    db.session.commit()
+    return submission
+
+
+def write(student_ids, assignment_id):
+    submission = submit(random.choice(student_ids), assignment_id)
+    save_results(submission, submission.assignment, fake_result(submission.assignment), "0" * 64)
+
+
+def read(student_ids, assignment_id):
+    submissions = (Submission.query.filter_by(assignment_id=assignment_id)
+                   .order_by(Submission.submission_time.desc(), Submission.id.desc())
+                   .limit(50).all())
+    for submission in submissions[:5]:
+        get_results(submission)
+
+
+def run_stress(args):
+    work_folder = tempfile.mkdtemp(prefix="codebench-")
+    try:
+        app = create_app(work_folder, args)
+        os.makedirs(app.config['SUBMISSIONS_FOLDER'])
+        with app.app_context():
+            db.create_all()
+            student_ids, assignment_id = populate()
+
+        operations = Counter()
+        errors = Counter()
+        latencies = {"write": [], "read": []}
+        lock = threading.Lock()
+        stop_at = time.time() + args.seconds
+
+        def worker(kind, operation):
+            while time.time() < stop_at:
+                with app.app_context():
+                    start = time.time()
+                    try:
+                        operation(student_ids, assignment_id)
+                    except Exception as error:
+                        db.session.rollback()
+                        with lock:
+                            errors["{}: {}".format(kind, str(error).splitlines()[0])] += 1
+                    else:
+                        with lock:
+                            operations[kind] += 1
+                            latencies[kind].append(time.time() - start)
+                    finally:
+                        db.session.remove()
+
+        threads = ([threading.Thread(target=worker, args=("write", write))
+                    for _ in range(args.writers)] +
+                   [threading.Thread(target=worker, args=("read", read))
+                    for _ in range(args.readers)])
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        report = {
+            "journal_mode": args.journal_mode,
+            "busy_timeout": args.busy_timeout,
+            "retries": args.retries,
+            "writers": args.writers,
+            "readers": args.readers,
+            "seconds": args.seconds,
+            "errors": dict(errors)
+        }
+        for kind, kind_latencies in latencies.items():
+            kind_latencies.sort()
+            report[kind] = {
+                "operations": operations[kind],
+                "per_second": operations[kind] / args.seconds,
+                "latency_max": kind_latencies[-1] if kind_latencies else None,
+            }
+        return report
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--journal-mode", default="WAL")
+    parser.add_argument("--busy-timeout", type=int, default=5000, help="Milliseconds")
+    parser.add_argument("--retries", type=int, default=5,
+                        help="Retries of write transactions on a locked database")
+    args = parser.parse_args()
+
+    report = run_stress(args)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+    if report["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Script to import the Students of a Group from a CSV roster
+
+The roster needs a header row with the columns cms_id, first_name, last_name,
+email and password. Existing students, matched by cms_id, are updated.
+
+Usage: python scripts/import_roster.py <group_id> <roster.csv> [--batch-size 500] [--workers 4]
+"""
+
+import sys, os
+# Include the application folder in path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import argparse
+import json
+import time
+
+from flask import Flask
+from models import db, Group
+from database import configure_database
+from roster import import_roster, RosterError
+
+app = Flask(__name__)
+app.config['SECRET_KEY']='thisissecretkey'
+
+# Database Configurations
+app.config['SQLALCHEMY_DATABASE_URI']='sqlite:///../database.db'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS']=False
+db.init_app(app)
+configure_database(app)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("group_id", type=int)
+    parser.add_argument("roster", help="Path of the CSV roster")
+    parser.add_argument("--batch-size", type=int, default=500,
+                        help="Students written per statement")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Threads hashing passwords")
+    args = parser.parse_args()
+    app.config['ROSTER_HASH_WORKERS']=args.workers
+
+    with app.app_context():
+        group = Group.query.get(args.group_id)
+        if group is None:
+            sys.exit("Group {} does not exist".format(args.group_id))
+
+        start = time.time()
+        try:
+            with open(args.roster, "rb") as roster_file:
+                report = import_roster(group, roster_file, args.batch_size)
+        except RosterError as error:
+            sys.exit(str(error))
+
+    for rejected in report["rejected"]:
+        print("Line {line}: {reason} (cms_id {cms_id})".format(**rejected), file=sys.stderr)
+    print(json.dumps({"created": report["created"], "updated": report["updated"],
+                      "rejected": len(report["rejected"]),
+                      "seconds": round(time.time() - start, 2)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
 from flask import Blueprint, request
 from flask_marshmallow import Marshmallow 
 from marshmallow import fields, Schema, pre_dump
-from models import Administrator, Assignment, Submission, Student
+from sqlalchemy import func
+from models import db, Administrator, Assignment, Submission, Student, TestCase
 from flask_jwt_extended import get_jwt_identity
-from utils import get_user
 
 serializers_bp = Blueprint("serializers_bp", __name__)
 
@@ -38,31 +38,49 @@ class AssignmentSchema(ma.Schema):
     submission = fields.Bool()
     total_test_cases = fields.Int()
 
-    @pre_dump
-    def add_total_count_or_submission(self, in_data, **kwargs):
-        user_type = get_jwt_identity()["mode"]
+    @pre_dump(pass_many=True)
+    def add_counts_and_submission_status(self, data, many, **kwargs):
+        """Adds the number of test cases to every assignment along with the total
+        submission count in Admin mode or the submission status in Student mode.
+
+        Counts come from a single GROUP BY query for all the assignments being
+        dumped, so the number of queries does not grow with the assignments"""
+
+        assignments = data if many else [data]
+        assignment_ids = [assignment.id for assignment in assignments]
+        if not assignment_ids:
+            return data
+
+        test_case_counts = dict(
+            db.session.query(TestCase.assignment_id, func.count(TestCase.id))
+            .filter(TestCase.assignment_id.in_(assignment_ids))
+            .group_by(TestCase.assignment_id)
+        )
+        for assignment in assignments:
+            setattr(assignment, "total_test_cases", test_case_counts.get(assignment.id, 0))
+
+        jwt_data = get_jwt_identity()
 
         # In Admin mode, add total submission count
-        if user_type == "admin":
-            submissions_count = len(in_data.submissions)
-            
-            setattr(in_data, "total_submissions", submissions_count)
+        if jwt_data["mode"] == "admin":
+            submission_counts = dict(
+                db.session.query(Submission.assignment_id, func.count(Submission.id))
+                .filter(Submission.assignment_id.in_(assignment_ids))
+                .group_by(Submission.assignment_id)
+            )
+            for assignment in assignments:
+                setattr(assignment, "total_submissions", submission_counts.get(assignment.id, 0))
 
         # In student mode, add submission status
         else:
-            user = get_user(get_jwt_identity())
-            common_submissions = Submission.query.filter(
-                (Submission.student == user) & (Submission.assignment==in_data)
-            ).all()
-            setattr(in_data, "submission", len(common_submissions)> 0)
-
-        return in_data
+            submitted = {assignment_id for assignment_id, in
+                         db.session.query(Submission.assignment_id).distinct()
+                         .filter(Submission.student_id == jwt_data["id"])
+                         .filter(Submission.assignment_id.in_(assignment_ids))}
+            for assignment in assignments:
+                setattr(assignment, "submission", assignment.id in submitted)
 
-    @pre_dump
-    def add_number_of_test_cases(self, in_data, **kwargs):
-        test_cases = in_data.test_cases
-        setattr(in_data, "total_test_cases", len(test_cases))
-        return in_data
+        return data
 
 assignment_schema=AssignmentSchema()
 assignments_schema=AssignmentSchema(many=True)
@@ -97,6 +115,13 @@ class SubmissionSchema(ma.Schema):
 submission_schema=SubmissionSchema(exclude=('student.email','student.group', 'student.first_name', 'student.last_name'))
 submissions_schema=SubmissionSchema(exclude=('student.email','student.group'),many=True) 
 
+class SubmissionFileSchema(ma.Schema):
+    class Meta:
+        fields=("id","submission_time","extension","size")
+
+
+submission_files_schema=SubmissionFileSchema(many=True)
+
 class TestCaseSchema(ma.Schema):
     class Meta:
         fields=("expected_output","expected_input")
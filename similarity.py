@@ -0,0 +1,165 @@
+"""Detection of similar submissions of an Assignment
+
+Every submitted file is fingerprinted as it is stored:
+ - The source code is reduced to a sequence of tokens, dropping comments and
+   whitespace and replacing every identifier, number and string by a
+   placeholder, so renaming variables or reformatting changes nothing
+ - Every k consecutive tokens (a 'k-gram') are hashed
+ - Winnowing keeps the smallest hash of every window of consecutive hashes.
+   Any run of at least window + k - 1 tokens two files have in common is
+   guaranteed to give them a shared fingerprint, while only a fraction of
+   the hashes has to be stored
+
+The fingerprints are stored as Fingerprint rows indexed by (assignment_id,
+hash), and replaced whenever the Submission is resubmitted. Similar pairs
+are then found by joining the fingerprints of an Assignment on their hash,
+which only ever touches pairs that share something instead of comparing
+every pair of files. Fingerprints found in too many submissions, like code
+given out with the assignment, are left out.
+"""
+import hashlib
+import re
+
+from models import db, Fingerprint, Submission, Student
+
+KEYWORDS = frozenset("""
+    and as assert async await break case catch class const continue def default del do elif
+    else except extends final finally for from global if implements import in include is
+    lambda new nonlocal not or pass private protected public raise return static struct
+    switch this throw throws try using void while with yield int long short char float
+    double bool boolean unsigned signed auto template typename namespace std print
+    printf scanf cin cout input range len self True False None true false null NULL
+""".split())
+
+TOKENS = re.compile(r'''
+    (?P<comment>\#[^\n]*|//[^\n]*|/\*[\s\S]*?\*/)
+  | (?P<string>"""[\s\S]*?"""|\'\'\'[\s\S]*?\'\'\'|"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+  | (?P<name>[A-Za-z_]\w*)
+  | (?P<number>\d[\w.]*)
+  | (?P<symbol>\S)
+''', re.VERBOSE)
+
+
+def tokenize(source):
+    """Returns the normalized tokens of the source code (str)"""
+
+    tokens = []
+    for match in TOKENS.finditer(source):
+        kind = match.lastgroup
+        if kind == "comment":
+            continue
+        elif kind == "string":
+            tokens.append("S")
+        elif kind == "number":
+            tokens.append("N")
+        elif kind == "name":
+            token = match.group()
+            tokens.append(token if token in KEYWORDS else "V")
+        else:
+            tokens.append(match.group())
+    return tokens
+
+
+def _hash(kgram):
+    # Stable across processes, unlike hash(), and fits a signed 64 bit column
+    digest = hashlib.blake2b(" ".join(kgram).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def fingerprint(source, k=6, window=5):
+    """Returns the set of fingerprints of the source code (str or bytes)"""
+
+    if isinstance(source, bytes):
+        source = source.decode(errors="replace")
+
+    tokens = tokenize(source)
+    hashes = [_hash(tokens[start:start + k]) for start in range(len(tokens) - k + 1)]
+    if len(hashes) <= window:
+        # Shorter than a single window, which would keep its smallest hash
+        return {min(hashes)} if hashes else set()
+
+    fingerprints = set()
+    selected = -1
+    for start in range(len(hashes) - window + 1):
+        # The rightmost smallest hash of the window, only taken again once it
+        # leaves the window
+        if selected < start:
+            selected = start
+            for position in range(start + 1, start + window):
+                if hashes[position] <= hashes[selected]:
+                    selected = position
+        elif hashes[start + window - 1] <= hashes[selected]:
+            selected = start + window - 1
+        fingerprints.add(hashes[selected])
+    return fingerprints
+
+
+def index_submission(submission, fingerprints):
+    """Replaces the stored fingerprints of submission. Left for the caller to commit"""
+
+    Fingerprint.query.filter_by(submission_id=submission.id).delete(synchronize_session=False)
+    if fingerprints:
+        db.session.execute(Fingerprint.__table__.insert(), [
+            {"assignment_id": submission.assignment_id, "submission_id": submission.id,
+             "hash": value}
+            for value in fingerprints
+        ])
+
+
+SIMILAR_PAIRS = db.text(
+    "WITH common AS ("
+    "    SELECT hash FROM fingerprints WHERE assignment_id = :assignment_id "
+    "    GROUP BY hash HAVING COUNT(*) > :max_submissions), "
+    "totals AS ("
+    "    SELECT submission_id, COUNT(*) AS total FROM fingerprints "
+    "    WHERE assignment_id = :assignment_id GROUP BY submission_id), "
+    "pairs AS ("
+    "    SELECT first.submission_id AS first_id, second.submission_id AS second_id, "
+    "           COUNT(*) AS shared "
+    "    FROM fingerprints AS first JOIN fingerprints AS second "
+    "      ON second.assignment_id = first.assignment_id AND second.hash = first.hash "
+    "     AND second.submission_id > first.submission_id "
+    "    WHERE first.assignment_id = :assignment_id "
+    "      AND first.hash NOT IN (SELECT hash FROM common) "
+    "    GROUP BY first.submission_id, second.submission_id "
+    "    HAVING COUNT(*) >= :min_shared) "
+    "SELECT first_id, second_id, shared, "
+    "       CAST(shared AS FLOAT) / MIN(first_totals.total, second_totals.total) AS similarity "
+    "FROM pairs "
+    "JOIN totals AS first_totals ON first_totals.submission_id = first_id "
+    "JOIN totals AS second_totals ON second_totals.submission_id = second_id "
+    "ORDER BY similarity DESC, shared DESC LIMIT :limit"
+)
+
+
+def similar_pairs(assignment, limit=20, min_shared=5, common_fraction=0.5):
+    """Returns up to limit pairs of submissions of assignment, most similar
+    first. similarity is the share of the smaller submission's fingerprints
+    found in the other one. Fingerprints found in more than common_fraction
+    of the submissions (and at least 2) are ignored"""
+
+    submission_count = (db.session.query(db.func.count(db.distinct(Fingerprint.submission_id)))
+                        .filter(Fingerprint.assignment_id == assignment.id).scalar())
+    max_submissions = max(2, int(submission_count * common_fraction))
+
+    rows = db.session.execute(SIMILAR_PAIRS, {
+        "assignment_id": assignment.id, "max_submissions": max_submissions,
+        "min_shared": min_shared, "limit": limit
+    }).fetchall()
+
+    submission_ids = {row[0] for row in rows} | {row[1] for row in rows}
+    students = {}
+    if submission_ids:
+        students = {
+            submission_id: {"submission_id": submission_id, "cms_id": cms_id,
+                            "name": "{} {}".format(first_name, last_name)}
+            for submission_id, cms_id, first_name, last_name in
+            db.session.query(Submission.id, Student.cms_id, Student.first_name, Student.last_name)
+            .join(Student, Submission.student_id == Student.id)
+            .filter(Submission.id.in_(submission_ids))
+        }
+
+    return [{"first": students.get(first_id, {"submission_id": first_id}),
+             "second": students.get(second_id, {"submission_id": second_id}),
+             "shared_fingerprints": shared, "similarity": round(similarity, 4)}
+            for first_id, second_id, shared, similarity in rows]
@@ -0,0 +1,98 @@
+"""Content addressed file storage
+
+Files are stored once per distinct content, named by the SHA-256 of their
+bytes and sharded into sub-folders by the first characters of the name, so
+no single folder grows too large to list:
+
+    <folder>/ab/abcdef0123...
+
+A suffix such as a file extension may be added to the name, for files that
+are run by a program going by their extension.
+
+Storing the same content twice keeps a single file. Files are streamed in
+and out, so they never have to fit in memory. Stored files are never
+modified, as the same file may be referred to from any number of places.
+"""
+import hashlib
+import os
+import tempfile
+
+from flask import current_app
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class BlobStore:
+    """Stores files in folder by the hash of their content"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, digest, suffix=""):
+        """Returns the path of the file with the given digest"""
+
+        return os.path.join(self.folder, digest[:2], digest + suffix)
+
+    def exists(self, digest, suffix=""):
+        return os.path.exists(self.path(digest, suffix))
+
+    def open(self, digest, suffix=""):
+        return open(self.path(digest, suffix), "rb")
+
+    def remove(self, digest, suffix=""):
+        """Deletes the file with the given digest. Only for files nothing refers to"""
+
+        try:
+            os.remove(self.path(digest, suffix))
+        except FileNotFoundError:
+            pass
+
+    def put(self, source, head=b"", suffix=""):
+        """Stores the bytes or binary file source, preceded by head, and
+        returns (digest, size) of the stored content"""
+
+        digest = hashlib.sha256()
+        size = 0
+
+        # Written to a temporary file first so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                for chunk in _chunks(source, head):
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+                    size += len(chunk)
+
+            path = self.path(digest.hexdigest(), suffix)
+            if os.path.exists(path):
+                os.remove(temp_path)    # Same content is already stored
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return digest.hexdigest(), size
+
+
+def _chunks(source, head):
+    if head:
+        yield head
+    if isinstance(source, bytes):
+        if source:
+            yield source
+        return
+    for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+        yield chunk
+
+
+def get_store(config_key):
+    """Returns the BlobStore of the application in the folder set by config_key"""
+
+    stores = current_app.extensions.setdefault("blob_stores", {})
+    if config_key not in stores:
+        stores[config_key] = BlobStore(current_app.config[config_key])
+    return stores[config_key]
@@ -0,0 +1,149 @@
+import sys, os
+# Include the application folder in path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import datetime
+import io
+from contextlib import contextmanager
+
+import pytest
+from flask import Flask
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import db, Administrator, Group, Student, Assignment, TestCase
+from database import configure_database
+from storage import get_store
+from utils import save_submission
+
+
+FOLDERS = ("SUBMISSIONS_FOLDER", "TESTCASES_FOLDER", "RESULT_CACHE_FOLDER", "BUILD_CACHE_FOLDER")
+
+
+@pytest.fixture
+def app(tmp_path):
+    """An application on its own database and folders, the one of core.py is
+    bound to database.db"""
+
+    app = Flask(__name__)
+    app.config['SECRET_KEY']='thisissecretkey'
+    app.config['SQLALCHEMY_DATABASE_URI']='sqlite:///' + str(tmp_path / "test.db")
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS']=False
+    for folder in FOLDERS:
+        app.config[folder]=str(tmp_path / folder.lower())
+        os.makedirs(app.config[folder])
+
+    db.init_app(app)
+    configure_database(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app, monkeypatch):
+    """Test client of the application of core.py, using the database and folders of app"""
+
+    import core
+    for key in ("SQLALCHEMY_DATABASE_URI",) + FOLDERS:
+        monkeypatch.setitem(core.app.config, key, app.config[key])
+    monkeypatch.setitem(core.app.extensions, "blob_stores", {})
+    return core.app.test_client()
+
+
+@pytest.fixture
+def admin_headers(client, group):
+    import core
+    with core.app.app_context():
+        token = create_access_token(identity={"mode": "admin", "id": group.administrator.id})
+    return {"Authorization": "Bearer " + token}
+
+
+@pytest.fixture
+def student_headers(client, student):
+    import core
+    with core.app.app_context():
+        token = create_access_token(identity={"mode": "student", "id": student.id})
+    return {"Authorization": "Bearer " + token}
+
+
+@pytest.fixture
+def other_admin_headers(client, app):
+    """Headers of an Administrator that owns none of the test data"""
+
+    import core
+    admin = Administrator(first_name="Other", last_name="Admin", email="other@test.com",
+                          password="")
+    db.session.add(admin)
+    db.session.commit()
+    with core.app.app_context():
+        token = create_access_token(identity={"mode": "admin", "id": admin.id})
+    return {"Authorization": "Bearer " + token}
+
+
+@pytest.fixture
+def group(app):
+    admin = Administrator(first_name="Test", last_name="Admin", email="admin@test.com",
+                          password="")
+    group = Group(name="Test", administrator=admin)
+    db.session.add_all([admin, group])
+    db.session.commit()
+    return group
+
+
+@pytest.fixture
+def student(group):
+    student = Student(first_name="Test", last_name="Student", cms_id=1,
+                      email="student@test.com", password="", group=group)
+    db.session.add(student)
+    db.session.commit()
+    return student
+
+
+@pytest.fixture
+def assignment(group):
+    """A Python assignment echoing its input twice over two test cases"""
+
+    assignment = Assignment(title="Echo", group=group, linting=0, time_limit=5,
+                            deadline=datetime.datetime.now() + datetime.timedelta(days=7))
+    for number in range(2):
+        TestCase(assignment=assignment, exp_input=str(number),
+                 exp_output="{0}\n{0}\n".format(number), visible=True)
+    db.session.add(assignment)
+    db.session.commit()
+    return assignment
+
+
+ECHO_TWICE = b"line = input()\nprint(line)\nprint(line)\n"
+
+
+@pytest.fixture
+def submit(student, assignment):
+    """Stores source code as the Python Submission of student for assignment
+    and returns the Submission"""
+
+    def submit(source=ECHO_TWICE, student=student):
+        digest, size = get_store("SUBMISSIONS_FOLDER").put(io.BytesIO(source), suffix=".py")
+        return save_submission(student, assignment, "py", digest, size)
+
+    return submit
+
+
+@contextmanager
+def recorded_statements():
+    """Collects the SQL statements run until the block ends, on any engine as
+    the session of a request may still be bound to the one of app"""
+
+    statements = []
+
+    def record(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
@@ -0,0 +1,191 @@
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import zipfile
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import datetime
+
+import core
+from models import db, Assignment, Group
+from models import TestCase as AssignmentTestCase    # Not collected as a test
+from conftest import recorded_statements
+
+
+def stored_files(app):
+    return sorted(name for _, _, names in os.walk(app.config["TESTCASES_FOLDER"])
+                  for name in names)
+
+
+def upload(client, headers, group, test_cases, files, corrupt=None):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        for name, content in files.items():
+            zip_file.writestr(name, content)
+    if corrupt is not None:
+        # Fails the CRC check once the member has been read
+        data = archive.getvalue()
+        start = data.index(files[corrupt].encode())
+        archive = io.BytesIO(data[:start] + b"X" + data[start + 1:])
+    archive.seek(0)
+
+    assignment = {"title": "Large", "group_id": group.id, "deadline": "2030-01-01T10:00",
+                  "test_cases": test_cases}
+    return client.post("/admin/assignments/new", headers=headers,
+                       data={"assignment": json.dumps(assignment),
+                             "test_cases": (archive, "test_cases.zip")})
+
+
+@pytest.fixture(autouse=True)
+def small_inline_limit(monkeypatch):
+    monkeypatch.setitem(core.app.config, "TESTCASE_INLINE_LIMIT", 16)
+
+
+def test_invalid_test_case_stores_no_files(app, client, admin_headers, group):
+    response = upload(client, admin_headers, group,
+                      [{"input_file": "in", "output_file": "out", "visible": True},
+                       {"input_file": "in", "output_file": "missing", "visible": True}],
+                      {"in": "1\n" * 100, "out": "2\n" * 100})
+
+    assert response.get_json()["description"] == "Invalid Test Case Archive"
+    assert stored_files(app) == []
+    assert Assignment.query.count() == 0
+
+
+def test_corrupt_test_case_file_discards_stored_files(app, client, admin_headers, group):
+    response = upload(client, admin_headers, group,
+                      [{"input_file": "in", "output_file": "out", "visible": True},
+                       {"input_file": "in", "output_file": "bad", "visible": True}],
+                      {"in": "1\n" * 100, "out": "2\n" * 100, "bad": "3\n" * 100},
+                      corrupt="bad")
+
+    assert response.get_json()["description"] == "Invalid Test Case Archive"
+    assert stored_files(app) == []
+
+
+def test_failed_commit_only_discards_files_of_the_request(app, client, admin_headers, group,
+                                                          monkeypatch):
+    test_case = {"input_file": "in", "output_file": "out", "visible": True}
+    upload(client, admin_headers, group, [test_case], {"in": "1\n" * 100, "out": "2\n" * 100})
+    assert len(stored_files(app)) == 2
+
+    def commit():
+        raise RuntimeError("Commit failed")
+
+    monkeypatch.setattr(db.session, "commit", commit)
+    monkeypatch.setitem(core.app.config, "PROPAGATE_EXCEPTIONS", False)
+    monkeypatch.setitem(core.app.config, "PRESERVE_CONTEXT_ON_EXCEPTION", False)
+    response = upload(client, admin_headers, group, [test_case],
+                      {"in": "1\n" * 100, "out": "3\n" * 100})
+
+    assert response.status_code == 500
+    # The input is shared with the first assignment
+    assert len(stored_files(app)) == 2
+
+
+def test_upload_is_read_again_after_a_locked_commit(app, client, admin_headers, group,
+                                                    monkeypatch):
+    commit = db.session.commit
+    attempts = []
+
+    def commit_once_locked():
+        attempts.append(True)
+        if len(attempts) == 1:
+            raise OperationalError("COMMIT", {}, sqlite3.OperationalError("database is locked"))
+        commit()
+
+    monkeypatch.setattr(db.session, "commit", commit_once_locked)
+    response = upload(client, admin_headers, group,
+                      [{"input_file": "in", "output_file": "out", "visible": True}],
+                      {"in": "1\n" * 100, "out": "2\n" * 100})
+
+    assert response.get_json()["status"] == "success"
+    assert len(attempts) == 2
+    assert Assignment.query.one().test_cases[0].get_input() is not None
+    assert len(stored_files(app)) == 2
+
+
+@pytest.mark.parametrize("files", [{"in": "1\n" * 100, "out": "2\n" * 100}, {}])
+def test_uploaded_archive_is_closed(app, client, admin_headers, group, files, monkeypatch):
+    opened = []
+    temporary_file = tempfile.TemporaryFile
+
+    def recorded_temporary_file(*args, **kwargs):
+        opened.append(temporary_file(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(tempfile, "TemporaryFile", recorded_temporary_file)
+    upload(client, admin_headers, group,
+           [{"input_file": "in", "output_file": "out", "visible": True}], files)
+
+    assert len(opened) == 1
+    assert opened[0].closed
+
+
+def test_edited_test_cases_leave_no_unused_files(app, client, admin_headers, group):
+    upload(client, admin_headers, group,
+           [{"input_file": "in", "output_file": "out", "visible": True}],
+           {"in": "1\n" * 100, "out": "2\n" * 100})
+    assignment_id = Assignment.query.one().id
+    kept = AssignmentTestCase.query.one().input_file
+
+    response = client.post("/admin/assignment/edit/{}".format(assignment_id),
+                           headers=admin_headers,
+                           json={"title": "Edited", "deadline": "2030-01-01 10:00",
+                                 "test_cases": [{"expected_input": "1\n" * 100,
+                                                 "expected_output": "3\n" * 100}]})
+
+    assert response.get_json()["status"] == "Success"
+    test_case = AssignmentTestCase.query.one()
+    assert test_case.input_file == kept
+    assert test_case.get_expected_output().path.endswith(test_case.output_file)
+    assert stored_files(app) == sorted([test_case.input_file, test_case.output_file])
+
+
+@pytest.fixture
+def assignments(group, assignment, submit):
+    """assignment with a submission and two more Assignments without any"""
+
+    submit()
+    deadline = datetime.datetime.now() + datetime.timedelta(days=7)
+    others = [Assignment(title="Other {}".format(number), group=group, deadline=deadline)
+              for number in range(2)]
+    AssignmentTestCase(assignment=others[0], exp_input="", exp_output="", visible=True)
+    db.session.add_all(others)
+    db.session.commit()
+    return [assignment.id] + [other.id for other in others]
+
+
+def test_assignment_counts_take_the_same_queries_for_any_number(client, admin_headers, group,
+                                                                assignments):
+    url = "/admin/groups/{}/assignments".format(group.id)
+    group_id = group.id
+    with recorded_statements() as statements:
+        listed = client.get(url, headers=admin_headers).get_json()
+
+    counts = {assignment["id"]: (assignment["total_test_cases"], assignment["total_submissions"])
+              for assignment in listed}
+    assert counts == {assignments[0]: (2, 1), assignments[1]: (1, 0), assignments[2]: (0, 0)}
+
+    deadline = datetime.datetime.now() + datetime.timedelta(days=7)
+    group = Group.query.get(group_id)
+    db.session.add_all([Assignment(title="More {}".format(number), group=group,
+                                   deadline=deadline) for number in range(5)])
+    db.session.commit()
+    with recorded_statements() as more_statements:
+        listed = client.get(url, headers=admin_headers).get_json()
+
+    assert len(listed) == 8
+    assert len(more_statements) == len(statements)
+
+
+def test_students_see_which_assignments_they_submitted(client, student_headers, assignments):
+    listed = client.get("/student/assignments", headers=student_headers).get_json()
+
+    assert {assignment["id"]: assignment["submission"] for assignment in listed} == {
+        assignments[0]: True, assignments[1]: False, assignments[2]: False}
+
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import benchmark_grading
+from benchmark_grading import PROGRAMS, make_input, make_expected_output, percentile
+from sandbox import Limits, run_process
+
+
+@pytest.mark.parametrize("program", ["cpu", "io"])
+@pytest.mark.parametrize("size", [1, 10])
+def test_programs_print_the_expected_output(program, size):
+    test_input = make_input(size, seed=3)
+
+    execution = run_process([sys.executable, "-c", PROGRAMS[program]], test_input.encode(),
+                            Limits(time_limit=10), make_expected_output(program, test_input))
+
+    assert execution.passed
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+
+    assert [percentile(values, fraction) for fraction in (0.5, 0.95, 0.99)] == [50, 95, 99]
+    assert percentile([7], 0.99) == 7
+
+
+def test_benchmark_reports_every_scenario(monkeypatch):
+    monkeypatch.setattr(benchmark_grading, "TEST_CASE_COUNTS", (2,))
+    monkeypatch.setattr(benchmark_grading, "INPUT_SIZES", (10,))
+    monkeypatch.setattr(benchmark_grading, "PROGRAMS", {"io": PROGRAMS["io"]})
+    args = benchmark_grading.argparse.Namespace(runner="subprocess", parallel=False,
+                                                concurrency=1, submissions=2, linting=0)
+
+    report = benchmark_grading.run_benchmark(args)
+
+    scenario = report["scenarios"]["io-2tc-10n"]
+    assert scenario["submissions"] == 2
+    assert scenario["passed_share"] == 1.0
+    assert report["overall"]["submissions"] == 2
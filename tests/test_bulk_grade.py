@@ -0,0 +1,87 @@
+import pytest
+
+import core
+from models import db, Student, Submission
+from utils import bulk_grade
+from conftest import recorded_statements
+
+
+@pytest.fixture
+def submissions(group, submit):
+    students = [Student(first_name="Student", last_name=str(number), cms_id=number + 10,
+                        email="student{}@test.com".format(number), password="", group=group)
+                for number in range(3)]
+    db.session.add_all(students)
+    db.session.commit()
+    return [submit(student=student) for student in students]
+
+
+def test_grades_are_saved_with_one_update(app, group, submissions):
+    items = [{"submission_id": submission.id, "submission_grade": 50 + number,
+              "remarks": "Remark {}".format(number)}
+             for number, submission in enumerate(submissions)]
+    ids = [submission.id for submission in submissions]
+    administrator_id = group.administrator.id
+
+    with recorded_statements() as statements:
+        graded, errors = bulk_grade(administrator_id, items, chunk_size=2)
+
+    db.session.expire_all()
+    stored = [(submission.graded, submission.grade_percentage, submission.remarks)
+              for submission in Submission.query.filter(Submission.id.in_(ids))
+                                                .order_by(Submission.id)]
+    assert (graded, errors) == (3, [])
+    assert stored == [(True, 50, "Remark 0"), (True, 51, "Remark 1"), (True, 52, "Remark 2")]
+    # Owners are read in chunks of chunk_size ids
+    assert sum(statement.startswith("SELECT") for statement in statements) == 2
+    assert sum(statement.startswith("UPDATE") for statement in statements) == 1
+
+
+def test_items_that_cannot_be_graded_are_reported(app, group, submissions):
+    first, second, third = (submission.id for submission in submissions)
+    items = [{"submission_id": "abc", "submission_grade": 10},
+             {"submission_id": first, "submission_grade": 101},
+             {"submission_id": second, "submission_grade": 10, "remarks": 5},
+             {"submission_id": third, "submission_grade": 10},
+             {"submission_id": third, "submission_grade": 20},
+             {"submission_id": 0, "submission_grade": 10}]
+
+    graded, errors = bulk_grade(group.administrator.id, items)
+
+    assert graded == 1
+    assert [(error["index"], error["description"]) for error in errors] == [
+        (0, "Invalid Submission"), (1, "Invalid Grade"), (2, "Invalid Remarks"),
+        (4, "Duplicate Submission"), (5, "Submission Does Not Exist")]
+    db.session.expire_all()
+    assert Submission.query.get(third).grade_percentage == 10
+    assert not Submission.query.get(first).graded
+
+
+def test_submissions_of_other_groups_are_not_graded(client, other_admin_headers, submissions):
+    submission_id = submissions[0].id
+
+    response = client.post("/admin/submissions/grade", headers=other_admin_headers,
+                           json={"grades": [{"submission_id": submission_id,
+                                             "submission_grade": 100}]})
+
+    assert response.get_json()["graded"] == 0
+    assert response.get_json()["errors"] == [
+        {"index": 0, "submission_id": submission_id, "description": "Access Denied"}]
+    db.session.expire_all()
+    assert not Submission.query.get(submission_id).graded
+
+
+def test_grade_requests_are_checked(client, admin_headers, submissions, monkeypatch):
+    monkeypatch.setitem(core.app.config, "BULK_GRADE_MAX_ITEMS", 2)
+    items = [{"submission_id": submission.id, "submission_grade": 100}
+             for submission in submissions]
+
+    too_many = client.post("/admin/submissions/grade", headers=admin_headers,
+                           json={"grades": items})
+    no_grades = client.post("/admin/submissions/grade", headers=admin_headers, json={})
+    graded = client.post("/admin/submissions/grade", headers=admin_headers,
+                         json={"grades": items[:2]})
+
+    assert too_many.get_json()["description"] == "Too Many Grades"
+    assert no_grades.get_json()["description"] == "No Grades Given"
+    assert (graded.get_json()["status"], graded.get_json()["graded"]) == ("Success", 2)
@@ -0,0 +1,113 @@
+import sqlite3
+import threading
+
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.pool import QueuePool
+
+from models import db, Student
+from database import retry_on_lock, is_lock_error, begin_write
+
+
+def locked():
+    return OperationalError("COMMIT", {}, sqlite3.OperationalError("database is locked"))
+
+
+def test_pragmas_are_set_on_every_pooled_connection(app):
+    assert isinstance(db.engine.pool, QueuePool)
+
+    # Held at the same time, so they are two connections of the pool
+    with db.engine.connect() as first, db.engine.connect() as second:
+        for connection in (first, second):
+            assert connection.execute("PRAGMA journal_mode").scalar() == "wal"
+            assert connection.execute("PRAGMA busy_timeout").scalar() == 5000
+            assert connection.execute("PRAGMA foreign_keys").scalar() == 1
+            assert connection.execute("PRAGMA synchronous").scalar() == 1     # NORMAL
+        assert first.connection.connection is not second.connection.connection
+
+
+def test_foreign_keys_are_enforced(app):
+    with pytest.raises(IntegrityError):
+        db.session.execute("INSERT INTO students (cms_id, email, group_id) "
+                           "VALUES (1, 'student@test.com', 12345)")
+    db.session.rollback()
+
+
+def test_locked_transaction_is_run_again(app):
+    app.config["DATABASE_LOCK_RETRY_DELAY"] = 0
+    attempts = []
+
+    @retry_on_lock
+    def write():
+        attempts.append(True)
+        if len(attempts) < 3:
+            raise locked()
+        return "written"
+
+    assert write() == "written"
+    assert len(attempts) == 3
+
+
+def test_lock_error_is_raised_once_retries_run_out(app):
+    app.config["DATABASE_LOCK_RETRIES"] = 2
+    app.config["DATABASE_LOCK_RETRY_DELAY"] = 0
+    attempts = []
+
+    @retry_on_lock
+    def write():
+        attempts.append(True)
+        raise locked()
+
+    with pytest.raises(OperationalError) as error:
+        write()
+    assert is_lock_error(error.value)
+    assert len(attempts) == 3
+
+
+def test_other_errors_are_not_retried(app):
+    attempts = []
+
+    @retry_on_lock
+    def write():
+        attempts.append(True)
+        raise OperationalError("SELECT", {}, sqlite3.OperationalError("no such table: x"))
+
+    with pytest.raises(OperationalError):
+        write()
+    assert len(attempts) == 1
+
+
+def test_concurrent_writers_and_readers_do_not_fail(app, group):
+    """A short version of scripts/db_stress.py"""
+
+    group_id = group.id
+    errors = []
+
+    @retry_on_lock
+    def write(writer, number):
+        begin_write()
+        db.session.execute("INSERT INTO students (cms_id, email, group_id) "
+                           "VALUES (:cms_id, :email, :group_id)",
+                           {"cms_id": writer * 1000 + number, "group_id": group_id,
+                            "email": "{}-{}@test.com".format(writer, number)})
+        db.session.commit()
+
+    def run(writer):
+        with app.app_context():
+            try:
+                for number in range(20):
+                    write(writer, number)
+                    Student.query.filter_by(group_id=group_id).count()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=run, args=(writer,)) for writer in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert Student.query.count() == 80
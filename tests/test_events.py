@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+import core
+from events import EventBroker
+from models import db, Student, Assignment, Submission
+from utils import run_test
+
+
+@pytest.fixture
+def broker(client, monkeypatch):
+    """An EventBroker of core.app without the streams of other tests"""
+
+    monkeypatch.setitem(core.app.extensions, "event_broker", None)
+    broker = EventBroker(core.app)
+    monkeypatch.setattr(core, "event_broker", broker)
+    return broker
+
+
+def read_events(response):
+    """Returns the (id, event, data) sent in a Server-Sent Events response"""
+
+    events = []
+    for message in response.get_data(as_text=True).strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in message.splitlines())
+        events.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_events_of_the_grading_are_sent(client, student_headers, broker, submit):
+    submission = submit()
+    stream = broker.start(submission.id)
+    for event, data in [("queued", {}), ("running", {"total_test_cases": 2}),
+                        ("test_case", {"position": 0}), ("done", {"test_cases_passed": 2})]:
+        stream.publish(event, data)
+    stream.close()
+
+    response = client.get("/student/submissions/{}/events".format(submission.id),
+                          headers=student_headers)
+
+    assert response.mimetype == "text/event-stream"
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert read_events(response) == [
+        (0, "queued", {}), (1, "running", {"total_test_cases": 2}),
+        (2, "test_case", {"position": 0}), (3, "done", {"test_cases_passed": 2})]
+
+
+@pytest.mark.parametrize("last_event_id, first_sent", [("1", 2), ("abc", 0)])
+def test_reconnecting_clients_get_the_events_they_missed(client, student_headers, broker,
+                                                         submit, last_event_id, first_sent):
+    submission = submit()
+    stream = broker.start(submission.id)
+    for event in ("queued", "running", "done"):
+        stream.publish(event, {})
+    stream.close()
+
+    response = client.get("/student/submissions/{}/events".format(submission.id),
+                          headers=dict(student_headers, **{"Last-Event-ID": last_event_id}))
+
+    assert [event_id for event_id, _, _ in read_events(response)] == list(range(first_sent, 3))
+
+
+def test_results_are_sent_without_a_stream(client, student_headers, broker, assignment, submit):
+    submission_id, assignment_id = submit().id, assignment.id
+    url = "/student/submissions/{}/events".format(submission_id)
+
+    not_queued = client.get(url, headers=student_headers)
+    run_test(Submission.query.get(submission_id), Assignment.query.get(assignment_id))
+    graded = client.get(url, headers=student_headers)
+
+    assert not_queued.get_json()["description"] == "Submission has not been queued for grading"
+    (event_id, event, data), = read_events(graded)
+    assert (event_id, event, data["test_cases_passed"]) == (0, "done", 2)
+
+
+def test_token_can_be_given_in_the_query_string(client, student_headers, broker, submit):
+    submission = submit()
+    stream = broker.start(submission.id)
+    stream.publish("done", {})
+    stream.close()
+    url = "/student/submissions/{}/events".format(submission.id)
+    token = student_headers["Authorization"].split()[1]
+
+    response = client.get(url + "?token=" + token)
+    without_token = client.get(url)
+
+    assert [event for _, event, _ in read_events(response)] == ["done"]
+    assert without_token.status_code == 401
+
+
+def test_events_of_other_students_are_not_sent(client, student_headers, broker, group, submit):
+    other_student = Student(first_name="Other", last_name="Student", cms_id=2,
+                            email="other@test.com", password="", group=group)
+    db.session.add(other_student)
+    db.session.commit()
+    submission_id = submit(student=other_student).id
+
+    response = client.get("/student/submissions/{}/events".format(submission_id),
+                          headers=student_headers)
+    missing = client.get("/student/submissions/0/events", headers=student_headers)
+
+    assert response.get_json()["description"] == "Access Denied"
+    assert missing.get_json()["description"] == "Submission does not exist"
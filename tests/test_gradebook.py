@@ -0,0 +1,70 @@
+import csv
+import io
+import json
+
+import pytest
+
+import core
+from gradebook import gradebook_query, export_gradebook, GRADEBOOK_COLUMNS
+from models import db, Student
+from utils import run_test
+
+
+@pytest.fixture
+def graded(group, assignment, submit):
+    """The Submission of student, graded, and a second Student that did not submit"""
+
+    submission = submit()
+    run_test(submission, assignment)
+    db.session.add(Student(first_name="No", last_name="Submission", cms_id=2,
+                           email="absent@test.com", password="", group=group))
+    db.session.commit()
+    return submission
+
+
+def test_every_student_gets_a_row(app, group, graded):
+    rows = list(csv.DictReader(io.StringIO("".join(export_gradebook(gradebook_query(group.id))))))
+
+    assert [row["cms_id"] for row in rows] == ["1", "2"]
+    assert list(rows[0]) == list(GRADEBOOK_COLUMNS)
+    assert (rows[0]["submitted"], rows[0]["test_cases_passed"], rows[0]["total_test_cases"]) == (
+        "true", "2", "2")
+    assert (rows[1]["submitted"], rows[1]["graded"], rows[1]["overall_score"]) == (
+        "false", "", "")
+
+
+def test_rows_are_sent_in_batches(app, group, graded):
+    chunks = list(export_gradebook(gradebook_query(group.id), "ndjson", batch_size=1))
+
+    assert len(chunks) == 2
+    assert [json.loads(chunk)["cms_id"] for chunk in chunks] == [1, 2]
+
+
+def test_unsupported_format_is_not_exported(app, group):
+    with pytest.raises(ValueError):
+        list(export_gradebook(gradebook_query(group.id), "xlsx"))
+
+
+def test_assignment_gradebook_is_streamed(client, admin_headers, assignment, graded,
+                                          monkeypatch):
+    monkeypatch.setitem(core.app.config, "GRADEBOOK_BATCH_SIZE", 1)
+    url = "/admin/assignments/{}/gradebook?format=ndjson".format(assignment.id)
+
+    response = client.get(url, headers=admin_headers)
+
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert response.mimetype == "application/x-ndjson"
+    assert "gradebook-assignment-" in response.headers["Content-Disposition"]
+    assert [(row["cms_id"], row["submitted"]) for row in rows] == [(1, True), (2, False)]
+
+
+def test_gradebook_errors(client, admin_headers, other_admin_headers, group):
+    url = "/admin/groups/{}/gradebook".format(group.id)
+
+    unsupported = client.get(url + "?format=xlsx", headers=admin_headers)
+    denied = client.get(url, headers=other_admin_headers)
+    missing = client.get("/admin/groups/0/gradebook", headers=admin_headers)
+
+    assert unsupported.get_json()["message"] == "Unsupported Format"
+    assert denied.get_json()["message"] == "Access Denied"
+    assert missing.get_json()["message"] == "Access Denied"
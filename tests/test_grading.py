@@ -0,0 +1,180 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import grading
+from events import EventBroker
+from grading import GradingQueue, Regrader, DONE
+from models import db, Student, SubmissionResult
+
+
+def wait_for(status, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = status()
+        if job is not None and job["status"] == DONE:
+            return job
+        time.sleep(0.05)
+    raise AssertionError("Job did not finish: {}".format(status()))
+
+
+@pytest.fixture
+def submissions(group, submit):
+    students = [Student(first_name="Student", last_name=str(number), cms_id=number + 10,
+                        email="student{}@test.com".format(number), password="", group=group)
+                for number in range(3)]
+    db.session.add_all(students)
+    db.session.commit()
+    return [submit(student=student) for student in students]
+
+
+@pytest.fixture
+def regrader(app):
+    app.config["RESULT_CACHE_FOLDER"] = None
+    return Regrader(GradingQueue(app), app)
+
+
+def test_regrade_stores_every_result(regrader, submissions, assignment):
+    regrader.start(assignment.id)
+
+    job = wait_for(lambda: regrader.status(assignment.id))
+    assert (job["graded"], job["failed"]) == (3, 0)
+    for submission in submissions:
+        result = SubmissionResult.query.filter_by(submission_id=submission.id).one()
+        assert result.test_cases_passed == 2
+
+
+def test_regrade_does_not_hold_the_write_lock_while_grading(app, regrader, submissions,
+                                                           assignment, monkeypatch):
+    database = app.config["SQLALCHEMY_DATABASE_URI"][len("sqlite:///"):]
+    writes = []
+    regrade = grading.regrade
+
+    def regrade_then_write(*args, **kwargs):
+        result = regrade(*args, **kwargs)
+        # Another writer does not wait for the batch to finish
+        connection = sqlite3.connect(database, timeout=0)
+        try:
+            with connection:
+                connection.execute("UPDATE groups SET name = name")
+            writes.append(True)
+        finally:
+            connection.close()
+        return result
+
+    monkeypatch.setattr(grading, "regrade", regrade_then_write)
+    regrader.start(assignment.id)
+
+    job = wait_for(lambda: regrader.status(assignment.id))
+    assert (job["graded"], job["failed"]) == (3, 0)
+    assert writes == [True] * 3
+
+
+def test_regrade_keeps_results_stored_before_a_failure(regrader, submissions, assignment,
+                                                      monkeypatch):
+    store_results = grading.store_results
+    failing = submissions[1]
+
+    def store_or_fail(submission, *args):
+        store_results(submission, *args)
+        if submission.id == failing.id:
+            raise RuntimeError("Storing failed")
+
+    monkeypatch.setattr(grading, "store_results", store_or_fail)
+    regrader.start(assignment.id)
+
+    job = wait_for(lambda: regrader.status(assignment.id))
+    assert (job["graded"], job["failed"]) == (2, 1)
+    db.session.expire_all()
+    stored = {result.submission_id for result in SubmissionResult.query}
+    assert stored == {submissions[0].id, submissions[2].id}
+
+
+def test_regrade_drops_results_of_a_resubmitted_source(regrader, submissions, assignment,
+                                                      submit, monkeypatch):
+    resubmitted = submissions[0]
+    graded, resubmit = threading.Event(), threading.Event()
+    regrade = grading.regrade
+
+    def regrade_then_wait(submission, *args, **kwargs):
+        result = regrade(submission, *args, **kwargs)
+        if submission.id == resubmitted.id:
+            graded.set()
+            resubmit.wait(10)
+        return result
+
+    monkeypatch.setattr(grading, "regrade", regrade_then_wait)
+    regrader.start(assignment.id)
+    assert graded.wait(10)
+    submit(b"print(input())\n", student=resubmitted.student)
+    resubmit.set()
+
+    job = wait_for(lambda: regrader.status(assignment.id))
+    assert (job["graded"], job["failed"], job["superseded"]) == (2, 0, 1)
+    db.session.expire_all()
+    stored = {result.submission_id for result in SubmissionResult.query}
+    assert stored == {submissions[1].id, submissions[2].id}
+
+
+@pytest.fixture
+def grading_queue(app, monkeypatch):
+    monkeypatch.setattr(grading, "event_broker", EventBroker(app))
+    return GradingQueue(app)
+
+
+def test_resubmission_stream_gets_no_events_of_the_previous_job(grading_queue, submit,
+                                                                monkeypatch):
+    submission = submit()
+    first_started, finish_first = threading.Event(), threading.Event()
+    run_test = grading.run_test
+
+    def run_test_blocking(*args, **kwargs):
+        if not first_started.is_set():
+            first_started.set()
+            finish_first.wait(10)
+        return run_test(*args, **kwargs)
+
+    monkeypatch.setattr(grading, "run_test", run_test_blocking)
+    grading_queue.submit(submission.id, submission.source_digest)
+    assert first_started.wait(10)
+    first_stream = grading.event_broker.get(submission.id)
+
+    grading_queue.submit(submission.id, submission.source_digest)
+    second_stream = grading.event_broker.get(submission.id)
+    finish_first.set()
+    wait_for(lambda: grading_queue.status(submission.id))
+
+    second_events = [event for _, event, _ in second_stream.follow(timeout=10)]
+    assert second_events == ["queued", "running", "test_case", "test_case", "done"]
+    # The first job only published to its own, already closed, Stream
+    assert [event for event, _ in first_stream.events] == ["queued", "running"]
+
+
+def test_results_of_a_resubmitted_source_are_dropped(grading_queue, submit, monkeypatch):
+    submission = submit()
+    first_started, finish_first = threading.Event(), threading.Event()
+    run_test = grading.run_test
+
+    def run_test_blocking(*args, **kwargs):
+        if not first_started.is_set():
+            first_started.set()
+            finish_first.wait(10)
+        return run_test(*args, **kwargs)
+
+    monkeypatch.setattr(grading, "run_test", run_test_blocking)
+    grading_queue.submit(submission.id, submission.source_digest)
+    assert first_started.wait(10)
+
+    # Passes no test case, graded while the job of the first source waits
+    resubmission = submit(b"print(input())\n")
+    grading_queue.submit(resubmission.id, resubmission.source_digest)
+    wait_for(lambda: grading_queue.status(submission.id))
+    finish_first.set()
+    deadline = time.monotonic() + 60
+    while grading_queue.pending and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    db.session.expire_all()
+    assert SubmissionResult.query.filter_by(submission_id=submission.id).one().test_cases_passed == 0
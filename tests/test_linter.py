@@ -0,0 +1,126 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import linter
+from linter import LinterPool, LinterError
+
+# Stands in for a pylint worker: rates a file by the length of its path, and
+# exits on a path ending in "crash" and never responds to one ending in "hang"
+FAKE_WORKER = """
+import json, os, sys, time
+for line in iter(sys.stdin.readline, ""):
+    path = line.rstrip("\\n")
+    if path.endswith("crash"):
+        sys.exit(1)
+    if path.endswith("hang"):
+        time.sleep(60)
+    print(json.dumps({"global_note": len(path), "pid": os.getpid()}), flush=True)
+"""
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    script = tmp_path / "fake_worker.py"
+    script.write_text(FAKE_WORKER)
+    monkeypatch.setattr(linter, "LINTER_SCRIPT", str(script))
+    pool = LinterPool(size=2)
+    yield pool
+    pool.close()
+
+
+def test_pylint_is_not_imported_by_the_grader():
+    root = os.path.join(os.path.dirname(__file__), "..")
+    check = "import sys, utils; sys.exit('pylint' in sys.modules or 'astroid' in sys.modules)"
+
+    assert subprocess.run([sys.executable, "-c", check], cwd=root).returncode == 0
+
+
+def test_workers_are_started_once_and_reused(pool):
+    assert pool.started == []
+
+    notes = [pool.lint("a" * length) for length in range(1, 6)]
+
+    assert notes == [1, 2, 3, 4, 5]
+    assert len(pool.started) == 1
+
+
+def test_no_more_than_size_workers_are_started(pool):
+    barrier = threading.Barrier(6)
+    notes = []
+
+    def lint():
+        barrier.wait()
+        for _ in range(5):
+            notes.append(pool.lint("file.py"))
+
+    threads = [threading.Thread(target=lint) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert notes == [7] * 30
+    assert len(pool.started) <= 2
+
+
+def test_stopped_worker_is_replaced(pool):
+    pool.lint("first.py")
+    (worker,) = pool.started
+
+    with pytest.raises(LinterError):
+        pool.lint("crash")
+
+    assert pool.started == []
+    assert not worker.alive
+    assert pool.lint("second.py") == 9
+    assert len(pool.started) == 1
+
+
+def test_worker_not_responding_is_killed(pool):
+    pool.timeout = 0.5
+    pool.lint("first.py")
+    (worker,) = pool.started
+
+    with pytest.raises(LinterError):
+        pool.lint("hang")
+
+    assert not worker.alive
+    assert pool.lint("second.py") == 9
+
+
+def test_waiting_threads_are_served_after_every_worker_stopped(pool):
+    errors = []
+
+    def lint(path):
+        try:
+            pool.lint(path)
+        except LinterError as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=lint, args=("crash",)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert len(errors) == 3
+    assert pool.lint("file.py") == 7
+
+
+def test_files_are_rated_by_pylint(tmp_path):
+    pytest.importorskip("pylint")
+    source = tmp_path / "submission.py"
+    source.write_text('"""Prints a greeting"""\nprint("Hello")\n')
+    pool = LinterPool(size=1)
+
+    try:
+        assert pool.lint(str(source)) == 10
+        with pytest.raises(LinterError):
+            pool.lint(str(tmp_path / "missing.py"))
+    finally:
+        pool.close()
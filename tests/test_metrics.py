@@ -0,0 +1,28 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import core
+from models import db
+
+
+def test_metrics_are_not_served_without_a_token(client):
+    assert client.get("/metrics").status_code == 404
+
+
+def test_metrics_require_the_token(client, monkeypatch):
+    monkeypatch.setitem(core.app.config, "METRICS_TOKEN", "secret")
+
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    response = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert b"codebench_requests_total" in response.data
+
+
+def test_failed_statement_is_not_left_timing(client):
+    connection = db.session.connection()
+    with pytest.raises(OperationalError):
+        connection.execute("SELECT * FROM missing_table")
+    connection.execute("SELECT 1")
+
+    assert connection.info["metrics_statement_start"] == []
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+import utils
+from result_cache import ResultCache, is_cacheable
+from sandbox import ACCEPTED, WRONG_ANSWER, TIME_LIMIT_EXCEEDED, MEMORY_LIMIT_EXCEEDED
+
+
+def entries(folder):
+    return sorted(name for name in os.listdir(folder) if name.endswith(".json"))
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path), max_entries=10)
+    for number in range(10):
+        cache.put("key{}".format(number), {"number": number})
+        os.utime(os.path.join(str(tmp_path), "key{}.json".format(number)), (number, number))
+    os.utime(os.path.join(str(tmp_path), "key0.json"))     # Just used
+
+    cache.put("key10", {"number": 10})
+
+    # Evicted down to 9 entries, oldest first
+    assert entries(str(tmp_path)) == ["key0.json", "key10.json"] + [
+        "key{}.json".format(number) for number in range(3, 10)]
+    assert cache.total_entries == 9
+    assert cache.get("key0") == {"number": 0}
+
+
+def test_folder_is_only_scanned_when_full(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path), max_entries=100)
+    scans = []
+    scan = cache._scan
+    monkeypatch.setattr(cache, "_scan", lambda: scans.append(1) or scan())
+
+    for number in range(50):
+        cache.put("key{}".format(number), {"number": number})
+    cache.put("key0", {"number": "replaced"})
+
+    assert scans == [1]
+    assert cache.total_entries == 50
+    assert cache.total_bytes == sum(os.path.getsize(os.path.join(str(tmp_path), name))
+                                    for name in entries(str(tmp_path)))
+
+
+@pytest.mark.parametrize("verdicts, cacheable", [
+    ((ACCEPTED, WRONG_ANSWER), True),
+    ((ACCEPTED, TIME_LIMIT_EXCEEDED), False),
+    ((MEMORY_LIMIT_EXCEEDED,), False),
+])
+def test_only_results_of_deterministic_verdicts_are_cacheable(verdicts, cacheable):
+    result = {"test_cases": [{"verdict": verdict} for verdict in verdicts]}
+
+    assert is_cacheable(result) == cacheable
+
+
+def test_timed_out_submission_is_graded_again(app, assignment, submit, monkeypatch):
+    submission = submit()
+    grade = utils.grade
+    graded = []
+
+    def grade_timing_out(*args, **kwargs):
+        result = grade(*args, **kwargs)
+        result["test_cases"][0]["verdict"] = TIME_LIMIT_EXCEEDED
+        graded.append(result)
+        return result
+
+    monkeypatch.setattr(utils, "grade", grade_timing_out)
+    utils.run_test(submission, assignment)
+    utils.run_test(submission, assignment)
+
+    assert len(graded) == 2
+    assert entries(app.config["RESULT_CACHE_FOLDER"]) == []
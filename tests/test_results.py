@@ -0,0 +1,56 @@
+import json
+import os
+
+from models import SubmissionResult
+from models import TestCaseResult as StoredTestCaseResult    # Not collected as a test
+from utils import run_test, get_results
+
+
+def test_results_are_stored_per_test_case(app, assignment, submit):
+    submission = submit(b"print(input())\nprint(0)\n")
+
+    summary = run_test(submission, assignment)
+
+    result = SubmissionResult.query.filter_by(submission_id=submission.id).one()
+    rows = StoredTestCaseResult.query.order_by(StoredTestCaseResult.position).all()
+    assert (result.test_cases_passed, result.total_test_cases) == (1, 2)
+    assert [(row.position, row.test_case_id, row.verdict) for row in rows] == [
+        (0, assignment.test_cases[0].id, "AC"), (1, assignment.test_cases[1].id, "WA")]
+    assert summary["test_cases_passed"] == 1
+
+
+def test_stored_results_are_replaced_when_graded_again(app, assignment, submit):
+    submission = submit(b"print(input())\nprint(0)\n")
+    run_test(submission, assignment)
+
+    resubmission = submit()
+    run_test(resubmission, assignment)
+
+    assert SubmissionResult.query.count() == 1
+    rows = StoredTestCaseResult.query.order_by(StoredTestCaseResult.position)
+    assert [row.verdict for row in rows] == ["AC", "AC"]
+    results = get_results(resubmission)
+    assert results["test_cases_passed"] == 2
+    assert [test_case["expected_output"] for test_case in results["test_cases"]] == [
+        "0\n0\n", "1\n1\n"]
+
+
+def test_results_of_a_json_file_are_still_read(app, assignment, submit):
+    submission = submit()
+    legacy = {"test_cases": [], "test_cases_passed": 0, "total_test_cases": 0}
+    with open(os.path.join(app.config["SUBMISSIONS_FOLDER"], "{}.json".format(submission.id)),
+              "w") as results_file:
+        json.dump(legacy, results_file)
+
+    assert get_results(submission) == legacy
+
+
+def test_administrator_gets_the_stored_results(client, admin_headers, assignment, submit):
+    submission = submit()
+    run_test(submission, assignment)
+    url = "/admin/submissions/{}/results".format(submission.id)
+
+    results = client.get(url, headers=admin_headers).get_json()
+
+    assert results["test_cases_passed"] == 2
+    assert [test_case["verdict"] for test_case in results["test_cases"]] == ["AC", "AC"]
@@ -0,0 +1,63 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash
+
+from models import db, Group, Student
+from roster import import_roster, get_hash_pool
+
+HEADER = "cms_id,first_name,last_name,email,password\n"
+
+
+def roster(*rows):
+    return io.BytesIO((HEADER + "".join(row + "\n" for row in rows)).encode())
+
+
+def test_import_creates_and_updates_students(group, student):
+    report = import_roster(group, roster("1,New,Name,student@test.com,pw",
+                                         "2,Jared,Dunn,jared@test.com,pw"))
+
+    assert report == {"created": 1, "updated": 1, "rejected": []}
+    db.session.expire_all()
+    assert student.first_name == "New"
+    assert Student.query.filter_by(cms_id=2).one().group_id == group.id
+
+
+def test_import_rejects_students_of_another_group(group, student):
+    other = Group(name="Other", administrator=group.administrator)
+    db.session.add(other)
+    db.session.commit()
+
+    report = import_roster(other, roster("1,Taken,Over,taken@test.com,pw",
+                                         "3,Monica,Hall,monica@test.com,pw"))
+
+    assert report["created"] == 1
+    assert report["updated"] == 0
+    assert report["rejected"] == [{"line": 2, "cms_id": 1,
+                                   "reason": "cms_id belongs to a student of another group"}]
+    db.session.expire_all()
+    assert student.group_id == group.id
+    assert student.email == "student@test.com"
+
+
+def test_import_rejects_emails_of_other_students(group, student):
+    report = import_roster(group, roster("2,Jared,Dunn,student@test.com,pw"))
+
+    assert report["created"] == 0
+    assert report["rejected"][0]["reason"] == "Email belongs to another student"
+
+
+def test_passwords_are_hashed_on_the_pool_of_the_application(app, group, student,
+                                                             monkeypatch):
+    monkeypatch.setitem(app.config, "ROSTER_HASH_WORKERS", 3)
+    import_roster(group, roster("1,Test,Student,student@test.com,first"))
+    pool = get_hash_pool()
+    import_roster(group, roster("1,Test,Student,student@test.com,second",
+                                "2,Jared,Dunn,jared@test.com,third"))
+
+    assert get_hash_pool() is pool
+    assert isinstance(pool, ThreadPoolExecutor)
+    assert pool._max_workers == 3
+    db.session.expire_all()
+    assert check_password_hash(student.password, "second")
+    assert check_password_hash(Student.query.filter_by(cms_id=2).one().password, "third")
@@ -0,0 +1,113 @@
+import threading
+
+import pytest
+
+import utils
+from models import db
+from models import TestCaseResult as StoredTestCaseResult    # Not collected as a test
+from utils import grade, run_test, regrade
+
+
+def test_test_cases_run_side_by_side_and_keep_their_order(app, assignment, submit, monkeypatch):
+    submission = submit()
+    app.config.update(PARALLEL_TEST_CASES=True, TEST_CASE_CONCURRENCY=2)
+    # Only passed once both test cases are running at the same time
+    both_running = threading.Barrier(2, timeout=10)
+    threads = set()
+
+    def run_test_case(execute, test_case, time_limit, limits):
+        threads.add(threading.current_thread().name)
+        both_running.wait()
+        return {"passed": True, "verdict": "AC", "output": test_case.input,
+                "visible": test_case.visible, "time_elapsed": 0}
+
+    monkeypatch.setattr(utils, "run_test_case", run_test_case)
+    result = grade(submission.get_submission_filename(), assignment)
+
+    assert [test_case["output"] for test_case in result["test_cases"]] == [b"0", b"1"]
+    assert len(threads) == 2
+
+
+def test_test_cases_run_one_at_a_time_unless_parallel(app, assignment, submit, monkeypatch):
+    submission = submit()
+    app.config.update(PARALLEL_TEST_CASES=False, TEST_CASE_CONCURRENCY=2)
+    threads = []
+
+    def run_test_case(execute, test_case, time_limit, limits):
+        threads.append(threading.current_thread())
+        return {"passed": True, "verdict": "AC", "output": test_case.input,
+                "visible": test_case.visible, "time_elapsed": 0}
+
+    monkeypatch.setattr(utils, "run_test_case", run_test_case)
+    grade(submission.get_submission_filename(), assignment)
+
+    assert threads == [threading.current_thread()] * 2
+
+
+def test_parallel_grading_passes_every_test_case(app, assignment, submit):
+    submission = submit()
+    app.config.update(PARALLEL_TEST_CASES=True, TEST_CASE_CONCURRENCY=2)
+
+    result = grade(submission.get_submission_filename(), assignment)
+
+    assert [test_case["verdict"] for test_case in result["test_cases"]] == ["AC", "AC"]
+    assert result["test_cases_passed"] == 2
+
+
+@pytest.fixture
+def graded(app, assignment, submit, monkeypatch):
+    """A graded submission of assignment, and the test case inputs run since"""
+
+    submission = submit()
+    run_test(submission, assignment)
+
+    inputs = []
+    run_test_case = utils.run_test_case
+
+    def counting_run_test_case(execute, test_case, *args):
+        inputs.append(test_case.input)
+        return run_test_case(execute, test_case, *args)
+
+    monkeypatch.setattr(utils, "run_test_case", counting_run_test_case)
+    return submission, inputs
+
+
+def test_regrade_only_reruns_changed_test_cases(assignment, graded):
+    submission, inputs = graded
+    assignment.test_cases[1].set_content("2", "2\n2\n")
+    db.session.commit()
+
+    summary = regrade(submission, assignment)
+
+    assert inputs == [b"2"]
+    assert summary["test_cases_passed"] == 2
+    rows = StoredTestCaseResult.query.order_by(StoredTestCaseResult.position).all()
+    assert [row.test_case_version for row in rows] == [test_case.version
+                                                       for test_case in assignment.test_cases]
+
+
+def test_regrade_reuses_verdicts_of_unchanged_test_cases(assignment, graded):
+    submission, inputs = graded
+    # Still expects the old output, so only a rerun would fail it
+    assignment.test_cases[1].set_content("1", "changed\n")
+    db.session.commit()
+
+    summary = regrade(submission, assignment)
+
+    assert inputs == [b"1"]
+    assert summary["test_cases_passed"] == 1
+
+
+@pytest.mark.parametrize("change", ["source", "time_limit"])
+def test_regrade_reruns_everything_when_the_verdicts_no_longer_hold(assignment, graded, submit,
+                                                                    change):
+    submission, inputs = graded
+    if change == "source":
+        submission = submit(b"line = input()\nprint(line)\nprint(line)\n\n")
+    else:
+        assignment.time_limit = 3
+        db.session.commit()
+
+    regrade(submission, assignment)
+
+    assert sorted(inputs) == [b"0", b"1"]
@@ -0,0 +1,141 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+from runners import BuildCache, Runner, get_runner, PythonRunner
+from sandbox import Limits, run_process, ACCEPTED, COMPILE_ERROR, TIME_LIMIT_EXCEEDED, \
+                    MEMORY_LIMIT_EXCEEDED
+import utils
+from result_cache import is_cacheable
+from utils import grade
+
+needs_gcc = pytest.mark.skipif(shutil.which("gcc") is None, reason="gcc is not installed")
+
+LIMITS = Limits(time_limit=30, memory=None)
+
+C_ECHO_TWICE = (b"#include <stdio.h>\n"
+                b"int main(void) { int n; scanf(\"%d\", &n); printf(\"%d\\n%d\\n\", n, n); }\n")
+
+
+@pytest.mark.parametrize("filename, name", [("main.py", "python"), ("Main.java", "java"),
+                                            ("main.c", "c"), ("MAIN.CPP", "cpp"),
+                                            ("main.cc", "cpp"), ("main.rb", None)])
+def test_runners_are_picked_by_extension(filename, name):
+    runner = get_runner(filename)
+
+    assert (runner.name if runner is not None else None) == name
+
+
+def test_only_compiled_languages_have_a_source_name():
+    assert not PythonRunner().compiled
+    assert get_runner("main.c").compiled
+
+
+@needs_gcc
+def test_source_is_compiled_once(tmp_path, monkeypatch):
+    source = tmp_path / "main.c"
+    source.write_bytes(C_ECHO_TWICE)
+    cache = BuildCache(str(tmp_path / "builds"))
+    compiles = []
+    monkeypatch.setattr("runners.run_process",
+                        lambda command, *args, **kwargs: compiles.append(command) or
+                        run_process(command, *args, **kwargs))
+
+    build = cache.get_build(get_runner("main.c"), str(source), LIMITS)
+    again = cache.get_build(get_runner("main.c"), str(source), LIMITS)
+
+    assert build == again
+    assert build.error is None
+    assert len(compiles) == 1
+
+
+@needs_gcc
+def test_failed_build_is_cached_with_the_compiler_output(tmp_path):
+    source = tmp_path / "main.c"
+    source.write_bytes(b"int main(void) { return undeclared; }\n")
+    cache = BuildCache(str(tmp_path / "builds"))
+
+    build = cache.get_build(get_runner("main.c"), str(source), LIMITS)
+
+    assert "undeclared" in build.error
+    assert build.verdict == COMPILE_ERROR
+    # Paths of the temporary build folder are left out
+    assert str(tmp_path) not in build.error
+    assert cache.get_build(get_runner("main.c"), str(source), LIMITS) == build
+
+
+class ScriptRunner(Runner):
+    """Compiles by running its source file as a Python script"""
+
+    name = "script"
+    source_name = "build.py"
+
+    def compile_command(self, build_folder):
+        return [sys.executable, os.path.join(build_folder, self.source_name)]
+
+
+def test_build_that_timed_out_is_built_again(tmp_path):
+    source = tmp_path / "build.py"
+    source.write_bytes(b"import time\ntime.sleep(1)\n")
+    cache = BuildCache(str(tmp_path / "builds"))
+
+    timed_out = cache.get_build(ScriptRunner(), str(source), Limits(time_limit=0.2))
+    retried = cache.get_build(ScriptRunner(), str(source), LIMITS)
+
+    assert (timed_out.folder, timed_out.verdict) == (None, TIME_LIMIT_EXCEEDED)
+    assert "took longer than 0.2 seconds" in timed_out.error
+    assert retried.error is None and os.path.isdir(retried.folder)
+    assert os.listdir(str(tmp_path / "builds")) == [os.path.basename(retried.folder)]
+
+
+def test_killed_compiler_is_not_cached(tmp_path):
+    source = tmp_path / "build.py"
+    source.write_bytes(b"import os, signal\nos.kill(os.getpid(), signal.SIGKILL)\n")
+    cache = BuildCache(str(tmp_path / "builds"))
+
+    build = cache.get_build(ScriptRunner(), str(source), LIMITS)
+
+    assert (build.folder, build.verdict) == (None, MEMORY_LIMIT_EXCEEDED)
+    assert os.listdir(str(tmp_path / "builds")) == []
+
+
+def test_least_recently_used_builds_are_evicted(tmp_path):
+    cache = BuildCache(str(tmp_path), max_entries=2)
+    for number, name in enumerate(["old", "used", "new"]):
+        (tmp_path / name).mkdir()
+        os.utime(str(tmp_path / name), (number, number))
+
+    cache.evict()
+
+    assert sorted(entry.name for entry in tmp_path.iterdir()) == ["new", "used"]
+
+
+@needs_gcc
+@pytest.mark.parametrize("source, verdict", [(C_ECHO_TWICE, ACCEPTED),
+                                             (b"int main(void) {", COMPILE_ERROR)])
+def test_c_submissions_are_graded(app, assignment, tmp_path, source, verdict):
+    submission_file = tmp_path / "main.c"
+    submission_file.write_bytes(source)
+
+    result = grade(str(submission_file), assignment)
+
+    assert [test_case["verdict"] for test_case in result["test_cases"]] == [verdict] * 2
+
+
+@needs_gcc
+def test_compile_timeout_is_not_a_cached_compile_error(app, assignment, tmp_path, monkeypatch):
+    submission_file = tmp_path / "main.c"
+    submission_file.write_bytes(C_ECHO_TWICE)
+    compile_limits = utils.get_compile_limits
+    monkeypatch.setattr(utils, "get_compile_limits", lambda: Limits(time_limit=0.001))
+
+    timed_out = grade(str(submission_file), assignment)
+    monkeypatch.setattr(utils, "get_compile_limits", compile_limits)
+    retried = grade(str(submission_file), assignment)
+
+    assert [test_case["verdict"] for test_case in timed_out["test_cases"]] == [
+        TIME_LIMIT_EXCEEDED] * 2
+    assert not is_cacheable(timed_out)
+    assert [test_case["verdict"] for test_case in retried["test_cases"]] == [ACCEPTED] * 2
@@ -0,0 +1,122 @@
+import os
+import sys
+
+import pytest
+
+from sandbox import Limits, run_process, get_verdict, ACCEPTED, WRONG_ANSWER, \
+                    MEMORY_LIMIT_EXCEEDED, RUNTIME_ERROR, TIME_LIMIT_EXCEEDED
+from zygote import ZygotePool
+from utils import get_preview
+
+LIMITS = Limits(time_limit=5, memory=256 * 1024 * 1024)
+
+PROGRAMS = {
+    "accepted": ("print(input())\n", ACCEPTED),
+    "wrong_answer": ("print('no')\n", WRONG_ANSWER),
+    "diverges_early": ("while True:\n    print('no')\n", WRONG_ANSWER),
+    # Print nothing, so the output does not match but was never seen diverging
+    "out_of_memory": ("blocks = [bytearray(2 ** 20) for _ in range(10 ** 4)]\n",
+                      MEMORY_LIMIT_EXCEEDED),
+    "runtime_error": ("raise ValueError()\n", RUNTIME_ERROR),
+    "too_slow": ("import time\ntime.sleep(30)\n", TIME_LIMIT_EXCEEDED),
+}
+
+
+@pytest.fixture(params=["subprocess", "zygote"])
+def execute(request, tmp_path):
+    """Runs source code like utils.run_test_case does with either runner"""
+
+    pools = []
+
+    def execute(source, limits, preview_length=None):
+        submission = tmp_path / "submission.py"
+        submission.write_text(source)
+        if request.param == "subprocess":
+            return run_process([sys.executable, str(submission)], b"1\n", limits, "1\n",
+                               preview_length)
+        pool = ZygotePool(str(submission), python=sys.executable)
+        pools.append(pool)
+        return pool.run(b"1\n", limits, "1\n", preview_length)
+
+    yield execute
+    for pool in pools:
+        pool.close()
+
+
+@pytest.mark.parametrize("program", sorted(PROGRAMS))
+def test_verdict(execute, program):
+    source, verdict = PROGRAMS[program]
+    limits = Limits(time_limit=1, memory=LIMITS.memory) if program == "too_slow" else LIMITS
+
+    execution = execute(source, limits)
+
+    assert get_verdict(execution, execution.passed, limits.time_limit) == verdict
+
+
+def test_only_early_kill_counts_as_diverged(execute):
+    assert not execute(PROGRAMS["runtime_error"][0], LIMITS).diverged
+    assert execute(PROGRAMS["diverges_early"][0], LIMITS).diverged
+
+
+@pytest.mark.parametrize("length, truncated", [(9, True), (10, False), (11, False)])
+def test_output_of_exactly_the_preview_length_is_not_truncated(execute, length, truncated):
+    execution = execute("import sys\nsys.stdout.write('x' * 10)\n", LIMITS, preview_length=length)
+
+    preview = get_preview(execution.stdout, length)
+    assert preview.startswith("x" * min(length, 10))
+    assert preview.endswith("(output truncated)") == truncated
+
+
+FORK_BOMB = """
+import os, time
+forked = 0
+try:
+    for _ in range(20):
+        if os.fork() == 0:
+            time.sleep(0.5)
+            os._exit(0)
+        forked += 1
+except OSError:
+    pass
+for _ in range(forked):
+    os.wait()
+print(forked)
+"""
+
+needs_root = pytest.mark.skipif(os.geteuid() != 0, reason="Switching users needs root")
+
+
+# Most likely not running anything, as every thread of the user counts
+UNUSED_ID = 43210
+
+
+@pytest.fixture
+def dedicated_user_limits():
+    return Limits(time_limit=5, memory=LIMITS.memory, processes=5, uid=UNUSED_ID,
+                  gid=UNUSED_ID)
+
+
+@needs_root
+def test_subprocess_runs_as_the_dedicated_user_with_a_process_limit(dedicated_user_limits):
+    # The shell reads its own status without starting any process
+    command = ["/bin/sh", "-c", "while read key value rest; do "
+               "[ \"$key\" = Uid: ] && echo $value; done < /proc/self/status; "
+               "while read max key soft hard; do "
+               "[ \"$key\" = processes ] && echo $soft; done < /proc/self/limits"]
+
+    execution = run_process(command, b"", dedicated_user_limits)
+
+    assert execution.stdout.split() == [str(UNUSED_ID).encode(), b"5"]
+
+
+@needs_root
+def test_zygote_child_cannot_fork_past_the_process_limit(tmp_path, dedicated_user_limits):
+    submission = tmp_path / "submission.py"
+    submission.write_text(FORK_BOMB)
+
+    with ZygotePool(str(submission), python=sys.executable) as pool:
+        execution = pool.run(b"", dedicated_user_limits)
+
+    assert execution.exit_code == 0
+    # The child itself is one of the 5
+    assert int(execution.stdout) == 4
@@ -0,0 +1,120 @@
+import pytest
+
+from models import db, Student, Fingerprint
+from similarity import fingerprint, tokenize, similar_pairs
+
+ORIGINAL = b'''
+def total(values):
+    result = 0
+    for value in values:
+        if value % 2 == 0:
+            result += value * 3
+        else:
+            result -= value
+    return result
+
+numbers = [int(part) for part in input().split()]
+print(total(numbers), max(numbers), min(numbers))
+'''
+
+# The same program with renamed variables, other constants and comments
+RENAMED = b'''
+# Sums the numbers
+def f(xs):
+    acc = 10   # Start
+    for x in xs:
+        if x % 7 == 1:
+            acc += x * 5
+        else:
+            acc -= x
+    return acc
+
+ys = [int(p) for p in input().split()]
+print(f(ys), max(ys), min(ys))
+'''
+
+DIFFERENT = b'''
+while True:
+    try:
+        line = input()
+    except EOFError:
+        break
+    print(line[::-1].upper())
+'''
+
+
+def test_renaming_and_comments_do_not_change_fingerprints():
+    assert tokenize("a = 1  # one") == ["V", "=", "N"]
+    assert fingerprint(ORIGINAL) == fingerprint(RENAMED)
+    assert fingerprint(ORIGINAL) & fingerprint(DIFFERENT) == set()
+
+
+def test_shared_code_gives_a_shared_fingerprint():
+    # A run of window + k - 1 common tokens in otherwise different files
+    shared = "while V < N : V += V [ V ] ; V = V"
+    first = "x = [ 1 ] ; import V ; " + shared + " ; return x"
+    second = "def g ( ) : pass ; " + shared + " ; yield V V V"
+
+    assert len(tokenize(shared)) >= 5 + 6 - 1
+    assert fingerprint(first) & fingerprint(second)
+
+
+def test_short_sources_keep_a_fingerprint():
+    assert len(fingerprint("print(a + b + c)", k=6, window=5)) == 1
+    assert fingerprint("print(1)", k=6, window=5) == set()
+
+
+@pytest.fixture
+def students(group):
+    students = [Student(first_name="Student", last_name=str(number), cms_id=number + 10,
+                        email="student{}@test.com".format(number), password="", group=group)
+                for number in range(4)]
+    db.session.add_all(students)
+    db.session.commit()
+    return students
+
+
+def test_copies_are_reported_most_similar_first(app, assignment, submit, students):
+    copy = submit(ORIGINAL, student=students[0])
+    renamed = submit(RENAMED, student=students[1])
+    submit(DIFFERENT, student=students[2])
+    submit(DIFFERENT + b"print(1)\n", student=students[3])
+
+    pairs = similar_pairs(assignment, min_shared=1, common_fraction=1)
+
+    assert [(pair["first"]["submission_id"], pair["second"]["submission_id"])
+            for pair in pairs][0] == (copy.id, renamed.id)
+    assert pairs[0]["similarity"] == 1
+    assert pairs[0]["first"]["cms_id"] == 10
+    assert len(similar_pairs(assignment, limit=1, min_shared=1, common_fraction=1)) == 1
+
+
+def test_fingerprints_of_most_submissions_are_ignored(app, assignment, submit, students):
+    for student in students:
+        submit(ORIGINAL, student=student)
+
+    assert similar_pairs(assignment, min_shared=1, common_fraction=0.5) == []
+
+
+def test_resubmission_replaces_fingerprints(app, assignment, submit, students):
+    submission = submit(ORIGINAL, student=students[0])
+    submit(RENAMED, student=students[1])
+
+    submit(DIFFERENT, student=students[0])
+
+    stored = {row.hash for row in Fingerprint.query.filter_by(submission_id=submission.id)}
+    assert stored == fingerprint(DIFFERENT)
+    assert similar_pairs(assignment, min_shared=1, common_fraction=1) == []
+
+
+def test_similarity_endpoint(client, admin_headers, other_admin_headers, assignment):
+    url = "/admin/assignments/{}/similarity".format(assignment.id)
+
+    for limit in ("0", "1001", "many"):
+        response = client.get(url + "?limit=" + limit, headers=admin_headers)
+        assert response.get_json()["message"] == "Invalid Limit"
+    denied = client.get(url, headers=other_admin_headers)
+    empty = client.get(url, headers=admin_headers)
+
+    assert denied.get_json()["message"] == "Access Denied"
+    assert empty.get_json() == {"status": "success", "pairs": []}
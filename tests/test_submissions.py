@@ -0,0 +1,116 @@
+import io
+from collections import OrderedDict
+
+from flask_jwt_extended import create_access_token
+
+import pytest
+
+import core
+from models import db, Administrator, Student, Submission
+from utils import run_test, get_current_results
+from conftest import ECHO_TWICE
+
+
+@pytest.fixture
+def submissions(group, submit):
+    students = [Student(first_name="Student", last_name=str(number), cms_id=number + 10,
+                        email="student{}@test.com".format(number), password="", group=group)
+                for number in range(3)]
+    db.session.add_all(students)
+    db.session.commit()
+    return [submit(student=student) for student in students]
+
+
+def test_submissions_are_listed_in_pages(client, admin_headers, assignment, submissions):
+    url = "/admin/assignments/{}/submissions".format(assignment.id)
+
+    first = client.get(url + "?limit=2", headers=admin_headers)
+    second = client.get(url + "?limit=2&cursor=" + first.headers["X-Next-Cursor"],
+                        headers=admin_headers)
+
+    # Still a list of submissions, like before the listing was paginated
+    listed = [submission["id"] for submission in first.get_json() + second.get_json()]
+    assert listed == [submission.id for submission in reversed(submissions)]
+    assert "X-Next-Cursor" not in second.headers
+
+
+@pytest.mark.parametrize("args", ["cursor=abc", "cursor=bm90IGpzb24=", "cursor=WzFd",
+                                  "limit=many", "min_score=high"])
+def test_invalid_arguments_are_rejected(client, admin_headers, assignment, args):
+    response = client.get("/admin/assignments/{}/submissions?{}".format(assignment.id, args),
+                          headers=admin_headers)
+
+    assert response.status_code == 400
+    assert response.get_json()["message"] in ("Invalid cursor", "Invalid limit",
+                                               "Invalid min_score")
+
+
+def test_resubmission_time_is_stored_like_the_orm_does(app, submit):
+    submission = submit()
+    resubmission = submit()
+
+    stored = db.session.execute("SELECT submission_time FROM submssions WHERE id = :id",
+                                {"id": resubmission.id}).scalar()
+    assert resubmission.id == submission.id
+    assert stored.endswith(".000000")
+
+
+def test_submission_is_not_stored_when_the_queue_is_full(client, student_headers, assignment,
+                                                         monkeypatch):
+    monkeypatch.setitem(core.app.config, "GRADING_QUEUE_SIZE", 0)
+
+    response = client.post("/student/assignments/{}/submit".format(assignment.id),
+                           headers=student_headers,
+                           data={"source_code": (io.BytesIO(b"print(1)\n"), "main.py")})
+
+    assert response.get_json()["status"] == "error"
+    assert Submission.query.count() == 0
+    assert core.grading_queue.pending == 0
+
+
+def test_status_does_not_report_results_of_an_earlier_source(client, student_headers,
+                                                            assignment, submit, monkeypatch):
+    monkeypatch.setattr(core.grading_queue, "jobs", OrderedDict())
+    submission = submit()
+    run_test(submission, assignment)
+    assert get_current_results(submission)["test_cases_passed"] == 2
+
+    # Stored, but its grading was lost
+    submit(b"print(input())\n")
+    response = client.get("/student/submissions/{}/status".format(submission.id),
+                          headers=student_headers).get_json()
+    assert response["description"] == "Submission has not been queued for grading"
+
+
+def test_every_version_of_a_submission_is_kept(client, admin_headers, submit):
+    submission = submit()
+    submit(b"print(input())\n")
+    url = "/admin/submissions/{}/".format(submission.id)
+
+    files = client.get(url + "files", headers=admin_headers).get_json()
+    first = client.get(url + "file?version={}".format(files[0]["id"]), headers=admin_headers)
+    latest = client.get(url + "file", headers=admin_headers)
+
+    assert [version["size"] for version in files] == [len(ECHO_TWICE), 15]
+    assert first.data == ECHO_TWICE
+    assert latest.data == b"print(input())\n"
+
+
+@pytest.mark.parametrize("path", ["files", "file", "file?version=1"])
+def test_versions_are_only_shown_to_the_administrator_of_the_group(client, student_headers,
+                                                                   submit, path):
+    url = "/admin/submissions/{}/{}".format(submit().id, path)
+    other_admin = Administrator(first_name="Other", last_name="Admin",
+                                email="other@test.com", password="")
+    db.session.add(other_admin)
+    db.session.commit()
+    with core.app.app_context():
+        token = create_access_token(identity={"mode": "admin", "id": other_admin.id})
+
+    response = client.get(url, headers={"Authorization": "Bearer " + token})
+    # Students never get past the admin check
+    student_response = client.get(url, headers=student_headers)
+
+    assert response.status_code == 403
+    assert response.get_json()["message"] == "Access Denied"
+    assert student_response.get_json()["description"] == "Not in Admin Mode"
@@ -0,0 +1,77 @@
+import io
+
+import pytest
+
+from models import db
+from sandbox import File, OutputMatcher, ACCEPTED, WRONG_ANSWER
+from utils import grade
+
+LARGE_INPUT = "".join("{}\n".format(number) for number in range(20000))
+
+
+@pytest.fixture
+def large_assignment(app, assignment):
+    """assignment with its first test case large enough to be stored in files"""
+
+    app.config["TESTCASE_INLINE_LIMIT"] = 1024
+    app.config["TESTCASE_PREVIEW_LENGTH"] = 16
+    assignment.test_cases[0].set_content(io.BytesIO(LARGE_INPUT.encode()),
+                                         LARGE_INPUT + LARGE_INPUT)
+    db.session.commit()
+    return assignment
+
+
+def test_large_parts_are_stored_in_files_with_a_preview(large_assignment):
+    test_case = large_assignment.test_cases[0]
+
+    assert isinstance(test_case.get_input(), File)
+    assert isinstance(test_case.get_expected_output(), File)
+    with open(test_case.get_input().path) as input_file:
+        assert input_file.read() == LARGE_INPUT
+    assert test_case.expected_input == "0\n1\n2\n3\n4\n5\n6\n7\n\n... ({} bytes in total)".format(
+        len(LARGE_INPUT))
+    # Small test cases are still stored in the row
+    assert large_assignment.test_cases[1].get_input() == b"1"
+
+
+def test_version_follows_the_content(large_assignment):
+    test_case = large_assignment.test_cases[0]
+    version = test_case.version
+
+    test_case.set_content(LARGE_INPUT, LARGE_INPUT + LARGE_INPUT)
+    assert test_case.version == version
+
+    test_case.set_content(LARGE_INPUT, LARGE_INPUT)
+    assert test_case.version != version
+
+
+@pytest.mark.parametrize("runner", ["subprocess", "zygote"])
+@pytest.mark.parametrize("source, verdict", [
+    (b"import sys\ndata = sys.stdin.read()\nprint(data + data, end='')\n", ACCEPTED),
+    (b"import sys\nprint(sys.stdin.read(), end='')\n", WRONG_ANSWER)])
+def test_large_test_cases_are_streamed_to_the_submission(app, large_assignment, tmp_path,
+                                                         runner, source, verdict):
+    app.config["GRADING_RUNNER"] = runner
+    submission_file = tmp_path / "submission.py"
+    submission_file.write_bytes(source)
+
+    result = grade(str(submission_file), large_assignment)
+
+    assert result["test_cases"][0]["verdict"] == verdict
+    # Only a preview of the output is kept
+    assert len(result["test_cases"][0]["output"]) < app.config.get("OUTPUT_PREVIEW_LENGTH", 4096) + 100
+
+
+@pytest.mark.parametrize("output, matches", [
+    (LARGE_INPUT, True), ("\n  " + LARGE_INPUT + "\n\n", True),
+    (LARGE_INPUT[:-2], False), (LARGE_INPUT + "extra", False)])
+def test_output_is_compared_with_an_expected_file_in_chunks(tmp_path, output, matches):
+    expected = tmp_path / "expected"
+    expected.write_text(LARGE_INPUT)
+    matcher = OutputMatcher(File(str(expected)), chunk_size=1000)
+
+    data = output.encode()
+    fed = all(matcher.feed(data[start:start + 777]) for start in range(0, len(data), 777))
+
+    assert (fed and matcher.finish()) == matches
+    matcher.close()
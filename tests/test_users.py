@@ -0,0 +1,35 @@
+from flask import g
+
+from models import db
+from utils import get_user
+from conftest import recorded_statements
+
+
+def test_user_is_loaded_once_per_request(app, group):
+    identity = {"mode": "admin", "id": group.administrator.id}
+    group_id = group.id
+    db.session.expire_all()
+
+    with app.app_context(), app.test_request_context(), recorded_statements() as statements:
+        admin = get_user(identity)
+
+        assert get_user(identity) is admin
+        # Loaded along with the groups
+        assert [loaded.id for loaded in admin.groups] == [group_id]
+        assert len(statements) == 1
+
+    with app.app_context(), app.test_request_context():
+        assert "users" not in g
+
+
+def test_unknown_mode_is_not_a_user(app):
+    with app.test_request_context():
+        assert get_user({"mode": "guest", "id": 1}) is None
+
+
+def test_views_reuse_the_user_loaded_by_the_decorator(client, student_headers):
+    with recorded_statements() as statements:
+        response = client.get("/student/details", headers=student_headers)
+
+    assert response.get_json()["email"] == "student@test.com"
+    assert len([statement for statement in statements if "FROM students" in statement]) == 1
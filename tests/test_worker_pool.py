@@ -0,0 +1,65 @@
+import threading
+
+from worker_pool import WorkerPool
+
+
+class FakeWorker:
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool(WorkerPool):
+    def start_worker(self):
+        return FakeWorker()
+
+
+def test_waiting_thread_replaces_a_worker_that_stopped():
+    pool = FakePool(size=2)
+    held = [pool._acquire(), pool._acquire()]
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool._acquire()))
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()    # Both workers are in use
+
+    for worker in held:
+        worker.alive = False
+        pool._release(worker)
+    waiter.join(5)
+
+    assert not waiter.is_alive()
+    assert all(worker.closed for worker in held)
+    assert pool.started == acquired and acquired[0] not in held
+
+
+def test_every_waiting_thread_gets_a_worker_when_all_stopped():
+    pool = FakePool(size=2)
+    used = []
+
+    def use(stop):
+        with pool.worker() as worker:
+            used.append(worker)
+            worker.alive = not stop
+
+    threads = [threading.Thread(target=use, args=(number < 6,)) for number in range(9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert len(used) == 9
+    assert len(pool.started) <= 2
+
+
+def test_workers_released_after_closing_are_not_kept():
+    pool = FakePool(size=1)
+    with pool.worker() as worker:
+        pool.close()
+
+    assert worker.closed
+    assert pool.idle == [] and pool.started == []
@@ -0,0 +1,76 @@
+import os
+import signal
+import sys
+import threading
+import time
+
+import pytest
+
+import zygote
+from sandbox import Limits
+from zygote import ZygotePool, ZygoteError
+
+
+def test_modules_next_to_the_submission_are_only_imported_in_the_child(tmp_path):
+    marker = tmp_path / "imported_by"
+    (tmp_path / "helper.py").write_text(
+        "import os\nopen({!r}, 'w').write(str(os.getpid()))\n".format(str(marker)))
+    submission = tmp_path / "submission.py"
+    submission.write_text("import json, helper\nprint(input())\n")
+
+    with ZygotePool(str(submission), python=sys.executable) as pool:
+        execution = pool.run(b"1\n", Limits(time_limit=5), "1\n")
+        zygote_pid = pool.started[0].process.pid
+
+    assert execution.passed
+    assert marker.read_text() != str(zygote_pid)
+
+
+def test_zygote_not_responding_is_killed_and_replaced(tmp_path, monkeypatch):
+    monkeypatch.setattr(zygote, "RESPONSE_GRACE", 0.5)
+    submission = tmp_path / "submission.py"
+    submission.write_text("print(input())\n")
+
+    with ZygotePool(str(submission), python=sys.executable) as pool:
+        assert pool.run(b"1\n", Limits(time_limit=1), "1\n").passed
+        stuck = pool.started[0]
+        os.kill(stuck.process.pid, signal.SIGSTOP)
+
+        with pytest.raises(ZygoteError):
+            pool.run(b"2\n", Limits(time_limit=1), "2\n")
+        assert not stuck.alive
+        assert pool.started == []
+
+        assert pool.run(b"3\n", Limits(time_limit=1), "3\n").passed
+
+
+def is_running(pid):
+    try:
+        with open("/proc/{}/stat".format(pid)) as stat:
+            return stat.read().rpartition(")")[2].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+@pytest.mark.skipif(zygote.prctl is None or not os.path.isdir("/proc"), reason="Linux only")
+def test_child_is_killed_with_its_zygote(tmp_path):
+    pid_file = tmp_path / "pid"
+    submission = tmp_path / "submission.py"
+    submission.write_text("import os, time\nopen({!r}, 'w').write(str(os.getpid()))\n"
+                          "time.sleep(60)\n".format(str(pid_file)))
+
+    with ZygotePool(str(submission), python=sys.executable) as pool:
+        runner = threading.Thread(target=pytest.raises, args=(ZygoteError, pool.run, b"",
+                                                              Limits(time_limit=60)))
+        runner.start()
+        deadline = time.monotonic() + 10
+        while not pid_file.exists() or not pid_file.read_text():
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        child_pid = int(pid_file.read_text())
+
+        pool.started[0].process.kill()
+        runner.join(10)
+        while is_running(child_pid) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert not is_running(child_pid)
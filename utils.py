@@ -1,119 +1,727 @@
 """Miscellaneous Helper Functions"""
-from functools import wraps # To create decorators
-import subprocess
-import io
+from functools import wraps, partial # To create decorators
+from contextlib import ExitStack
+import os
+import threading
 import json
+import base64
+import hashlib
+import binascii
+import codecs
+import tempfile
+from datetime import datetime
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from math import exp
-from time import time
 
-from pylint.lint import Run as LinterRun
+try:
+    import pwd
+except ImportError:     # Not available on Windows
+    pwd = None
 
-from flask import jsonify
+from flask import jsonify, current_app, has_app_context, g, request
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import joinedload
 from flask_jwt_extended import get_jwt_identity
-from models import Student, Administrator, Group, Assignment, Submission
+from models import db, Student, Administrator, Group, Assignment, Submission, \
+                   SubmissionFile, SubmissionResult, TestCaseResult
+from zygote import ZygotePool
+from metrics import metrics
+from database import begin_write, retry_on_lock
+from result_cache import ResultCache, grading_key, is_cacheable
+from runners import get_runner, BuildCache
+from linter import LinterPool
+from similarity import fingerprint, index_submission
+from storage import get_store
+from sandbox import Limits, run_process, get_verdict, TIME_LIMIT_EXCEEDED, \
+                    MEMORY_LIMIT_EXCEEDED, OUTPUT_LIMIT_EXCEEDED, COMPILE_ERROR
 
 def normalize_linter_score(number):
     return 1/(1+exp(-number))
 
 
+def get_linter_pool():
+    """Returns the LinterPool of the application. Its workers start when first used"""
+
+    extensions = current_app.extensions
+    if "linter_pool" not in extensions:
+        extensions.setdefault("linter_pool", LinterPool(get_config("LINTER_WORKERS", 2),
+                                                        timeout=get_config("LINTER_TIMEOUT", 60)))
+    return extensions["linter_pool"]
+
+
+def lint_submission(submission_file):
+    """Runs the linter on the submission file and returns its normalized score"""
+
+    return normalize_linter_score(get_linter_pool().lint(submission_file))
+
+
 def get_user(jwt_data):
-    """Returns the appropriate Student/Administrator record according to mode""" 
+    """Returns the appropriate Student/Administrator record according to mode
+
+    Records are loaded once per request and cached on flask.g, together with
+    the relationships the views use, so every caller shares the same object"""
 
     mode = jwt_data["mode"]
     id = jwt_data["id"]
-    
+
+    users = g.setdefault("users", {})
+    if (mode, id) in users:
+        return users[(mode, id)]
+
     if mode=="admin":
-        user = Administrator.query.get(id)
+        user = Administrator.query.options(joinedload(Administrator.groups)).get(id)
     elif mode=="student":
-        user = Student.query.get(id)
+        user = Student.query.options(joinedload(Student.group)).get(id)
     else:
         return None
+
+    users[(mode, id)] = user
     return user
 
 
-def admin_required(fn):
+def get_current_user():
+    """Returns the Student/Administrator who made the current request"""
+
+    jwt_data = get_jwt_identity()
+    if jwt_data is None:
+        return None
+    return get_user(jwt_data)
+
+
+def _login_required(mode, fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
         data = get_jwt_identity()
         if data is None:
             return jsonify(status="denied", description="Not Logged In")
 
-        if data['mode'] != 'admin':
-            return jsonify(status="error", description="Not in Admin Mode")
-        else:
-            return fn(*args, **kwargs)
+        if data['mode'] != mode:
+            return jsonify(status="error",
+                           description="Not in {} Mode".format(mode.capitalize()))
+
+        # Loads the user for the rest of the request
+        if get_current_user() is None:
+            return jsonify(status="denied", description="User does not exist")
+
+        return fn(*args, **kwargs)
     return wrapper
 
+def admin_required(fn):
+    return _login_required("admin", fn)
+
 def student_required(fn):
+    return _login_required("student", fn)
+
+
+def token_in_query_string(fn):
+    """Lets the view take the access token from the 'token' query argument
+    when there is no Authorization header, as the browser's EventSource can't
+    set one. Goes above jwt_required. Only for views a browser opens that way,
+    the URL with the token may end up in access logs"""
+
     @wraps(fn)
     def wrapper(*args, **kwargs):
-        data = get_jwt_identity()
-        if data is None:
-            return jsonify(status="denied", description="Not Logged In")
-
-        if data['mode'] != 'student':
-            return jsonify(status="error", description="Not in Student Mode")
-        else:
-            return fn(*args, **kwargs)
+        token = request.args.get("token")
+        if token and "Authorization" not in request.headers:
+            # Read from the environ by flask_jwt_extended
+            request.environ["HTTP_AUTHORIZATION"] = "Bearer " + token
+        return fn(*args, **kwargs)
     return wrapper
 
+
+def encode_cursor(submission):
+    """Returns an opaque cursor pointing right after submission"""
+
+    position = [submission.submission_time.isoformat(), submission.id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns the position encoded by encode_cursor. Raises ValueError with a
+    fixed message if cursor is malformed"""
+
+    try:
+        submission_time, submission_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(submission_time), int(submission_id)
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError("Invalid cursor") from None
+
+
+def _int_arg(args, key, message, default=None):
+    try:
+        return int(args.get(key, default))
+    except (TypeError, ValueError):
+        raise ValueError(message) from None
+
+
+def paginate_submissions(query, args):
+    """Returns a page of the Submission query, newest first, and the cursor of the
+    next page (None for the last page)
+
+    Accepts the following request args:
+     - cursor: The next_cursor of the previous page
+     - limit: Number of submissions in a page
+     - graded: 'true' or 'false'
+     - min_score, max_score: Range of grade_percentage
+
+    Raises ValueError with a message safe to show if any of them is invalid"""
+
+    limit = min(_int_arg(args, "limit", "Invalid limit", get_config("SUBMISSIONS_PAGE_SIZE", 50)),
+                get_config("SUBMISSIONS_MAX_PAGE_SIZE", 200))
+    if limit <= 0:
+        raise ValueError("Invalid limit")
+
+    graded = args.get("graded")
+    if graded is not None:
+        if graded not in ("true", "false"):
+            raise ValueError("Invalid graded filter")
+        query = query.filter(Submission.graded == (graded == "true"))
+
+    if args.get("min_score") is not None:
+        query = query.filter(Submission.grade_percentage >= _int_arg(args, "min_score",
+                                                                     "Invalid min_score"))
+    if args.get("max_score") is not None:
+        query = query.filter(Submission.grade_percentage <= _int_arg(args, "max_score",
+                                                                     "Invalid max_score"))
+
+    if args.get("cursor"):
+        submission_time, submission_id = decode_cursor(args["cursor"])
+
+        query = query.filter(or_(
+            Submission.submission_time < submission_time,
+            and_(Submission.submission_time == submission_time, Submission.id < submission_id)
+        ))
+
+    # One extra row tells whether there is a next page
+    submissions = (query.options(joinedload(Submission.student))
+                        .order_by(Submission.submission_time.desc(), Submission.id.desc())
+                        .limit(limit + 1)
+                        .all())
+
+    next_cursor = None
+    if len(submissions) > limit:
+        submissions = submissions[:limit]
+        next_cursor = encode_cursor(submissions[-1])
+
+    return submissions, next_cursor
+
+
+def get_config(key, default=None):
+    """Returns the app config for key, or default when used outside of the application"""
+
+    if has_app_context():
+        return current_app.config.get(key, default)
+    return default
+
+
+# Limits how many test cases run at the same time on this host, whichever
+# submission they belong to. Created on first use from TEST_CASE_CONCURRENCY
+_test_case_slots = None
+_test_case_slots_lock = threading.Lock()
+
+def get_test_case_slots():
+    global _test_case_slots
+
+    with _test_case_slots_lock:
+        if _test_case_slots is None:
+            concurrency = get_config("TEST_CASE_CONCURRENCY") or os.cpu_count() or 1
+            _test_case_slots = threading.BoundedSemaphore(concurrency)
+    return _test_case_slots
+
+
+def execute_subprocess(submission_file, input_data, limits, expected_output=None,
+                       preview_length=None, build_folder=None):
+    """Runs the submission file in a new process with input_data as its stdin
+    under limits. Compiled languages run the build in build_folder. Returns an
+    Execution, see sandbox.run_process for expected_output and preview_length"""
+
+    runner = get_runner(submission_file)
+    command = runner.run_command(submission_file, build_folder, limits)
+    return run_process(command, input_data, runner.get_limits(limits),
+                       expected_output, preview_length)
+
+
+def get_build_cache():
+    """Returns the BuildCache of the application"""
+
+    extensions = current_app.extensions
+    if "build_cache" not in extensions:
+        folder = get_config("BUILD_CACHE_FOLDER") or os.path.join(tempfile.gettempdir(),
+                                                                  "codebench-builds")
+        extensions["build_cache"] = BuildCache(folder, get_config("BUILD_CACHE_MAX_ENTRIES", 1000))
+    return extensions["build_cache"]
+
+
+def get_compile_limits():
+    """Compilers need more memory than submissions, so only time and output are limited"""
+
+    return Limits(time_limit=get_config("COMPILE_TIME_LIMIT", 30), memory=None,
+                  output=get_config("SUBMISSION_OUTPUT_LIMIT", 8 * 1024 * 1024))
+
+
+# Output stored in place of what the submission printed
+LIMIT_MESSAGES = {
+    TIME_LIMIT_EXCEEDED: "TIME LIMIT EXCEEDED",
+    MEMORY_LIMIT_EXCEEDED: "MEMORY LIMIT EXCEEDED",
+    OUTPUT_LIMIT_EXCEEDED: "OUTPUT LIMIT EXCEEDED"
+}
+
+def get_preview(output, preview_length):
+    """Decodes the first preview_length bytes of output, marking it if it was cut
+    short. Output longer than preview_length was cut short, see sandbox.communicate"""
+
+    if len(output) <= preview_length:
+        return output.decode(errors="replace")
+    # A character split at the end of the preview is left out
+    preview = codecs.getincrementaldecoder("utf-8")(errors="replace").decode(output[:preview_length])
+    return preview + "\n... (output truncated)"
+
+
+# A TestCase as handed to the threads running it. input and output are what it
+# runs with (see TestCase.get_input), expected_input and expected_output what
+# its results show
+TestCaseData = namedtuple("TestCaseData", ["input", "output", "visible",
+                                           "expected_input", "expected_output"])
+
+
+def run_test_case(execute, test_case, time_limit, limits):
+    """Runs a single TestCaseData through execute and returns its results. The
+    output is compared while it is produced and only a preview of it is kept"""
+
+    preview_length = get_config("OUTPUT_PREVIEW_LENGTH", 4096)
+
+    with get_test_case_slots():
+        #checking of the test cases
+        execution = execute(test_case.input, limits, test_case.output, preview_length)
+
+    metrics.observe_phase("spawn", execution.spawn_time)
+    metrics.observe_phase("execute", execution.time_elapsed - execution.spawn_time)
+
+    with metrics.time_phase("compare"):
+        #information to be returned 
+        output = get_preview(execution.stdout, preview_length).strip()
+        passed = bool(execution.passed)
+
+        verdict = get_verdict(execution, passed, time_limit)
+        if verdict in LIMIT_MESSAGES:
+            output = LIMIT_MESSAGES[verdict]
+            passed = False
+
+    return {
+        "passed": passed,
+        "verdict": verdict,
+        "expected_input": test_case.expected_input,
+        "expected_output": test_case.expected_output,
+        "output": output,
+        "visible": test_case.visible,
+        "time_elapsed": execution.time_elapsed
+    }
+
+
+def compile_error_result(test_case, error, verdict=COMPILE_ERROR):
+    """Result of a TestCaseData of a submission that failed to compile, verdict
+    being the limit the compiler ran into if it did"""
+
+    preview_length = get_config("OUTPUT_PREVIEW_LENGTH", 4096)
+
+    return {
+        "passed": False,
+        "verdict": verdict,
+        "expected_input": test_case.expected_input,
+        "expected_output": test_case.expected_output,
+        "output": get_preview(error.encode(), preview_length),
+        "visible": test_case.visible,
+        "time_elapsed": 0
+    }
+
+
+def get_submission_user():
+    """Returns the uid and gid of SUBMISSION_USER, a user name or uid, or
+    (None, None) if submissions run as the grader's user"""
+
+    user = get_config("SUBMISSION_USER")
+    if user is None or pwd is None:
+        return None, None
+    entry = pwd.getpwuid(user) if isinstance(user, int) else pwd.getpwnam(user)
+    return entry.pw_uid, entry.pw_gid
+
+
+def get_limits(time_limit, output_limit=None):
+    """Returns the Limits for running a submission of an assignment with time_limit
+    and output_limit. Assignments without limits of their own use
+    SUBMISSION_TIME_LIMIT and SUBMISSION_OUTPUT_LIMIT. The process limit only
+    applies when SUBMISSION_USER is set"""
+
+    uid, gid = get_submission_user()
+    return Limits(time_limit=time_limit or get_config("SUBMISSION_TIME_LIMIT", 10),
+                  memory=get_config("SUBMISSION_MEMORY_LIMIT", 512 * 1024 * 1024),
+                  output=output_limit or get_config("SUBMISSION_OUTPUT_LIMIT", 8 * 1024 * 1024),
+                  processes=get_config("SUBMISSION_PROCESS_LIMIT", 64), uid=uid, gid=gid)
+
+
+def get_result_cache():
+    """Returns the ResultCache of the application, or None if caching is disabled"""
+
+    folder = get_config("RESULT_CACHE_FOLDER")
+    if not folder:
+        return None
+
+    extensions = current_app.extensions
+    if "result_cache" not in extensions:
+        extensions["result_cache"] = ResultCache(folder,
+                                                 get_config("RESULT_CACHE_MAX_ENTRIES", 10000),
+                                                 get_config("RESULT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+    return extensions["result_cache"]
+
+
 #helper function that returns dictionary containing details of the submission 
-def run_test(submission_object, assignment_object):
+def run_test(submission_object, assignment_object, save=None, progress=None):
+    """Grades the submission, stores its results and returns the part students may see.
+    The results are stored by calling save (save_results by default) with the
+    submission, assignment, result and source hash. progress is called with the
+    position and result of every test case as it finishes"""
 
-    submission_id = submission_object.id
     submission_file = submission_object.get_submission_filename()
 
-    time_limit = assignment_object.time_limit
+    with open(submission_file, "rb") as source_file:
+        source = source_file.read()
+    source_hash = hashlib.sha256(source).hexdigest()
+
+    # Identical source code graded against an unchanged test suite
+    # gets the same result, so it is only graded once
+    result_cache = get_result_cache()
+    result = None
+    if result_cache is not None:
+        cache_key = grading_key(source, os.path.splitext(submission_file)[1], assignment_object)
+        result = result_cache.get(cache_key)
+
+        metrics.grading_cache.inc("hit" if result is not None else "miss")
+        if result is not None and progress is not None:
+            for position, test_case in enumerate(result["test_cases"]):
+                progress(position, test_case)
+
+    if result is None:
+        result = grade(submission_file, assignment_object, progress=progress)
+        if result_cache is not None and is_cacheable(result):
+            result_cache.put(cache_key, result)
+
+    result["student_id"] = submission_object.student.id
+
+    with metrics.time_phase("store"):
+        (save or save_results)(submission_object, assignment_object, result, source_hash)
+
+    return summarize_results(result)
+
+
+def regrade(submission_object, assignment_object, save=None):
+    """Like run_test, but only runs the test cases that were added or changed since
+    the submission was last graded. The verdicts of the others are reused"""
+
+    submission_file = submission_object.get_submission_filename()
+    submission_result = submission_object.result
+
+    with open(submission_file, "rb") as source_file:
+        source = source_file.read()
+    source_hash = hashlib.sha256(source).hexdigest()
+
+    # Stored verdicts only hold for the same source code and time limit
+    if (submission_result is None or submission_result.source_hash != source_hash
+            or submission_result.time_limit != assignment_object.time_limit):
+        return run_test(submission_object, assignment_object, save)
+
+    previous_results = {
+        test_case_result.test_case_id: test_case_result
+        for test_case_result in TestCaseResult.query.filter(
+            TestCaseResult.submission_result_id == submission_result.id)
+    }
+
+    reused = {}
+    for position, test_case in enumerate(assignment_object.test_cases):
+        previous = previous_results.get(test_case.id)
+        if previous is not None and previous.test_case_version == test_case.version:
+            reused[position] = previous.to_dict()
+
+    linter_score = None
+    if submission_result.linter_percentage:
+        linter_score = submission_result.linter_score / submission_result.linter_percentage
+
+    result = grade(submission_file, assignment_object, reused, linter_score)
+
+    result_cache = get_result_cache()
+    if result_cache is not None and is_cacheable(result):
+        cache_key = grading_key(source, os.path.splitext(submission_file)[1], assignment_object)
+        result_cache.put(cache_key, result)
+
+    result["student_id"] = submission_object.student.id
+
+    with metrics.time_phase("store"):
+        (save or save_results)(submission_object, assignment_object, result, source_hash)
+
+    return summarize_results(result)
+
+
+def store_results(submission_object, assignment_object, result, source_hash):
+    """Replaces the stored SubmissionResult of the submission with result.
+    The TestCaseResults are written with a single bulk insert"""
+
+    submission_result = SubmissionResult.get_or_create(submission_object)
+    TestCaseResult.query.filter(
+        TestCaseResult.submission_result_id == submission_result.id
+    ).delete(synchronize_session=False)
+
+    submission_result.update_from_result(result)
+    submission_result.source_hash = source_hash
+    submission_object.test_cases_passed = result["test_cases_passed"]
+    db.session.flush()   # Assigns the id of a new SubmissionResult
+
+    # Results are in the same order as the assignment's test cases
+    db.session.bulk_insert_mappings(TestCaseResult, [
+        {
+            "submission_result_id": submission_result.id,
+            "test_case_id": test_case.id,
+            "test_case_version": test_case.version,
+            "position": position,
+            "passed": test_case_result["passed"],
+            "verdict": test_case_result["verdict"],
+            "output": test_case_result["output"],
+            "time_elapsed": test_case_result["time_elapsed"]
+        }
+        for position, (test_case, test_case_result)
+        in enumerate(zip(assignment_object.test_cases, result["test_cases"]))
+    ])
 
-    test_cases = []
-    result = {
-              "test_cases": test_cases,
-              "student_id": submission_object.student.id,
-              "test_cases_passed": 0
-            }
 
-    for test_case in assignment_object.test_cases:
+@retry_on_lock
+def save_results(submission_object, assignment_object, result, source_hash, source_digest=None):
+    """Stores the results with store_results and commits them. With source_digest,
+    the results are dropped if the submission no longer points at that source,
+    i.e. it was resubmitted while being graded. Returns whether they were stored"""
 
-        start = time()
-        ##in case file is for python compiler
-        if (submission_file.split("."))[-1] == "py":
-            #subprocess to compile the given submitted file and run the test cases on it
-            test_process = subprocess.Popen(['python', submission_file], stdout=subprocess.PIPE,
-                                    stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    if source_digest is not None:
+        # Checked and stored in the same write transaction
+        begin_write()
+        current_digest = (db.session.query(Submission.source_digest)
+                          .filter(Submission.id == submission_object.id).scalar())
+        if current_digest != source_digest:
+            db.session.rollback()
+            return False
+
+    store_results(submission_object, assignment_object, result, source_hash)
+    db.session.commit()
+    return True
+
+
+def get_fingerprints(submission_file):
+    """Fingerprints of the source file for the similarity index. Files larger
+    than SIMILARITY_MAX_SOURCE_SIZE are not indexed"""
+
+    if os.path.getsize(submission_file) > get_config("SIMILARITY_MAX_SOURCE_SIZE", 1024 * 1024):
+        return set()
+
+    with open(submission_file, "rb") as source_file:
+        return fingerprint(source_file.read(), get_config("SIMILARITY_K", 6),
+                           get_config("SIMILARITY_WINDOW", 5))
+
+
+@retry_on_lock
+def save_submission(student, assignment, extension, digest, size):
+    """Points the Submission of student for assignment (created if needed) at the
+    stored source file with digest, keeping its earlier files, and updates its
+    fingerprints. Returns the Submission"""
+
+    fingerprints = get_fingerprints(get_store("SUBMISSIONS_FOLDER").path(digest, "."+extension))
+
+    submission_object = Submission.upsert(student, assignment, extension, digest)
+    db.session.add(SubmissionFile(submission_object, digest, extension, size))
+    index_submission(submission_object, fingerprints)
+    db.session.commit()
+    return submission_object
+
+
+def validate_grade(item):
+    """Returns (grade, remarks) of a manual grading request item, or raises
+    ValueError when the grade isn't a whole number from 0 to 100"""
+
+    try:
+        submission_grade = int(item.get("submission_grade"))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid Grade")
+    if not 0 <= submission_grade <= 100:
+        raise ValueError("Invalid Grade")
+
+    remarks = item.get("remarks")
+    if remarks is not None and not isinstance(remarks, str):
+        raise ValueError("Invalid Remarks")
+    return submission_grade, remarks
+
+
+@retry_on_lock
+def bulk_grade(administrator_id, items, chunk_size=500):
+    """Grades the submissions given as a list of {"submission_id", "submission_grade",
+    "remarks"} in a single transaction. Only submissions of the administrator's
+    groups are graded. Returns the number graded and an error for every item
+    that wasn't, with its index in items"""
+
+    errors = []
+    updates = {}
+    for index, item in enumerate(items):
+        try:
+            submission_id = int(item["submission_id"])
+        except (TypeError, KeyError, ValueError):
+            errors.append({"index": index, "submission_id": None,
+                           "description": "Invalid Submission"})
+            continue
+        if submission_id in updates:
+            errors.append({"index": index, "submission_id": submission_id,
+                           "description": "Duplicate Submission"})
+            continue
+        try:
+            submission_grade, remarks = validate_grade(item)
+        except ValueError as error:
+            errors.append({"index": index, "submission_id": submission_id,
+                           "description": str(error)})
+            continue
+        updates[submission_id] = (index, {"id": submission_id, "graded": True,
+                                          "grade_percentage": submission_grade,
+                                          "remarks": remarks})
+
+    # Owner of every submission, in one query per chunk of ids
+    owners = {}
+    submission_ids = list(updates)
+    for start in range(0, len(submission_ids), chunk_size):
+        owners.update(
+            db.session.query(Submission.id, Group.administrator_id)
+            .join(Assignment, Submission.assignment_id == Assignment.id)
+            .join(Group, Assignment.group_id == Group.id)
+            .filter(Submission.id.in_(submission_ids[start:start + chunk_size]))
+        )
+
+    mappings = []
+    for submission_id, (index, mapping) in updates.items():
+        if submission_id not in owners:
+            errors.append({"index": index, "submission_id": submission_id,
+                           "description": "Submission Does Not Exist"})
+        elif owners[submission_id] != administrator_id:
+            errors.append({"index": index, "submission_id": submission_id,
+                           "description": "Access Denied"})
         else:
-            #in case file is for java compiler
-            test_process =subprocess.Popen(["C:\\Program Files\\Java\\jdk-14.0.1\\bin\\java.exe",submission_file], shell=True,stdout=subprocess.PIPE
-            ,stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+            mappings.append(mapping)
 
+    db.session.bulk_update_mappings(Submission, mappings)
+    db.session.commit()
 
-        # Provided test cases from the admin
-        expected_input = test_case.expected_input
-        expected_output = test_case.expected_output
-        visible = test_case.visible
+    return len(mappings), sorted(errors, key=lambda error: error["index"])
 
-        #checking of the test cases
-        output=test_process.communicate(input=expected_input.encode())[0]
 
-        #information to be returned 
-        output = output.decode().strip()
-        passed = output == expected_output
+def get_results(submission_object):
+    """Returns the full results of a graded submission or None if it has not been graded"""
 
-        exit_code = test_process.wait()
-        end = time()
+    if submission_object.result is not None:
+        return submission_object.result.to_dict()
 
-        time_elapsed = end-start
-        if (time_limit > 0) and (time_elapsed > time_limit):
-            output = "TIME LIMIT EXCEEDED"
-            passed = False
+    # Graded before results were stored in the database
+    results_path = submission_object.get_submission_result_path()
+    if os.path.exists(results_path):
+        with open(results_path) as results_file:
+            return json.load(results_file)
+
+    return None
+
+
+def get_current_results(submission_object):
+    """Like get_results, but returns None if the results are of an earlier source
+    than the one the submission points at, e.g. when its grading was lost on a
+    restart"""
+
+    results = get_results(submission_object)
+    if results is None or submission_object.source_digest is None:
+        return results
+
+    submission_result = submission_object.result
+    if submission_result is None or submission_result.source_hash != submission_object.source_digest:
+        return None
+    return results
 
-        test_cases.append({
-            "passed": passed,
-            "expected_input": expected_input,
-            "expected_output": expected_output,
-            "output": output,
-            "visible": visible,
-            "time_elapsed": time_elapsed
-        })
+
+def grade(submission_file, assignment_object, reused=None, linter_score=None, progress=None):
+    """Runs the submission file against the test cases of the assignment along
+    with the linter and returns the results
+
+    reused maps the position of a test case to a result of it that is still
+    valid, and linter_score is the normalized linter score if it is known.
+    Those are not run again. progress is called with the position and result
+    of every test case that is run as soon as it finishes, from any thread"""
+
+    reused = reused or {}
+
+    runner = get_runner(submission_file)
+    if runner is None:
+        raise ValueError("No runner for " + submission_file)
+
+    time_limit = assignment_object.time_limit
+    limits = get_limits(time_limit, assignment_object.output_limit)
+
+    test_cases = []
+    result = {
+              "test_cases": test_cases,
+              "test_cases_passed": 0
+            }
+
+    # Provided test cases from the admin. Read here so the database is
+    # only ever accessed from the calling thread
+    test_case_data = [TestCaseData(test_case.get_input(), test_case.get_expected_output(),
+                                   test_case.visible, test_case.expected_input,
+                                   test_case.expected_output)
+                      for test_case in assignment_object.test_cases]
+
+    positions_to_run = [position for position in range(len(test_case_data))
+                        if position not in reused]
+    data_to_run = [test_case_data[position] for position in positions_to_run]
+
+    workers = 1
+    if get_config("PARALLEL_TEST_CASES") and len(data_to_run) > 1:
+        workers = min(len(data_to_run), get_config("TEST_CASE_CONCURRENCY") or os.cpu_count() or 1)
+
+    # Compiled once, every test case then runs the same build
+    build = None
+    if runner.compiled and data_to_run:
+        with metrics.time_phase("compile"):
+            build = get_build_cache().get_build(runner, submission_file, get_compile_limits())
+
+    with ExitStack() as stack:
+        use_zygote = (get_config("GRADING_RUNNER") == "zygote" and hasattr(os, "fork")
+                      and runner.name == "python")
+        if use_zygote:
+            # Pays for the interpreter startup once per worker instead of once per test case
+            execute = stack.enter_context(ZygotePool(submission_file, size=workers)).run
+        else:
+            execute = partial(execute_subprocess, submission_file,
+                              build_folder=build.folder if build is not None else None)
+
+        def run_one(position, data):
+            test_case_result = run_test_case(execute, data, time_limit, limits)
+            if progress is not None:
+                progress(position, test_case_result)
+            return test_case_result
+
+        if build is not None and build.error is not None:
+            new_results = [compile_error_result(data, build.error, build.verdict)
+                           for data in data_to_run]
+            if progress is not None:
+                for position, test_case_result in zip(positions_to_run, new_results):
+                    progress(position, test_case_result)
+        elif workers > 1:
+            # Every test case runs in its own process, so threads are enough to run
+            # them side by side. map() keeps the results in the original order
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                new_results = list(executor.map(run_one, positions_to_run, data_to_run))
+        else:
+            new_results = list(map(run_one, positions_to_run, data_to_run))
+
+    results_by_position = dict(reused)
+    results_by_position.update(zip(positions_to_run, new_results))
+    test_cases.extend(results_by_position[position] for position in range(len(test_case_data)))
 
     # Count the number of Test Cases that Passed
     result["test_cases_passed"] = list(map(lambda a:a["passed"], test_cases)).count(True)
@@ -127,11 +735,12 @@ def run_test(submission_object, assignment_object):
     try:
         tc_score = result["test_cases_passed"] * 100 / result["total_test_cases"]
     except ZeroDivisionError: tc_score = 100
-    linter_score = 0
 
-    if assignment_object.linting > 0:
-        linter_results = LinterRun([submission_file], do_exit=False)
-        linter_score = normalize_linter_score(linter_results.linter.stats['global_note'])
+    if assignment_object.linting <= 0:
+        linter_score = 0
+    elif linter_score is None:
+        with metrics.time_phase("lint"):
+            linter_score = lint_submission(submission_file)
 
     tc_score_scaled = (tc_score/100) * tc_percentage
     linter_score_scaled = linter_score * linter_percentage
@@ -150,12 +759,31 @@ def run_test(submission_object, assignment_object):
     }
     result["time_limit"] = time_limit
 
-    # Write Results to a JSON File
-    json_file_path = submission_object.get_submission_result_path() # get the pathname from the model
-    with open(json_file_path, "w+") as json_file:
-        json_file.write(json.dumps(result)) # Serialize object and write to .json file
+    return result
+
+
+def test_case_event(position, result):
+    """Returns the part of a test case's result that the student is allowed to
+    see while the submission is being graded"""
+
+    event = {
+        "position": position,
+        "passed": result["passed"],
+        "verdict": result["verdict"],
+        "time_elapsed": result["time_elapsed"],
+        "visible": result["visible"]
+    }
+    if result["visible"]:
+        event.update(expected_input=result["expected_input"],
+                     expected_output=result["expected_output"],
+                     output=result["output"])
+    return event
+
+
+def summarize_results(result):
+    """Returns the part of a submission's results that the student is allowed to see"""
 
-    visible_test_cases = list(filter(lambda x: x["visible"], test_cases))
+    visible_test_cases = list(filter(lambda x: x["visible"], result["test_cases"]))
 
     return {
         "status": "success",
@@ -164,5 +792,5 @@ def run_test(submission_object, assignment_object):
         "total_test_cases": result["total_test_cases"],
         "test_cases_passed": result["test_cases_passed"],
         "visible_test_cases": visible_test_cases,
-        "time_limit": time_limit
+        "time_limit": result["time_limit"]
     }
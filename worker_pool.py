@@ -0,0 +1,70 @@
+"""Pool of worker processes shared by the linter and the zygotes
+
+A 'WorkerPool' starts up to 'size' workers when they are first needed and
+hands them to any number of threads, one thread per worker at a time. A
+worker that is no longer alive once it was used is closed and its place
+freed, waking a thread waiting for a worker so it starts a replacement.
+
+Workers are handles to processes with an 'alive' property and a close()
+method. Only the standard library is used so the zygote can import this module.
+"""
+import threading
+from contextlib import contextmanager
+
+
+class WorkerPool:
+    """Up to 'size' workers made by start_worker(), started when first needed"""
+
+    def __init__(self, size):
+        self.size = size
+        self.idle = []          # Most recently used last
+        self.started = []
+        self.condition = threading.Condition()
+
+    def start_worker(self):
+        raise NotImplementedError()
+
+    @contextmanager
+    def worker(self):
+        """Holds a worker for the block, waiting for one if all are in use"""
+
+        worker = self._acquire()
+        try:
+            yield worker
+        finally:
+            self._release(worker)
+
+    def _acquire(self):
+        with self.condition:
+            while not self.idle and len(self.started) >= self.size:
+                self.condition.wait()
+            if self.idle:
+                return self.idle.pop()
+            worker = self.start_worker()
+            self.started.append(worker)
+            return worker
+
+    def _release(self, worker):
+        with self.condition:
+            # Not started anymore once the pool was closed
+            kept = worker.alive and worker in self.started
+            if kept:
+                self.idle.append(worker)
+            elif worker in self.started:
+                self.started.remove(worker)
+            self.condition.notify()
+        if not kept:
+            worker.close()
+
+    def close(self):
+        with self.condition:
+            workers, self.started, self.idle = self.started, [], []
+            self.condition.notify_all()
+        for worker in workers:
+            worker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
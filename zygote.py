@@ -0,0 +1,357 @@
+"""Pre-forked runner for Python submissions
+
+Starting a new interpreter for every test case costs more than most student
+programs take to run, and it used to be counted as part of the run time. A
+'Zygote' is a single interpreter started once per submission. It compiles
+the submission (and imports the installed modules it uses) up front and then
+forks a fresh child for every test case, so only the student's code is timed.
+
+The zygote is run as a script and talks to the grader over its stdin/stdout:
+ - Request: a JSON header line {"input": <length>, "expected": <length or null>,
+   "input_path": <path or null>, "expected_path": <path or null>,
+   "preview": <length or null>, "limits": {...}} followed by the input bytes
+   and the expected output bytes. Payloads stored in files are passed by path
+   and read by the zygote itself
+ - Response: a JSON header line {"exit_code", "time_elapsed", "timed_out",
+   "output_exceeded", "spawn_time", "passed", "diverged", "stdout", "stderr"}
+   followed by the child's stdout and stderr bytes
+
+The zygote compares the child's output with the expected output itself, so
+only a preview of the output ever reaches the grader. A zygote that does not
+respond within RESPONSE_GRACE seconds of the time limit is killed, and
+replaced by its ZygotePool. On Linux its running child is killed with it.
+
+Every child runs under the sandbox's Limits. Apart from the standard library
+only 'sandbox' and 'worker_pool' are imported in the zygote, so it must not
+import anything else from the application.
+"""
+import ast
+import atexit
+import builtins
+import contextlib
+import ctypes
+import importlib
+import importlib.machinery
+import io
+import json
+import os
+import subprocess
+import sys
+import sysconfig
+import threading
+import signal
+import time
+import traceback
+
+from sandbox import Limits, Execution, OutputMatcher, File, communicate, get_deadline, \
+                    wait_for_child
+from worker_pool import WorkerPool
+
+ZYGOTE_SCRIPT = os.path.abspath(__file__)
+
+# Seconds past the time limit of a test case the zygote has to respond in
+RESPONSE_GRACE = 10
+
+# Folders of the standard library and installed packages, the only modules
+# imported before the submission runs in the sandbox
+TRUSTED_PATHS = sorted({path for name, path in sysconfig.get_paths().items()
+                        if name in ("stdlib", "platstdlib", "purelib", "platlib")}
+                       | {os.path.join(sysconfig.get_paths()["stdlib"], "lib-dynload")})
+
+# Modules that do something when imported
+NOT_PRELOADED = frozenset(("antigravity", "this"))
+
+PR_SET_PDEATHSIG = 1
+try:
+    prctl = ctypes.CDLL(None, use_errno=True).prctl
+except (OSError, AttributeError):   # Not Linux
+    prctl = None
+
+
+class ZygoteError(Exception):
+    """Raised when the zygote process stops responding"""
+
+
+# --------------------------------------------
+#         Grader Side
+# --------------------------------------------
+class Zygote:
+    """Handle to a zygote process running a single submission file"""
+
+    def __init__(self, submission_file, python="python"):
+        self.process = subprocess.Popen([python, ZYGOTE_SCRIPT, submission_file],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def run(self, input_data, limits, expected_output=None, preview_length=None):
+        """Runs the submission in a forked child with input_data as its stdin
+        under limits. Returns an Execution. See sandbox.run_process for
+        expected_output and preview_length"""
+
+        request = {"input": 0, "expected": None, "input_path": None, "expected_path": None,
+                   "preview": preview_length, "limits": limits.to_dict()}
+        if isinstance(input_data, File):
+            request["input_path"] = input_data.path
+            input_data = b""
+        request["input"] = len(input_data)
+
+        expected = b""
+        if isinstance(expected_output, File):
+            request["expected_path"] = expected_output.path
+        elif expected_output is not None:
+            expected = expected_output.encode()
+            request["expected"] = len(expected)
+
+        # Killing the zygote ends the read below
+        timer = None
+        if limits.time_limit:
+            timer = threading.Timer(limits.time_limit + RESPONSE_GRACE, self.process.kill)
+            timer.start()
+        try:
+            header = json.dumps(request).encode()
+            self.process.stdin.write(header + b"\n" + input_data + expected)
+            self.process.stdin.flush()
+
+            response = json.loads(self.process.stdout.readline())
+            stdout = self.process.stdout.read(response["stdout"])
+            stderr = self.process.stdout.read(response["stderr"])
+        except (OSError, ValueError) as error:
+            self.process.kill()
+            self.process.wait()
+            raise ZygoteError("Zygote for {} stopped responding".format(self.process.args[-1])) from error
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        return Execution(stdout, stderr, response["exit_code"], response["time_elapsed"],
+                         response["timed_out"], response["output_exceeded"],
+                         response["spawn_time"], response["passed"], response["diverged"])
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+
+
+class ZygotePool(WorkerPool):
+    """Up to 'size' zygotes for the same submission file, started when first needed,
+    so test cases can run side by side"""
+
+    def __init__(self, submission_file, size=1, python="python"):
+        super().__init__(size)
+        self.submission_file = submission_file
+        self.python = python
+
+    def start_worker(self):
+        return Zygote(self.submission_file, self.python)
+
+    def run(self, input_data, limits, expected_output=None, preview_length=None):
+        # A zygote that stopped responding is replaced when one is needed
+        with self.worker() as zygote:
+            return zygote.run(input_data, limits, expected_output, preview_length)
+
+
+# --------------------------------------------
+#         Zygote Side
+# --------------------------------------------
+def is_trusted_module(name):
+    """Returns True if the top level package of the module name is built in, or
+    found in the standard library or installed packages"""
+
+    name = name.partition(".")[0]
+    if name in NOT_PRELOADED:
+        return False
+    if name in sys.builtin_module_names:
+        return True
+    return importlib.machinery.PathFinder.find_spec(name, TRUSTED_PATHS) is not None
+
+
+def warm_up(source_path):
+    """Compiles the submission and imports the modules it imports at the top level.
+    Returns the code object, or the formatted error if it does not compile
+
+    Runs outside of the sandbox, so only trusted modules are imported. Anything
+    else, like a module next to the submission, is left for the child"""
+
+    with open(source_path, "rb") as source_file:
+        source = source_file.read()
+
+    try:
+        code = compile(source, source_path, "exec")
+    except (SyntaxError, ValueError):
+        return None, traceback.format_exc(limit=0)
+
+    modules = set()
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.Import):
+            modules.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            modules.add(node.module)
+    modules = [module for module in modules if is_trusted_module(module)]
+
+    # Imports must not touch the streams used to talk to the grader
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        for module in modules:
+            try:
+                importlib.import_module(module)
+            except BaseException:
+                pass   # The child will report it when the submission runs
+
+    return code, None
+
+
+def run_child(source_path, code, compile_error, limits, zygote_pid):
+    """Runs the submission in the forked child. Never returns"""
+
+    # Own process group, so any children get killed with it
+    os.setpgid(0, 0)
+    try:
+        limits.apply()
+    except OSError as error:
+        os.write(2, "Applying limits failed: {}\n".format(error).encode())
+        os._exit(1)
+    # Killed along with the zygote, which would no longer kill it at the deadline.
+    # Set after apply(), as changing the user clears it
+    if prctl is not None:
+        prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+        if os.getppid() != zygote_pid:
+            os._exit(1)
+
+    sys.stdin = sys.__stdin__ = open(0, "r", encoding="utf-8", closefd=False)
+    sys.stdout = sys.__stdout__ = open(1, "w", encoding="utf-8", closefd=False)
+    sys.stderr = sys.__stderr__ = open(2, "w", encoding="utf-8", errors="backslashreplace",
+                                       closefd=False)
+
+    exit_code = 0
+    try:
+        if compile_error:
+            sys.stderr.write(compile_error)
+            exit_code = 1
+        else:
+            exec(code, {"__name__": "__main__", "__file__": source_path,
+                        "__builtins__": builtins, "__doc__": None})
+    except SystemExit as error:
+        if error.code is None or isinstance(error.code, int):
+            exit_code = error.code or 0
+        else:
+            print(error.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException as error:
+        # Leave out the frame of this function, like the interpreter would
+        traceback.print_exception(type(error), error, error.__traceback__.tb_next)
+        exit_code = 1
+
+    try:
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(exit_code)
+
+
+def run_test_case(source_path, code, compile_error, input_data, limits,
+                  expected_output=None, preview_length=None):
+    """Forks a child to run a single test case under limits and returns its Execution"""
+
+    if isinstance(input_data, File):
+        stdin_r, stdin_w = os.open(input_data.path, os.O_RDONLY), None
+    else:
+        stdin_r, stdin_w = os.pipe()
+    stdout_r, stdout_w = os.pipe()
+    stderr_r, stderr_w = os.pipe()
+
+    start = time.time()
+    deadline = get_deadline(limits)
+    zygote_pid = os.getpid()
+    pid = os.fork()
+    if pid == 0:
+        os.dup2(stdin_r, 0)
+        os.dup2(stdout_w, 1)
+        os.dup2(stderr_w, 2)
+        for fd in (stdin_r, stdin_w, stdout_r, stdout_w, stderr_r, stderr_w):
+            if fd is not None:
+                os.close(fd)
+        run_child(source_path, code, compile_error, limits, zygote_pid)
+
+    spawn_time = time.time() - start
+    for fd in (stdin_r, stdout_w, stderr_w):
+        os.close(fd)
+    try:
+        # Also done here so kill() works even before the child got to it
+        os.setpgid(pid, pid)
+    except OSError:
+        pass
+
+    def kill():
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    matcher = OutputMatcher(expected_output) if expected_output is not None else None
+    stdout, stderr, timed_out, output_exceeded, diverged = communicate(
+        open(stdin_w, "wb", buffering=0) if stdin_w is not None else None,
+        open(stdout_r, "rb", buffering=0), open(stderr_r, "rb", buffering=0),
+        input_data, kill, deadline, limits.output, matcher, preview_length)
+    passed = None
+    if matcher is not None:
+        passed = matcher.finish()
+        matcher.close()
+
+    exit_code, killed_at_deadline = wait_for_child(pid, deadline, kill)
+    time_elapsed = time.time() - start
+
+    return Execution(stdout, stderr, exit_code, time_elapsed,
+                     timed_out or killed_at_deadline, output_exceeded, spawn_time,
+                     passed, diverged)
+
+
+def serve(source_path):
+    source_path = os.path.abspath(source_path)
+    requests = sys.stdin.buffer
+    responses = sys.stdout.buffer
+
+    # Nothing next to the zygote or the submission is imported up front
+    del sys.path[0]
+    code, compile_error = warm_up(source_path)
+
+    # Make the submission see the same environment as 'python <submission>'
+    sys.argv = [source_path]
+    sys.path.insert(0, os.path.dirname(source_path))
+
+    for header in iter(requests.readline, b""):
+        request = json.loads(header)
+        input_data = requests.read(request["input"])
+        if request["input_path"] is not None:
+            input_data = File(request["input_path"])
+
+        expected_output = None
+        if request["expected"] is not None:
+            expected_output = requests.read(request["expected"]).decode()
+        elif request["expected_path"] is not None:
+            expected_output = File(request["expected_path"])
+        execution = run_test_case(source_path, code, compile_error, input_data,
+                                  Limits.from_dict(request["limits"]), expected_output,
+                                  request["preview"])
+
+        response = {"exit_code": execution.exit_code, "time_elapsed": execution.time_elapsed,
+                    "timed_out": execution.timed_out, "output_exceeded": execution.output_exceeded,
+                    "spawn_time": execution.spawn_time, "passed": execution.passed,
+                    "diverged": execution.diverged,
+                    "stdout": len(execution.stdout), "stderr": len(execution.stderr)}
+        responses.write(json.dumps(response).encode() + b"\n" + execution.stdout + execution.stderr)
+        responses.flush()
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1])